@@ -0,0 +1,21 @@
+import timeit
+from scoobe.server import unparse_boarding_xml, compiled_boarding_template
+
+# compares the xmltodict round trip with the compiled template it was replaced by
+# usage: python -m bench.bench_boarding
+
+mid = 2000012345
+args = (mid, 8000000000 - mid, "merchant_" + str(mid) + "BOARD_TO_SHARD_0")
+number = 2000
+
+def main():
+    for region in ['US', 'EU']:
+        slow = timeit.timeit(lambda : unparse_boarding_xml(region, *args, 'Bank', 'SOME_BANK'), number=number)
+        compiled = compiled_boarding_template(region, 'Bank')
+        fast = timeit.timeit(lambda : compiled.render(mid=args[0], bemid=args[1], merchant_str=args[2],
+                                                      channel_value='SOME_BANK'), number=number)
+        print("{}: xmltodict {:.1f} us, compiled {:.1f} us ({:.0f}x)".format(
+              region, slow / number * 1e6, fast / number * 1e6, slow / fast))
+
+if __name__ == '__main__':
+    main()
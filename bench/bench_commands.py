@@ -0,0 +1,159 @@
+import os
+import sys
+import json
+import time
+from os.path import join, dirname
+from argparse import ArgumentParser
+from bench import standins
+from bench.standins import StandIns
+from scoobe import stats, http, cli
+
+# times whole commands (argument parsing and all, but not python starting up) against the stand-ins in
+# bench/standins.py, and compares them with a stored baseline
+# usage: python -m bench.bench_commands [--runs N] [--save]
+#
+# The committed bench/baseline.json holds just the round trips each command makes, which are the same on any
+# machine. Timings only mean something next to ones from the same machine, so they're compared when the baseline
+# has them (save one with --save, somewhere else with --baseline if it shouldn't be committed).
+
+default_baseline = join(dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# name : (where the entry point is, its arguments once the stand-ins are up)
+commands = { 'merchant'         : ('scoobe.server:print_merchant',
+                                   lambda s : [standins.merchant_uuid, s.target_arg]),
+             'get_reseller'     : ('scoobe.server:print_get_reseller',
+                                   lambda s : [standins.reseller_uuid, s.target_arg]),
+             'provision_device' : ('scoobe.server:provision',
+                                   lambda s : [standins.serial, standins.cpuid, s.target_arg, standins.merchant_uuid]),
+             'device_info'      : ('scoobe.device:print_info',
+                                   lambda s : []),
+             'wait_text'        : ('scoobe.ui:wait_text',
+                                   lambda s : ['Next', '--timeout', '5']) }
+
+def entry_point(spec):
+    module_name, function_name = spec.split(':')
+    __import__(module_name)
+    return getattr(sys.modules[module_name], function_name)
+
+# the commands write to stdout and stderr (their printers hold on to sys.stderr), so quiet the file descriptors
+class Silenced:
+
+    def __enter__(self):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        self.saved = [ os.dup(1), os.dup(2) ]
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+        os.close(devnull)
+
+    def __exit__(self, type, value, traceback):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(self.saved[0], 1)
+        os.dup2(self.saved[1], 2)
+        for fd in self.saved:
+            os.close(fd)
+
+# one run of a command, as if it were its own process: returns (seconds, counts)
+def run_once(name, function, args):
+    sys.argv = [name] + args
+    # each process logs in for itself
+    http._cookies.clear()
+
+    with stats.counted() as counts:
+        began = time.perf_counter()
+        try:
+            function()
+        except SystemExit as ex:
+            if ex.code:
+                raise ValueError("{} exited with {}".format(name, ex.code))
+        seconds = time.perf_counter() - began
+    return seconds, counts
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def measure(name, function, args, runs):
+    run_once(name, function, args)
+
+    times = []
+    for i in range(runs):
+        seconds, counts = run_once(name, function, args)
+        times.append(seconds)
+
+    ordered = sorted(times)
+    return { 'runs'       : runs,
+             'p50_ms'     : round(percentile(ordered, 0.50) * 1000, 3),
+             'p95_ms'     : round(percentile(ordered, 0.95) * 1000, 3),
+             'per_second' : round(runs / sum(times), 1),
+             # these shouldn't change from run to run, or go up without a good reason
+             'round_trips' : { k : v for k, v in counts.items()
+                               if v and k in ['tunnels', 'mysql_connections', 'sql_statements', 'sql_round_trips',
+                                              'http_requests', 'logins', 'adb_calls'] } }
+
+# what got slower by more than `tolerance` (a fraction), or started making more round trips
+def regressions(results, baseline, tolerance):
+    found = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]
+        if 'p50_ms' in before and result['p50_ms'] > before['p50_ms'] * (1 + tolerance):
+            found.append("{}: p50 {} ms, was {} ms".format(name, result['p50_ms'], before['p50_ms']))
+        for kind, count in result['round_trips'].items():
+            if count > before['round_trips'].get(kind, 0):
+                found.append("{}: {} {}, was {}".format(name, count, kind, before['round_trips'].get(kind, 0)))
+    return found
+
+def main():
+    parser = ArgumentParser(description="Time scoobe commands against local stand-ins for mysql, http and adb")
+    parser.add_argument('-r', '--runs', type=int, default=20, help="runs per command (default: 20)")
+    parser.add_argument('-c', '--commands', nargs='+', choices=list(commands), default=list(commands),
+                        help="which commands (default: all)")
+    parser.add_argument('-b', '--baseline', type=str, default=default_baseline,
+                        help="where the baseline is kept (default: bench/baseline.json)")
+    parser.add_argument('-t', '--tolerance', type=float, default=0.25,
+                        help="how much slower than the baseline is a regression (default: 0.25, i.e. 25%%)")
+    parser.add_argument('-s', '--save', action='store_true', help="make these results the baseline")
+    args = parser.parse_args()
+
+    real_target_from_arg = cli.target_from_arg
+    results = {}
+    with StandIns() as stand_ins:
+
+        # the commands parse the stand-ins' snapshot path into a target, this makes it the one with http
+        cli.target_from_arg = lambda value : (stand_ins.target if value == stand_ins.target_arg
+                                              else real_target_from_arg(value))
+        try:
+            for name in args.commands:
+                # imported now so that they find the fake adb
+                function = entry_point(commands[name][0])
+                with Silenced():
+                    results[name] = measure(name, function, commands[name][1](stand_ins), args.runs)
+                print(json.dumps(dict(command=name, **results[name])))
+        finally:
+            cli.target_from_arg = real_target_from_arg
+
+    if args.save:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+        print("Saved as the baseline in {}".format(args.baseline), file=sys.stderr)
+        return
+
+    try:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    except OSError:
+        print("No baseline to compare with at {} (make one with --save)".format(args.baseline), file=sys.stderr)
+        sys.exit(2)
+
+    found = regressions(results, baseline, args.tolerance)
+    for regression in found:
+        print(regression, file=sys.stderr)
+    if found:
+        sys.exit(1)
+    print("No regressions against {}".format(args.baseline), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
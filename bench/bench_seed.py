@@ -0,0 +1,28 @@
+import random
+import timeit
+from types import SimpleNamespace
+from scoobe.seed import seed_plan, seed_merchant_devices
+
+# how fast seed makes up its dataset, before anything is sent to a server
+# (the per-phase timings that seed prints cover the server side)
+# usage: python -m bench.bench_seed
+
+sizes = [ (3, 30, 60), (10, 1000, 10000), (50, 10000, 100000) ]
+number = 3
+
+def generate(resellers, merchants, devices, rng):
+    plan = seed_plan(resellers, merchants, devices, rng=rng)
+    merchant_cts = [ (SimpleNamespace(id='M{:012d}'.format(index), reseller_db_id=reseller_index), device_ct)
+                     for reseller_index, x in enumerate(plan)
+                     for index, device_ct in enumerate(x.devices_per_merchant) ]
+    return seed_merchant_devices(merchant_cts, rng=rng)
+
+def main():
+    for resellers, merchants, devices in sizes:
+        rng = random.Random(0)
+        seconds = timeit.timeit(lambda : generate(resellers, merchants, devices, rng), number=number) / number
+        print("{} resellers, {} merchants, {} devices: {:.1f} ms ({:.0f} devices per second)".format(
+              resellers, merchants, devices, seconds * 1000, devices / seconds))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+#!/bin/sh
+# answers the adb calls that device_info and wait_text make, as an attached mini that has finished booting
+# (see bench/standins.py, which puts this on PATH as `adb`)
+
+case "$*" in
+    "get-serialno")
+        echo "C030UQ00000001"
+        ;;
+    "devices")
+        printf 'List of devices attached\nC030UQ00000001\tdevice\n'
+        ;;
+    "shell getprop sys.boot_completed")
+        echo "1"
+        ;;
+    "shell getprop")
+        echo "[ro.boot.serialno]: [C030UQ00000001]"
+        echo "[ro.serialno]: [C030UQ00000001]"
+        echo "[ro.boot.cpuid]: [0123456789abcdef0123456789abcdef]"
+        echo "[sys.boot_completed]: [1]"
+        ;;
+    "shell mmc_access r_yj3_target")
+        echo "YJ3 target: dev1:dev1.dev.clover.com"
+        ;;
+    "shell cat /pip/CLOVER_TARGET")
+        echo "dev1"
+        ;;
+    "shell cat /pip/CLOVER_CLOUD_URL")
+        echo "http://dev1.dev.clover.com"
+        ;;
+    "shell uiautomator dump /dev/tty")
+        printf '<?xml version="1.0" encoding="UTF-8"?><hierarchy rotation="0">'
+        printf '<node text="Pick Language" resource-id="" content-desc="" clickable="false" bounds="[0,0][100,50]">'
+        printf '<node text="Next" resource-id="com.clover:id/next" content-desc="" clickable="true" '
+        printf 'bounds="[0,60][100,100]"/></node></hierarchy>'
+        echo "UI hierchary dumped to: /dev/tty"
+        ;;
+    *)
+        echo "fake adb doesn't know: $*" >&2
+        exit 1
+        ;;
+esac
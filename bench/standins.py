@@ -0,0 +1,132 @@
+import os
+import gzip
+import json
+import shutil
+import tempfile
+import threading
+from os.path import join, dirname
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from scoobe.server import provision_uri
+from scoobe.snapshot import Snapshot, snapshot_suffix
+
+# Local stand-ins for what scoobe talks to, so that commands can be timed without dev1 or a device:
+#   - mysql: an in-memory sqlite db (a Snapshot's) holding just enough rows for the benchmarked commands
+#   - http: a server on 127.0.0.1 that logs anybody in and answers the /v3 calls they make
+#   - adb: bench/fake_adb.sh, put on PATH as `adb`
+
+serial = 'C030UQ00000001'
+cpuid = '0123456789abcdef0123456789abcdef'
+merchant_uuid = 'BENCHMERCHANT'
+reseller_uuid = 'BENCHRESELLER'
+plan_uuid = 'BENCHPLANAAAA'
+
+tables = { 'reseller'          : { 'columns' : ['id', 'uuid', 'name', 'parent_id'],
+                                   'rows'    : [ [1, reseller_uuid, 'bench', None] ] },
+           'reseller_channels' : { 'columns' : ['reseller_id', 'chain_agent', 'chain_bank', 'marker', 'sysprin'],
+                                   'rows'    : [ [1, None, 'SOME_BANK', None, None] ] },
+           'merchant'          : { 'columns' : ['id', 'uuid', 'reseller_id', 'merchant_plan_id'],
+                                   'rows'    : [ [3, merchant_uuid, 1, 5] ] },
+           'merchant_plan'     : { 'columns' : ['id', 'uuid'],
+                                   'rows'    : [ [5, plan_uuid] ] },
+           'device_provision'  : { 'columns' : ['id', 'serial_number', 'merchant_id', 'reseller_id'],
+                                   'rows'    : [ [9, serial, 3, 1] ] },
+           'authtoken'         : { 'columns' : ['id', 'uuid', 'deleted_time'],
+                                   'rows'    : [ [11, 'token', None] ] },
+           'authtoken_uri'     : { 'columns' : ['authtoken_id', 'uri'],
+                                   'rows'    : [ [11, provision_uri] ] } }
+
+reseller_response = { 'id' : reseller_uuid, 'name' : 'bench', 'supportPhone' : '555', 'locale' : 'en_US' }
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self, code, body=None, headers={}):
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(code)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def do_POST(self):
+        self._read_body()
+        if self.path == '/cos/v1/dashboard/internal/login':
+            self._reply(200, {}, { 'Set-Cookie' : 'internalSession=bench; Path=/' })
+        else:
+            self._reply(404)
+
+    def do_GET(self):
+        if self.path == '/v3/resellers/' + reseller_uuid:
+            self._reply(200, reseller_response)
+        else:
+            self._reply(404)
+
+    def do_PUT(self):
+        self._read_body()
+        if self.path.startswith('/v3/partner/pp/merchants/') and self.path.endswith('/provision'):
+            self._reply(200, {})
+        else:
+            self._reply(404)
+
+    def log_message(self, *args):
+        pass
+
+# a Snapshot whose GETs go to the stand-in http server instead of being read from the file
+class BenchTarget(Snapshot):
+
+    def __init__(self, path, http_port):
+        super().__init__(path)
+        self._http_port = http_port
+        self._name = 'the bench stand-ins'
+
+    def get_stored_response(self, path):
+        return None
+
+    def get_hostname(self):
+        return '127.0.0.1'
+
+    def get_http_port(self):
+        return self._http_port
+
+    def get_hypertext_protocol(self):
+        return 'http'
+
+# starts the stand-ins (and points PATH and SCOOBE_HOME at them, so do this before importing scoobe.device or
+# scoobe.ui, they find adb when they're imported), stops them on exit
+class StandIns:
+
+    def __enter__(self):
+        self.dir = tempfile.mkdtemp(prefix='scoobe_bench')
+
+        # what the commands remember between runs (and their latency records) goes here, not in ~/.scoobe
+        self.environ = dict(os.environ)
+        os.environ['SCOOBE_HOME'] = join(self.dir, 'home')
+        os.environ['SCOOBE_LATENCY'] = '0'
+
+        shutil.copy(join(dirname(os.path.abspath(__file__)), 'fake_adb.sh'), join(self.dir, 'adb'))
+        os.chmod(join(self.dir, 'adb'), 0o755)
+        os.environ['PATH'] = self.dir + os.pathsep + os.environ.get('PATH', '')
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+        path = join(self.dir, 'bench' + snapshot_suffix)
+        with gzip.open(path, 'wt') as snapshot_file:
+            json.dump({ 'source' : 'bench', 'taken' : 'now', 'tables' : tables, 'endpoints' : {} }, snapshot_file)
+        self.target = BenchTarget(path, self.server.server_address[1])
+        self.target_arg = path
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.server.shutdown()
+        self.server.server_close()
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.dir, ignore_errors=True)
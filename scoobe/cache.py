@@ -0,0 +1,85 @@
+import os
+import json
+import time
+import fcntl
+import tempfile
+import threading
+from os.path import expanduser, join, dirname
+from contextlib import contextmanager
+
+# each snac is its own short-lived process, so anything worth remembering between them lives on disk
+# (set SCOOBE_HOME to put it somewhere other than ~/.scoobe)
+def scoobe_dir(*parts):
+    path = join(os.environ.get('SCOOBE_HOME', join(expanduser('~'), '.scoobe')), *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+# write to a temp file and rename it into place so that a concurrent reader never sees half a file
+def atomic_write(path, data, mode='w'):
+    fd, temp_path = tempfile.mkstemp(dir=dirname(path), prefix='.' + os.path.basename(path))
+    try:
+        with os.fdopen(fd, mode) as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+# a json file full of { key : { 'time' : <epoch seconds>, 'value' : <something json-friendly> } }
+# entries older than ttl seconds are treated as missing (ttl=None means they never expire)
+class Cache:
+
+    # so that threads in one process don't clobber each other's updates
+    _lock = threading.Lock()
+
+    def __init__(self, name, ttl=None):
+        self.name = name
+        self.ttl = ttl
+
+    # caches are created at import time, so don't touch the disk until one is used
+    @property
+    def path(self):
+        return join(scoobe_dir('cache'), self.name + '.json')
+
+    def _load(self):
+        try:
+            with open(self.path) as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+
+    # read-modify-write happens under this, so that concurrent commands (and the sampler's background refresh)
+    # don't lose each other's entries
+    @contextmanager
+    def _locked(self):
+        with Cache._lock, open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _fresh(self, entry, now):
+        return self.ttl is None or now - entry['time'] < self.ttl
+
+    def get(self, key):
+        entry = self._load().get(key)
+        if entry and self._fresh(entry, time.time()):
+            return entry['value']
+        return None
+
+    def put(self, key, value):
+        with self._locked():
+            now = time.time()
+
+            # drop expired entries while we're here
+            entries = { k : v for k, v in self._load().items() if self._fresh(v, now) }
+            entries[key] = { 'time' : now, 'value' : value }
+
+            atomic_write(self.path, json.dumps(entries))
+
+    def invalidate(self, key):
+        with self._locked():
+            entries = self._load()
+            if entries.pop(key, None) is not None:
+                atomic_write(self.path, json.dumps(entries))
@@ -0,0 +1,525 @@
+import io
+import os
+import re
+import sys
+import gzip
+import json
+import time
+import base64
+import atexit
+import decimal
+import hashlib
+import datetime
+import threading
+import requests
+import sh
+from scoobe.cache import atomic_write
+from scoobe.common import ServerTarget, UserPass
+
+# Records what a command said to servers and devices, so it can be run again without them, e.g.
+#
+#   SCOOBE_RECORD=provision.json.gz provision_device C030UQ00000001 ... dev1 ...
+#   SCOOBE_REPLAY=provision.json.gz provision_device C030UQ00000001 ... dev1 ...
+#
+# (or `--record FILE` / `--replay FILE` on any command that parses its arguments).
+#
+# A cassette holds every http exchange, every sql statement (with all of its result sets) and every adb call (with
+# its output), in the order they happened, and an index from each request to the interactions that answered it.
+# When a request is made more than once, replay hands back its answers in the order they were recorded, and keeps
+# handing back the last one after that. A request that isn't in the cassette is an error, not a trip to the server.
+#
+# With SCOOBE_REPLAY_LATENCY=1 (or --replay-latency) each answer takes as long as it did when it was recorded.
+#
+# What isn't kept: request bodies and headers (only a hash of them, they carry passwords and cookies), the values
+# of cookies that responses set (the login's is a live session, replay gets a placeholder), mysql passwords, and the
+# output of adb calls made with _bg or _iter (those run for real, even when replaying).
+#
+# Targets named on the command line are recorded too, so replaying doesn't need their ~/.ssh/config entry or
+# properties file.
+
+version = 1
+
+class Cassette:
+
+    def __init__(self, path, mode, latency=False):
+        self.path = os.path.abspath(path)
+        self.mode = mode
+        self.latency = latency
+        self.lock = threading.Lock()
+        if mode == 'replay':
+            opener = gzip.open if self.path.endswith('.gz') else open
+            with opener(self.path, 'rt') as cassette_file:
+                self.data = json.load(cassette_file)
+            if self.data.get('version') != version:
+                raise ValueError("{} is a version {} cassette, this is version {}".format(
+                                 path, self.data.get('version'), version))
+            # key : how many of its interactions have been replayed
+            self.played = {}
+        else:
+            self.data = { 'version' : version, 'targets' : {}, 'interactions' : [], 'index' : {} }
+
+    @staticmethod
+    def key(kind, request):
+        canonical = json.dumps([kind, request], sort_keys=True, default=str)
+        return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+    def record(self, kind, request, description, seconds, response=None, error=None):
+        interaction = { 'kind' : kind, 'request' : description, 'seconds' : round(seconds, 6) }
+        if error is not None:
+            interaction['error'] = error
+        else:
+            interaction['response'] = response
+        key = Cassette.key(kind, request)
+        with self.lock:
+            self.data['index'].setdefault(key, []).append(len(self.data['interactions']))
+            self.data['interactions'].append(interaction)
+
+    def next(self, kind, request, description):
+        key = Cassette.key(kind, request)
+        with self.lock:
+            ids = self.data['index'].get(key)
+            if not ids:
+                raise ValueError("{} isn't in the cassette {}: {}".format(kind, self.path, description))
+            played = self.played.get(key, 0)
+            self.played[key] = played + 1
+            return self.data['interactions'][ids[min(played, len(ids) - 1)]]
+
+    def save(self):
+        text = json.dumps(self.data, indent=1)
+        if self.path.endswith('.gz'):
+            atomic_write(self.path, gzip.compress(text.encode('utf-8')), mode='wb')
+        else:
+            atomic_write(self.path, text)
+
+active = None
+
+def start(path, mode, latency=False):
+    global active
+    active = Cassette(path, mode, latency)
+    if mode == 'record':
+        atexit.register(_save_at_exit, active)
+
+def _save_at_exit(cassette):
+    try:
+        cassette.save()
+    except OSError as ex:
+        print("Couldn't write the cassette {} ({})".format(cassette.path, ex), file=sys.stderr)
+
+def recording():
+    return active is not None and active.mode == 'record'
+
+def replaying():
+    return active is not None and active.mode == 'replay'
+
+# makes a request through the cassette:
+# - not recording or replaying: perform() and return what it returns
+# - recording: perform(), and keep save(its result) (or save_error(what it raised)) in the cassette
+# - replaying: return load(what was saved) (or raise load_error(what was saved))
+def play(kind, request, description, perform, save, load, save_error=None, load_error=None):
+    if active is None:
+        return perform()
+
+    if active.mode == 'replay':
+        interaction = active.next(kind, request, description)
+        if active.latency:
+            time.sleep(interaction['seconds'])
+        if 'error' in interaction:
+            raise (load_error or _load_error)(interaction['error'])
+        return load(interaction['response'])
+
+    began = time.perf_counter()
+    try:
+        result = perform()
+    except Exception as ex:
+        if save_error is None:
+            raise
+        active.record(kind, request, description, time.perf_counter() - began, error=save_error(ex))
+        raise
+    active.record(kind, request, description, time.perf_counter() - began, response=save(result))
+    return result
+
+def _load_error(saved):
+    return ValueError(saved['message'])
+
+def _save_any_error(ex):
+    return { 'message' : '{}: {}'.format(type(ex).__name__, ex) }
+
+# values that json can't hold are tagged so that they come back as what they were
+def encode(value):
+    if isinstance(value, datetime.datetime):
+        return { '$datetime' : value.isoformat() }
+    if isinstance(value, datetime.date):
+        return { '$date' : value.isoformat() }
+    if isinstance(value, datetime.time):
+        return { '$time' : value.isoformat() }
+    if isinstance(value, datetime.timedelta):
+        return { '$timedelta' : value.total_seconds() }
+    if isinstance(value, decimal.Decimal):
+        return { '$decimal' : str(value) }
+    if isinstance(value, (bytes, bytearray)):
+        return { '$bytes' : base64.b64encode(value).decode('ascii') }
+    return value
+
+def decode(value):
+    if not isinstance(value, dict) or len(value) != 1:
+        return value
+    tag, data = next(iter(value.items()))
+    if tag == '$datetime':
+        return datetime.datetime.fromisoformat(data)
+    if tag == '$date':
+        return datetime.date.fromisoformat(data)
+    if tag == '$time':
+        return datetime.time.fromisoformat(data)
+    if tag == '$timedelta':
+        return datetime.timedelta(seconds=data)
+    if tag == '$decimal':
+        return decimal.Decimal(data)
+    if tag == '$bytes':
+        return base64.b64decode(data)
+    return value
+
+def _encode_row(row):
+    if isinstance(row, dict):
+        return { k : encode(v) for k, v in row.items() }
+    return [ encode(v) for v in row ]
+
+def _decode_row(row):
+    if isinstance(row, dict):
+        return { k : decode(v) for k, v in row.items() }
+    return tuple(decode(v) for v in row)
+
+# Targets
+
+def _recorded_value(target, getter):
+    try:
+        value = getattr(target, getter)()
+    except Exception:
+        return None
+    # keep the mysql user, not the password
+    if isinstance(value, UserPass):
+        return [value.user, '']
+    return value
+
+target_getters = [ 'get_name', 'get_cli_arg', 'get_hostname', 'get_http_port', 'get_hypertext_protocol',
+                   'get_mysql_port', 'get_db_name', 'get_admin_hostname', 'get_admin_http_port',
+                   'get_readonly_mysql_creds', 'get_readwrite_mysql_creds' ]
+
+def remember_target(value, target):
+    if recording():
+        with active.lock:
+            active.data['targets'][value] = { getter : _recorded_value(target, getter) for getter in target_getters }
+
+# what a target looked like when the cassette was recorded (None if it wasn't)
+def replayed_target(value):
+    if replaying() and value in active.data['targets']:
+        return ReplayedTarget(active.data['targets'][value])
+    return None
+
+class ReplayedTarget(ServerTarget):
+
+    def __init__(self, recorded):
+        self.recorded = recorded
+
+    def _get(self, getter):
+        value = self.recorded.get(getter)
+        if value is None:
+            raise ValueError("{} wasn't recorded for {}".format(getter, self.recorded.get('get_name')))
+        return value
+
+    def get_name(self):
+        return self._get('get_name')
+
+    def get_cli_arg(self):
+        return self._get('get_cli_arg')
+
+    def get_hostname(self):
+        return self._get('get_hostname')
+
+    def get_http_port(self):
+        return self._get('get_http_port')
+
+    def get_hypertext_protocol(self):
+        return self._get('get_hypertext_protocol')
+
+    def get_mysql_port(self):
+        return self._get('get_mysql_port')
+
+    def get_db_name(self):
+        return self._get('get_db_name')
+
+    def get_admin_hostname(self):
+        return self._get('get_admin_hostname')
+
+    def get_admin_http_port(self):
+        return self._get('get_admin_http_port')
+
+    def get_readonly_mysql_creds(self):
+        return UserPass(*self._get('get_readonly_mysql_creds'))
+
+    def get_readwrite_mysql_creds(self):
+        return UserPass(*self._get('get_readwrite_mysql_creds'))
+
+# Http
+
+# response headers that are credentials, they're left out
+secret_headers = [ 'authorization', 'proxy-authorization', 'cookie' ]
+
+# each cookie keeps its name and attributes, but not its value
+def _placeholder_cookies(set_cookie):
+    return re.sub(r'(^|,\s*)([^=;,\s]+)=[^;,]*', r'\1\2=replayed', set_cookie)
+
+def _safe_headers(headers):
+    result = {}
+    for name, value in headers.items():
+        if name.lower() in secret_headers:
+            continue
+        result[name] = _placeholder_cookies(value) if name.lower() == 'set-cookie' else value
+    return result
+
+def _save_response(response):
+    return { 'status'  : response.status_code,
+             'reason'  : response.reason,
+             'url'     : response.url,
+             'headers' : _safe_headers(response.headers),
+             'content' : base64.b64encode(response.content).decode('ascii') }
+
+# `kwargs` are what the request would have been sent with
+def _load_response(saved, method, endpoint, kwargs):
+    response = requests.models.Response()
+    response.status_code = saved['status']
+    response.reason = saved['reason']
+    response.url = saved['url']
+    response.headers = requests.structures.CaseInsensitiveDict(saved['headers'])
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    response._content = base64.b64decode(saved['content'])
+    response.request = requests.Request(method.upper(), endpoint, **kwargs).prepare()
+    return response
+
+# sends (or replays) verb(endpoint, **kwargs)
+def http_request(verb, endpoint, kwargs):
+    method = getattr(verb, '__name__', 'http')
+    body = kwargs.get('json', kwargs.get('data'))
+    body_hash = hashlib.sha1(json.dumps(body, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    request = [ method, endpoint, body_hash ]
+    return play('http', request, '{} {}'.format(method.upper(), endpoint),
+                lambda : verb(endpoint, **kwargs),
+                _save_response,
+                lambda saved : _load_response(saved, method, endpoint, kwargs),
+                save_error=_save_any_error)
+
+# Sql
+
+# runs statements on a real cursor (if there is one) and keeps every result set, so that it can hand them out
+# in the same way whether they came from mysql or from the cassette
+class _CassetteCursor:
+
+    def __init__(self, cursor=None):
+        self.cursor = cursor
+        self.sets = [ { 'rows' : [], 'rowcount' : -1, 'lastrowid' : None } ]
+        self.current = 0
+        self.position = 0
+
+    def _capture(self):
+        sets = []
+        while True:
+            rows = self.cursor.fetchall() if self.cursor.description else []
+            sets.append({ 'rows'      : [ _encode_row(row) for row in rows ],
+                          'rowcount'  : self.cursor.rowcount,
+                          'lastrowid' : self.cursor.lastrowid })
+            nextset = getattr(self.cursor, 'nextset', None)
+            if nextset is None or not nextset():
+                return sets
+
+    def _play(self, request, description, run):
+        def perform():
+            run()
+            return self._capture()
+        sets = play('sql', request, description, perform, lambda sets : sets, lambda sets : sets,
+                    save_error=_save_any_error)
+        self.sets = [ dict(s, rows=[ _decode_row(row) for row in s['rows'] ]) for s in sets ]
+        self.current = 0
+        self.position = 0
+
+    def execute(self, sql, args=None):
+        self._play([ sql, args ], sql.strip(),
+                   lambda : self.cursor.execute(sql) if args is None else self.cursor.execute(sql, args))
+
+    def executemany(self, sql, rows):
+        rows = list(rows)
+        self._play([ sql, [ _encode_row(row) for row in rows ] ], '{} (x {})'.format(sql.strip(), len(rows)),
+                   lambda : self.cursor.executemany(sql, rows))
+
+    @property
+    def description(self):
+        return self.cursor.description if self.cursor is not None else None
+
+    @property
+    def rowcount(self):
+        return self.sets[self.current]['rowcount']
+
+    @property
+    def lastrowid(self):
+        return self.sets[self.current]['lastrowid']
+
+    def fetchone(self):
+        rows = self.sets[self.current]['rows']
+        if self.position >= len(rows):
+            return None
+        self.position += 1
+        return rows[self.position - 1]
+
+    def fetchall(self):
+        rows = self.sets[self.current]['rows']
+        remaining = rows[self.position:]
+        self.position = len(rows)
+        return remaining
+
+    def nextset(self):
+        if self.current + 1 >= len(self.sets):
+            return None
+        self.current += 1
+        self.position = 0
+        return True
+
+    def close(self):
+        if self.cursor is not None:
+            self.cursor.close()
+
+# a db connection whose statements go through the cassette (db=None when replaying, there's nothing to talk to)
+class CassetteConnection:
+
+    def __init__(self, db=None):
+        self.db = db
+
+    def cursor(self):
+        return _CassetteCursor(self.db.cursor() if self.db is not None else None)
+
+    def commit(self):
+        if self.db is not None:
+            self.db.commit()
+
+    def rollback(self):
+        if self.db is not None:
+            self.db.rollback()
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+
+# Adb
+
+def _words(args):
+    words = []
+    for arg in args:
+        words += [ str(x) for x in arg ] if isinstance(arg, (list, tuple)) else [str(arg)]
+    return words
+
+# what a replayed command returns, enough like sh's RunningCommand for the ways scoobe uses one
+class ReplayedOutput:
+
+    def __init__(self, stdout, stderr, exit_code):
+        self.stdout = stdout
+        self.stderr = stderr
+        self.exit_code = exit_code
+
+    def wait(self):
+        return self
+
+    def __str__(self):
+        return self.stdout.decode('utf-8', 'replace')
+
+    def __iter__(self):
+        return iter(str(self).splitlines(keepends=True))
+
+    def __len__(self):
+        return len(str(self))
+
+    def __eq__(self, other):
+        return str(self) == other
+
+    def __contains__(self, item):
+        return item in str(self)
+
+def _b64(data):
+    return base64.b64encode(data or b'').decode('ascii')
+
+# (stdout, stderr, exit code) of a finished command
+# sh 1.x hands back a RunningCommand, sh 2.x just its output (it raises for a failed exit code, so that's 0)
+def _command_output(result):
+    if isinstance(result, str):
+        return result.encode('utf-8'), b'', 0
+    if isinstance(result, bytes):
+        return result, b'', 0
+    return result.stdout, result.stderr, result.exit_code
+
+def _save_command_error(ex):
+    if isinstance(ex, sh.ErrorReturnCode):
+        return { 'message'   : str(ex),
+                 'exit_code' : ex.exit_code,
+                 'full_cmd'  : ex.full_cmd,
+                 'stdout'    : _b64(ex.stdout),
+                 'stderr'    : _b64(ex.stderr) }
+    return _save_any_error(ex)
+
+def _load_command_error(saved):
+    if 'exit_code' not in saved:
+        return _load_error(saved)
+    # sh makes an ErrorReturnCode_N class for each exit code N, so `except sh.ErrorReturnCode_1` still works
+    error_class = getattr(sh, 'ErrorReturnCode_{}'.format(saved['exit_code']))
+    return error_class(saved['full_cmd'], base64.b64decode(saved['stdout']), base64.b64decode(saved['stderr']))
+
+# an sh command whose calls go through the cassette (bake and subcommands too)
+class RecordedCommand:
+
+    def __init__(self, command, words=None):
+        self._command = command
+        self._words = words if words is not None else [ os.path.basename(str(command).split(' ')[0]) ]
+
+    def __call__(self, *args, **kwargs):
+        # these hand back a process that's still running, there's nothing to record yet
+        if active is None or kwargs.get('_bg') or kwargs.get('_iter'):
+            return self._command(*args, **kwargs)
+
+        words = self._words + _words(args)
+        out = kwargs.get('_out')
+        if out is not None and not hasattr(out, 'write'):
+            out = None
+
+        # output that goes to a file object (screencaps) is caught on its way there, so it can be replayed into it
+        def perform():
+            if out is None:
+                return self._command(*args, **kwargs)
+            caught = io.BytesIO()
+            result = self._command(*args, **dict(kwargs, _out=caught))
+            out.write(caught.getvalue())
+            _, stderr, exit_code = _command_output(result)
+            return ReplayedOutput(caught.getvalue(), stderr, exit_code)
+
+        def save(result):
+            stdout, stderr, exit_code = _command_output(result)
+            return { 'stdout' : _b64(stdout), 'stderr' : _b64(stderr), 'exit_code' : exit_code }
+
+        def load(saved):
+            stdout = base64.b64decode(saved['stdout'])
+            if out is not None:
+                out.write(stdout)
+            return ReplayedOutput(stdout, base64.b64decode(saved['stderr']), saved['exit_code'])
+
+        return play('adb', words, ' '.join(words), perform, save, load,
+                    save_error=_save_command_error, load_error=_load_command_error)
+
+    def bake(self, *args, **kwargs):
+        return RecordedCommand(self._command.bake(*args, **kwargs), self._words + _words(args))
+
+    def __getattr__(self, name):
+        return RecordedCommand(getattr(self._command, name), self._words + [name])
+
+    def __str__(self):
+        return str(self._command)
+
+if os.environ.get('SCOOBE_REPLAY'):
+    start(os.environ['SCOOBE_REPLAY'], 'replay', latency=os.environ.get('SCOOBE_REPLAY_LATENCY') == '1')
+elif os.environ.get('SCOOBE_RECORD'):
+    start(os.environ['SCOOBE_RECORD'], 'record')
+    # a command's helper processes (the sampler's refresh, say) would overwrite the cassette with theirs
+    del os.environ['SCOOBE_RECORD']
@@ -3,6 +3,9 @@ import os
 import re
 import sys
 import select
+import io
+import csv
+import itertools
 import json
 from collections import namedtuple
 from argparse import ArgumentParser, RawTextHelpFormatter, FileType
@@ -10,6 +13,8 @@ from abc import ABC, abstractmethod
 from enum import Enum
 from scoobe.ssh import SshConfig
 from scoobe.properties import LocalServer
+from scoobe.snapshot import Snapshot, is_snapshot
+from scoobe import trace, stats, latency, prometheus, cassette
 from scoobe.common import StatusPrinter, Indent
 
 # used when generating classes (namedtuples) to store results
@@ -66,15 +71,60 @@ class Target(_IParseable):
                     the ssh host of server (specified in ~/.ssh/config)
                 if server is local:
                     the path to its *.properties file
+                if reading from a snapshot (see the snapshot command):
+                    the path to the *.snapshot.json.gz file
+                    (it only holds reference data, so commands about merchants
+                    or devices, like merchant and merchant_apps, and
+                    commands that change anything, need a server)
                 '''))
 
     def get_val(self, parser):
+        return target_from_arg(getattr(parser, field_name(self)))
 
-        value = getattr(parser, field_name(self))
-        if os.path.exists(value):
-            return LocalServer(value)
-        else:
-            return SshConfig(value)
+class SourceTarget(_IParseable):
+
+    def preparse(self, parser):
+        parser.add_argument(field_name(self), type=str,
+                            help="the server to copy from (an ssh host, or the path to its *.properties file)")
+
+    def get_val(self, parser):
+        return target_from_arg(getattr(parser, field_name(self)))
+
+class DestTarget(_IParseable):
+
+    def preparse(self, parser):
+        parser.add_argument(field_name(self), type=str,
+                            help="the server to copy to (an ssh host, or the path to its *.properties file)")
+
+    def get_val(self, parser):
+        return target_from_arg(getattr(parser, field_name(self)))
+
+class OtherTarget(_IParseable):
+
+    def preparse(self, parser):
+        parser.add_argument(field_name(self), type=str,
+                            help="another server (an ssh host, or the path to its *.properties file)")
+
+    def get_val(self, parser):
+        return target_from_arg(getattr(parser, field_name(self)))
+
+# the inverse of ServerTarget.get_cli_arg
+def target_from_arg(value):
+    # a snapshot is a file already, it doesn't need a cassette to stand in for it
+    if is_snapshot(value):
+        return Snapshot(value)
+
+    # a replayed target is what it was when the cassette was recorded, its ssh config entry needn't exist here
+    replayed = cassette.replayed_target(value)
+    if replayed is not None:
+        return replayed
+
+    if os.path.exists(value):
+        target = LocalServer(value)
+    else:
+        target = SshConfig(value)
+    cassette.remember_target(value, target)
+    return target
 
 class Code(_IParseable):
 
@@ -156,6 +206,16 @@ class Reseller(_IParseable):
         throw_if_not_id_or_uuid(value)
         return value
 
+class OtherReseller(_IParseable):
+
+    def preparse(self, parser):
+        parser.add_argument(field_name(self), type=str, help="the id or the uuid of another reseller")
+
+    def get_val(self, parser):
+        value = getattr(parser, field_name(self))
+        throw_if_not_id_or_uuid(value)
+        return value
+
 class Merchant(_IParseable):
 
     def preparse(self, parser):
@@ -226,6 +286,331 @@ class Cpuid(_IParseable):
            raise ValueError("{} doesn't look like a device cpuid".format(value))
         return value
 
+class Count(_IParseable):
+
+    def preparse(self, parser):
+        parser.add_argument('-n', '--'+field_name(self), type=int, default=10, help="how many frames to capture")
+
+    def get_val(self, parser):
+        value = getattr(parser, field_name(self))
+        if value < 1:
+            raise ValueError("{} is an invalid frame count".format(value))
+        return value
+
+class FrameRate(_IParseable):
+
+    def preparse(self, parser):
+        parser.add_argument('-r', '--'+field_name(self), type=float, default=2.0,
+                            help="how many frames per second to aim for (screencap is slow, you may get fewer)")
+
+    def get_val(self, parser):
+        value = getattr(parser, field_name(self))
+        if value <= 0:
+            raise ValueError("{} is an invalid frame rate".format(value))
+        return value
+
+class Destination(_IParseable):
+
+    def preparse(self, parser):
+        parser.add_argument(field_name(self), type=str, nargs='?', default=None, help=textwrap.dedent('''\
+                a directory to write the frames to
+                (or a path ending in .zip to write them into a single archive)
+                '''))
+
+    def get_val(self, parser):
+        value = getattr(parser, field_name(self))
+        return value
+
+class VersionCodes(_IParseable):
+
+    def preparse(self, parser):
+        parser.add_argument('-c', '--'+field_name(self), action='store_true',
+                            help="show the versionCode alongside each versionName")
+
+    def get_val(self, parser):
+        value = getattr(parser, field_name(self))
+        return value
+
+class Refresh(_IParseable):
+
+    def preparse(self, parser):
+        parser.add_argument('--'+field_name(self), action='store_true',
+                            help="ignore what's cached from last time and ask the device(s) again")
+
+    def get_val(self, parser):
+        return getattr(parser, field_name(self))
+
+# the columns of a csv manifest, if it doesn't have a header row saying otherwise
+manifest_fields = ['serial', 'cpuid', 'merchant']
+
+# read rows of {'serial', 'cpuid', 'merchant'} from either json lines or csv
+# (one line at a time, so a big manifest needn't fit in memory)
+def read_manifest(manifest_file):
+    lines = iter(manifest_file)
+    first = next((line for line in lines if line.strip()), None)
+    if first is None:
+        return
+    lines = itertools.chain([first], lines)
+
+    if first.lstrip().startswith('{'):
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+        return
+
+    fields = manifest_fields
+    for index, values in enumerate(csv.reader(lines)):
+        values = [ x.strip() for x in values ]
+        if not values or values[0].startswith('#'):
+            continue
+        if index == 0 and 'serial' in [ x.lower() for x in values ]:
+            fields = [ x.lower() for x in values ]
+            continue
+        yield dict(zip(fields, values))
+
+class Manifest(_IParseable):
+
+    def preparse(self, parser):
+        parser.add_argument('-m', '--'+field_name(self), default=sys.stdin, type=FileType('r'), nargs='?',
+                            help=textwrap.dedent(
+                                """
+                                A file listing one device per line, either as csv:
+
+                                    C043UQ72330608,00000001740e21801000000007018640,TCF09QDYHEDQ8
+
+                                (columns are serial,cpuid,merchant unless a header row says otherwise)
+                                or as json lines:
+
+                                    {"serial" : "C043UQ72330608", "cpuid" : "0000...", "merchant" : "TCF09QDYHEDQ8"}
+
+                                If not specified, will try to read from stdin.
+                                """))
+
+    # rows are read (and checked) as they're used
+    def get_val(self, parser):
+        value = getattr(parser, field_name(self))
+        for row in read_manifest(value):
+            if not re.match(r'C[A-Za-z0-9]{3}[UEL][CQNOPRD][0-9]{8}$', row.get('serial') or ''):
+                raise ValueError("{} doesn't have a valid serial number".format(row))
+            if row.get('cpuid') and not re.match(r'[A-Fa-f0-9]{16,32}$', str(row['cpuid'])):
+                raise ValueError("{} doesn't have a valid cpuid".format(row))
+            if row.get('merchant') and not re.match(r'([A-Za-z0-9]{13}|[0-9]+)$', str(row['merchant'])):
+                raise ValueError("{} doesn't have a valid merchant uuid or id".format(row))
+            yield row
+
+class Concurrency(_IParseable):
+
+    def preparse(self, parser):
+        parser.add_argument('-c', '--'+field_name(self), type=int, default=4,
+                            help="how many requests may be in flight at once (default: 4)")
+
+    def get_val(self, parser):
+        value = getattr(parser, field_name(self))
+        if value < 1:
+            raise ValueError("{} is an invalid concurrency limit".format(value))
+        return value
+
+class RateLimit(_IParseable):
+
+    def preparse(self, parser):
+        parser.add_argument('-r', '--'+field_name(self), type=float, default=None,
+                            help="at most this many requests per second (default: no limit)")
+
+    def get_val(self, parser):
+        value = getattr(parser, field_name(self))
+        if value is not None and value <= 0:
+            raise ValueError("{} is an invalid rate limit".format(value))
+        return value
+
+class Quantity(_IParseable):
+
+    def preparse(self, parser):
+        parser.add_argument(field_name(self), type=int, help="how many to create")
+
+    def get_val(self, parser):
+        value = getattr(parser, field_name(self))
+        if value < 1:
+            raise ValueError("{} is an invalid quantity".format(value))
+        return value
+
+class ChunkSize(_IParseable):
+
+    def preparse(self, parser):
+        parser.add_argument('-s', '--'+field_name(self), type=int, default=500,
+                            help="how many rows to write per statement (default: 500)")
+
+    def get_val(self, parser):
+        value = getattr(parser, field_name(self))
+        if value < 1:
+            raise ValueError("{} is an invalid chunk size".format(value))
+        return value
+
+SeedSizeValue = namedtuple('SeedSizeValue', 'resellers merchants devices')
+
+class SeedSize(_IParseable):
+
+    def preparse(self, parser):
+        parser.add_argument('--resellers', type=int, default=3, help="how many resellers to create (default: 3)")
+        parser.add_argument('--merchants', type=int, default=30,
+                            help="how many merchants to create, spread unevenly across the resellers (default: 30)")
+        parser.add_argument('--devices', type=int, default=60,
+                            help="how many devices to create, spread unevenly across the merchants (default: 60)")
+
+    def get_val(self, parser):
+        if parser.resellers < 1:
+            raise ValueError("{} is an invalid number of resellers".format(parser.resellers))
+        if parser.merchants < parser.resellers:
+            raise ValueError("Need at least one merchant per reseller")
+        if parser.devices < 0:
+            raise ValueError("{} is an invalid number of devices".format(parser.devices))
+        return SeedSizeValue(parser.resellers, parser.merchants, parser.devices)
+
+class RandomSeed(_IParseable):
+
+    def preparse(self, parser):
+        parser.add_argument('--seed', dest=field_name(self), type=int, default=None,
+                            help="seed the random choices with this, to make the same data again (default: random)")
+
+    def get_val(self, parser):
+        return getattr(parser, field_name(self))
+
+class Force(_IParseable):
+
+    def preparse(self, parser):
+        parser.add_argument('-f', '--'+field_name(self), action='store_true',
+                            help="do it even though it looks like a bad idea")
+
+    def get_val(self, parser):
+        return getattr(parser, field_name(self))
+
+class Sample(_IParseable):
+
+    def preparse(self, parser):
+        parser.add_argument('-k', '--'+field_name(self), type=int, default=1,
+                            help="how many (distinct) to pick (default: 1)")
+
+    def get_val(self, parser):
+        value = getattr(parser, field_name(self))
+        if value < 1:
+            raise ValueError("{} is an invalid sample size".format(value))
+        return value
+
+class UuidMap(_IParseable):
+
+    def preparse(self, parser):
+        parser.add_argument('-u', '--'+field_name(self), default=None, type=FileType('r'),
+                            help=textwrap.dedent(
+                                """
+                                A file containing a json object of source uuids to destination uuids, like so:
+
+                                    { "SOURCEBUNDLE1" : "DESTBUNDLE01" }
+
+                                ...for references that can't be matched up by name
+                                """))
+
+    def get_val(self, parser):
+        value = getattr(parser, field_name(self))
+        if value is None:
+            return {}
+        return json.loads(value.read())
+
+class DryRun(_IParseable):
+
+    def preparse(self, parser):
+        parser.add_argument('-n', '--'+field_name(self), action='store_true',
+                            help="show what would be done, but don't do it")
+
+    def get_val(self, parser):
+        return getattr(parser, field_name(self))
+
+class Output(_IParseable):
+
+    def preparse(self, parser):
+        parser.add_argument('-o', '--'+field_name(self), type=str, default=None, help="where to write the result")
+
+    def get_val(self, parser):
+        return getattr(parser, field_name(self))
+
+class Serials(_IParseable):
+
+    def preparse(self, parser):
+        parser.add_argument('-s', '--'+field_name(self), type=str, nargs='+', default=[],
+                            help="only these device serial numbers")
+
+    def get_val(self, parser):
+        value = getattr(parser, field_name(self))
+        for serial in value:
+            if not re.match(r'C[A-Za-z0-9]{3}[UEL][CQNOPRD][0-9]{8}$', serial):
+                raise ValueError("{} doesn't look like a serial number".format(serial))
+        return value
+
+class Merchants(_IParseable):
+
+    def preparse(self, parser):
+        parser.add_argument('-m', '--'+field_name(self), type=str, nargs='+', default=[],
+                            help="only these merchants (ids or uuids)")
+
+    def get_val(self, parser):
+        value = getattr(parser, field_name(self))
+        for merchant in value:
+            if not re.match(r'([A-Za-z0-9]{13}|[0-9]+)$', merchant):
+                raise ValueError("{} doesn't look like a row id or UUID".format(merchant))
+        return value
+
+class Interval(_IParseable):
+
+    def preparse(self, parser):
+        parser.add_argument('-i', '--'+field_name(self), type=float, default=1.0,
+                            help="seconds between polls (default: 1)")
+
+    def get_val(self, parser):
+        value = getattr(parser, field_name(self))
+        if value <= 0:
+            raise ValueError("{} is an invalid interval".format(value))
+        return value
+
+class Timeout(_IParseable):
+
+    def preparse(self, parser):
+        parser.add_argument('-t', '--'+field_name(self), type=float, default=None,
+                            help="give up after this many seconds (exits nonzero)")
+
+    def get_val(self, parser):
+        value = getattr(parser, field_name(self))
+        if value is not None and value <= 0:
+            raise ValueError("{} is an invalid timeout".format(value))
+        return value
+
+class Once(_IParseable):
+
+    def preparse(self, parser):
+        parser.add_argument('-1', '--'+field_name(self), action='store_true',
+                            help="exit after the first poll that sees a change")
+
+    def get_val(self, parser):
+        return getattr(parser, field_name(self))
+
+class Days(_IParseable):
+
+    def preparse(self, parser):
+        parser.add_argument('-d', '--'+field_name(self), type=int, default=7,
+                            help="how many days back to look (default: 7)")
+
+    def get_val(self, parser):
+        value = getattr(parser, field_name(self))
+        if value < 1:
+            raise ValueError("{} is an invalid number of days".format(value))
+        return value
+
+class Command(_IParseable):
+
+    def preparse(self, parser):
+        parser.add_argument('-c', '--'+field_name(self), type=str, default=None,
+                            help="only this command (e.g. provision_device)")
+
+    def get_val(self, parser):
+        return getattr(parser, field_name(self))
+
 class CloudTarget(Enum):
     prod_us = 'prod_us'
     prod_eu = 'prod_eu'
@@ -296,6 +681,8 @@ class PlanDict(_IParseable):
                                               | .merchant_plan_group="THEMERCHPLANGROUPUUID"
                                               | .app_bundle="THEAPPBUNDLEUUID"' \\
                                     | set_plan stg3
+
+                                (or use sync_targets to copy all of a server's plans, rewriting references by name)
                                  """))
 
     def get_val(self, parser):
@@ -435,6 +822,68 @@ class Parseable(Enum):
     showall = All
     event_subscription_dict = EventSubscriptionDict
     internal_permission = InternalPermission
+    count = Count
+    frame_rate = FrameRate
+    destination = Destination
+    version_codes = VersionCodes
+    refresh = Refresh
+    manifest = Manifest
+    concurrency = Concurrency
+    rate_limit = RateLimit
+    quantity = Quantity
+    chunk_size = ChunkSize
+    seed_size = SeedSize
+    random_seed = RandomSeed
+    force = Force
+    sample = Sample
+    other_reseller = OtherReseller
+    source_target = SourceTarget
+    dest_target = DestTarget
+    uuid_map = UuidMap
+    dry_run = DryRun
+    other_target = OtherTarget
+    output = Output
+    serials = Serials
+    merchants = Merchants
+    interval = Interval
+    timeout = Timeout
+    once = Once
+    days = Days
+    command = Command
+
+# every command can be traced and counted (see scoobe/trace.py and scoobe/stats.py)
+# commands that build their own ArgumentParser call this, then start_command_options once they've parsed
+def add_command_options(parser):
+    parser.add_argument('--trace', type=str, metavar='FILE', default=None,
+                        help="time each step and write the spans to FILE when done\n"
+                             "(*.folded for a flamegraph, otherwise chrome trace json)")
+    parser.add_argument('--stats', action='store_true',
+                        help="when done, show how many tunnels, queries, http requests and adb calls it took")
+    parser.add_argument('--prometheus', type=str, metavar='FILE', default=os.environ.get('SCOOBE_PROMETHEUS'),
+                        help="when done, add this command's timings and counts to FILE\n"
+                             "(for node_exporter's textfile collector, defaults to $SCOOBE_PROMETHEUS)")
+    # and recorded, to be replayed later without servers or devices (see scoobe/cassette.py)
+    parser.add_argument('--record', type=str, metavar='FILE', default=None,
+                        help="keep every http exchange, sql statement and adb call in the cassette FILE")
+    parser.add_argument('--replay', type=str, metavar='FILE', default=None,
+                        help="answer http requests, sql statements and adb calls from the cassette FILE\n"
+                             "(instead of talking to servers and devices)")
+    parser.add_argument('--replay-latency', action='store_true',
+                        help="when replaying, take as long to answer as the recorded ones did")
+
+def start_command_options(parsed):
+    if parsed.trace:
+        trace.start(parsed.trace)
+    if parsed.stats:
+        stats.print_at_exit()
+    if parsed.replay:
+        cassette.start(parsed.replay, 'replay', latency=parsed.replay_latency)
+    elif parsed.record:
+        cassette.start(parsed.record, 'record')
+    command = os.path.basename(sys.argv[0])
+    latency.record_at_exit(command, getattr(parsed, 'target', None))
+    if parsed.prometheus:
+        prometheus.export_at_exit(parsed.prometheus, command, getattr(parsed, 'target', None))
 
 # given a list of parsables, return a namedtuple containing their results
 def parse(*parsables, description=None):
@@ -465,8 +914,11 @@ def parse(*parsables, description=None):
         # remove leading space
         field_list.strip()
 
+    add_command_options(parser)
+
     # parse from the command line
     parsed = parser.parse_args()
+    start_command_options(parsed)
 
     # prepare results
     if parsables:
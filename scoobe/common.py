@@ -1,9 +1,14 @@
 import sys
+import time
+import threading
+import datetime
+import decimal
 import pprint as pp
 from textwrap import indent
 from enum import Enum
 from abc import ABC, abstractmethod
 from collections import namedtuple
+from scoobe import trace
 
 # don't log huge responses
 max_line = 200
@@ -47,6 +52,17 @@ def is_identity(func):
     except:
         return False
 
+# mysql hands back some types that json can't handle, make them into ones it can
+def json_safe(value):
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.hex()
+    return value
 
 UserPass = namedtuple('UserPass', 'user passwd')
 
@@ -106,6 +122,21 @@ class ServerTarget(ABC):
     def get_readwrite_mysql_creds(self):
         pass
 
+    # what to pass on the command line to get this target again
+    @abstractmethod
+    def get_cli_arg(self):
+        pass
+
+    # a db connection to use instead of connecting to mysql (through a tunnel, if need be)
+    # None means connect as usual
+    def get_db_connection(self):
+        return None
+
+    # a previously stored response to use instead of asking the server for `path`
+    # None means ask the server
+    def get_stored_response(self, path):
+        return None
+
 
 # print status to stderr so that only the requested value is written to stdout
 # (the better for consumption by a caller)
@@ -115,9 +146,12 @@ class StatusPrinter:
         self.indent = indent
         self.at_line_begin = True
         self.file = file
+        self.last = None
 
     def __call__(self, msg, end='\n'):
 
+        self.remember(msg)
+
         if self.at_line_begin:
             this_indent = self.indent
         else:
@@ -130,13 +164,52 @@ class StatusPrinter:
 
         print(indent(msg.__str__(), ' ' * this_indent), file=self.file, end=end)
 
+    # an Indent is named after whatever was printed just before it
+    # (only spans need the name, so there's nothing to do unless tracing)
+    def remember(self, msg):
+        if trace.tracer is None:
+            return
+        lines = msg.__str__().strip().split('\n')
+        self.last = shorten(lines[0])
+
+# a StatusPrinter that keeps quiet, for work that happens on many threads at once
+class QuietPrinter(StatusPrinter):
+    def __call__(self, msg, end='\n'):
+        self.remember(msg)
+
 # Increments the intent depth for a StatusPrinter
+# (and, when tracing, times the indented block)
 class Indent:
     def __init__(self, printer):
         self.printer = printer
+        self.spans = []
 
     def __enter__(self):
         self.printer.indent += 4
+        self.spans.append(trace.begin(getattr(self.printer, 'last', None) or 'indent'))
 
     def __exit__(self, type, value, traceback):
         self.printer.indent -= 4
+        if type is None:
+            trace.end(self.spans.pop())
+        else:
+            trace.end(self.spans.pop(), error=type.__name__)
+
+# spaces calls out so that, across all threads, at most `rate` of them begin each second (rate=None for no limit)
+class RateLimiter:
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+
+    def wait(self):
+        if not self.interval:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+
+        if delay > 0:
+            time.sleep(delay)
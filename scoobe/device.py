@@ -1,3 +1,4 @@
+import io
 import re
 import itertools
 import sys
@@ -6,15 +7,33 @@ import sh
 import json
 import ifaddr
 import ipaddress
-from scoobe.common import StatusPrinter, Indent
+import time
+import queue
+import hashlib
+import zipfile
+import socket
+import threading
+from scoobe.common import StatusPrinter, QuietPrinter, Indent
+from scoobe import stats
+from scoobe.trace import TracedCommand
+from scoobe.cassette import RecordedCommand
 from scoobe.cli import parse, Parseable
+from scoobe.cache import Cache
 from collections import namedtuple
-from sortedcontainers import SortedDict
 from enum import Enum
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from itertools import product as cross_product
-from sh import adb, sed, sort, grep, egrep, sleep, head, ping, rm
+from sh import sort, sleep, head, ping
 from datetime import datetime
 
+# each adb call is a span when tracing, and goes through the cassette when recording or replaying
+adb = TracedCommand(RecordedCommand(sh.adb), 'adb')
+
+# the lines of `text` that match `pattern`, each made into `replacement` (like `sed -n 's/pattern/replacement/p'`,
+# without starting a sed process, and without needing `text` to come from a real process)
+def sed_n(text, pattern, replacement=r'\1'):
+    return [ match.expand(replacement) for match in re.finditer(pattern, str(text), re.MULTILINE) ]
+
 def print_info():
     printer = StatusPrinter(indent=0)
     printer("Getting device info")
@@ -46,6 +65,7 @@ def ready():
 
 def wait_ready(printer=StatusPrinter()):
     if not ready():
+        began = time.monotonic()
         printer('waiting for device ', end='')
         spinner = itertools.cycle(['-', '\\', '|', '/'])
         while not ready():
@@ -55,6 +75,7 @@ def wait_ready(printer=StatusPrinter()):
             sys.stdout.write('\b')
             sys.stdout.flush()
         sleep(1)
+        stats.observe('device_ready', time.monotonic() - began)
         printer(' ... ready')
 
 def master_clear():
@@ -85,18 +106,15 @@ def set_target():
 # This takes the highest (string order) which works for both
 def get_cpuid(codename):
     if codename in ["KNOTTY_PINE","GOLDEN_OAK","BAYLEAF"]:
-        return  sorted(list(sed(adb.shell('getprop'), '-n',
-                r's/^.*clover_cpuid.*\[\([0-9a-fA-F]\{16\}\).*$/\1/p')))[-1].strip()
+        return  sorted(sed_n(adb.shell('getprop'), r'^.*clover_cpuid.*\[([0-9a-fA-F]{16}).*$'))[-1].strip()
     else:
-        return  sorted(list(sed(adb.shell('getprop'), '-n',
-                r's/^.*cpuid.*\[\([0-9a-fA-F]\{32\}\).*$/\1/p')))[-1].strip()
+        return  sorted(sed_n(adb.shell('getprop'), r'^.*cpuid.*\[([0-9a-fA-F]{32}).*$'))[-1].strip()
 
 def get_connected_device(printer=StatusPrinter()):
     wait_ready(printer)
 
     # tested for flex, mini, and station_2018
-    serial = str(sed(adb.shell('getprop'), '-n',
-        r's/^.*serial.*\[\(C[A-Za-z0-9]\{3\}[UEL][CQNOPRD][0-9]\{8\}\).*$/\1/p')).split('\n')[0]
+    serial = (sed_n(adb.shell('getprop'), r'^.*serial.*\[(C[A-Za-z0-9]{3}[UEL][CQNOPRD][0-9]{8}).*$') + [''])[0]
     assert(len(serial) > 0)
 
     codename = prefix2codename[serial[2:4]]
@@ -114,21 +132,22 @@ def get_connected_device(printer=StatusPrinter()):
 
     return device
 
+# stream a png of the current screen straight to the host (nothing touches the device's storage)
+def capture_png():
+    png = io.BytesIO()
+    adb(['exec-out', 'screencap', '-p'], _out=png)
+    return png.getvalue()
+
 def screenshot(device, printer=StatusPrinter()):
     printer("Dumping screenshot for Device: {}".format(device.serial))
     with Indent(printer):
 
-        # make way for new file
         outfile_name = "{}_{}.png".format(device.serial,
                                           datetime.now().strftime("%Y-%m-%d_%H%M%S"))
         outfile_path = os.path.join(os.getcwd(), outfile_name)
-        rm('-f', outfile_path)
 
-        # get the screencap
-        tempfile_path = '/sdcard/{}'.format(outfile_name)
-        adb.shell('screencap', '-p', tempfile_path)
-        adb.pull(tempfile_path)
-        adb.shell('rm', tempfile_path)
+        with open(outfile_path, 'wb') as outfile:
+            outfile.write(capture_png())
 
         printer("Wrote " + outfile_path)
 
@@ -139,6 +158,113 @@ def print_screenshot():
     device = get_connected_device(printer=printer)
     screenshot(device, printer=printer)
 
+# writes burst frames on its own thread so that capturing never waits on the disk
+# frames go into a directory, or into a single archive if the destination ends in '.zip'
+class FrameWriter(threading.Thread):
+
+    def __init__(self, destination):
+        super().__init__(daemon=True)
+        self.destination = destination
+        self.frames = queue.Queue()
+        self.manifest = []
+
+        if destination.endswith('.zip'):
+            # pngs are already compressed, don't bother deflating them again
+            self.archive = zipfile.ZipFile(destination, 'w', zipfile.ZIP_STORED)
+        else:
+            self.archive = None
+            os.makedirs(destination, exist_ok=True)
+
+    def _write(self, name, data):
+        if self.archive:
+            self.archive.writestr(name, data)
+        else:
+            with open(os.path.join(self.destination, name), 'wb') as outfile:
+                outfile.write(data)
+
+    def run(self):
+        # an archive that isn't closed has no central directory, so close it even if a write fails
+        try:
+            previous_digest = None
+            while True:
+                frame = self.frames.get()
+                if frame is None:
+                    break
+                (index, offset_ms, duration_ms, png) = frame
+
+                # identical frames mean the screen didn't change, which is what we look for when timing transitions
+                digest = hashlib.sha1(png).hexdigest()
+                name = "{:04d}_{:07d}ms.png".format(index, offset_ms)
+                self._write(name, png)
+                self.manifest.append({ 'frame'       : name,
+                                       'offset_ms'   : offset_ms,
+                                       'capture_ms'  : duration_ms,
+                                       'sha1'        : digest,
+                                       'changed'     : digest != previous_digest })
+                previous_digest = digest
+
+            self._write('manifest.json', json.dumps(self.manifest, indent=4).encode('utf-8'))
+        finally:
+            if self.archive:
+                self.archive.close()
+
+    def put(self, index, offset_ms, duration_ms, png):
+        self.frames.put((index, offset_ms, duration_ms, png))
+
+    def finish(self):
+        self.frames.put(None)
+        self.join()
+
+# capture `count` frames, aiming for `rate` frames per second
+# returns the offsets (ms since the first frame) at which the screen changed
+def burst_screenshot(device, count, rate, destination, printer=StatusPrinter()):
+    printer("Capturing {} frames at {} fps from Device: {}".format(count, rate, device.serial))
+    with Indent(printer):
+
+        writer = FrameWriter(destination)
+        writer.start()
+
+        # if a capture fails, the frames so far (and their manifest) are still written out
+        try:
+            period = 1.0 / rate
+            start = time.monotonic()
+            for index in range(count):
+
+                # if a capture ran long, start the next one right away rather than trying to catch up
+                delay = (start + index * period) - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+                began = time.monotonic()
+                png = capture_png()
+                ended = time.monotonic()
+
+                writer.put(index, int((began - start) * 1000), int((ended - began) * 1000), png)
+
+            elapsed = time.monotonic() - start
+            printer("Captured {} frames in {:.2f}s ({:.2f} fps)".format(count, elapsed, count / elapsed))
+        finally:
+            printer("Waiting for frames to be written...")
+            writer.finish()
+        printer("Wrote " + destination)
+
+    return [ x['offset_ms'] for x in writer.manifest if x['changed'] ]
+
+def print_burst_screenshot():
+    parsed_args = parse(Parseable.count, Parseable.frame_rate, Parseable.destination,
+                        description="Capture a series of screenshots from the connected device")
+    printer = StatusPrinter(indent=0)
+
+    device = get_connected_device(printer=printer)
+
+    destination = parsed_args.destination
+    if not destination:
+        destination = os.path.join(os.getcwd(), "{}_{}_burst".format(device.serial,
+                                                                    datetime.now().strftime("%Y-%m-%d_%H%M%S")))
+
+    burst_screenshot(device, parsed_args.count, parsed_args.framerate, destination, printer=printer)
+    print(destination)
+
 # base class for devices
 class Device:
 
@@ -189,8 +315,8 @@ class Mini(Device) :
 
     def get_target(self):
         self.wait_ready()
-        target_url = str(sed(adb.shell('mmc_access', 'r_yj3_target'), '-n',
-                r's/^.*YJ3[^:]*: \([^:]*\):\(.*\).*$/\1,\2/p')).strip()
+        target_url = '\n'.join(sed_n(adb.shell('mmc_access', 'r_yj3_target'),
+                                     r'^.*YJ3[^:]*: ([^:]*):(.*).*$', r'\1,\2')).strip()
         assert(len(target_url) > 0)
         (target, url) = target_url.split(',')
         return (target, url)
@@ -222,8 +348,8 @@ class Mobile(Device):
 
     def get_target(self):
         self.wait_ready()
-        target_url = str(sed(adb.shell('mmc_access', 'r_yj2_target'), '-n',
-                r's/^.*YJ2[^:]*: \([^:]*\):\(.*\).*$/\1,\2/p')).strip()
+        target_url = '\n'.join(sed_n(adb.shell('mmc_access', 'r_yj2_target'),
+                                     r'^.*YJ2[^:]*: ([^:]*):(.*).*$', r'\1,\2')).strip()
         assert(len(target_url) > 0)
         (target, url) = target_url.split(',')
         return (target, url)
@@ -261,6 +387,9 @@ codename2class = { "GOLDLEAF"    : Station,
                    "BAYLEAF"     : Flex,
                    "GOLDEN_OAK"  : Station2018 }
 
+# the adb daemon's port, used to see whether a device address is reachable from here
+adb_tcp_port = 5555
+
 def get_local_remote_ip(printer=StatusPrinter()):
 
     printer("Probing Network From Both Sides")
@@ -288,25 +417,25 @@ def get_local_remote_ip(printer=StatusPrinter()):
                         local_addresses.add(address)
         printer('')
 
+    # remember which pair worked, keyed by device serial and the set of local addresses
+    # (if either changes, the old answer no longer applies)
+    network_cache = Cache('network', ttl=300)
+
+    # skip the probe if we've already done it for this device on this network
+    cache_key = '{}|{}'.format(str(adb('get-serialno')).strip(),
+                               ','.join(sorted(x.ip_str for x in local_addresses)))
+    cached = network_cache.get(cache_key)
+    if cached:
+        printer("Using cached result: {} <-> {}".format(*cached))
+        return tuple(cached)
+
     # get all ipv4 addresses among the device's known routes
     printer("Device Address Candidates:")
     device_addresses = set()
     with Indent(printer):
-        # keep only things that look like ip addresses
-        device_ip_strs = set(re.findall(r'[0-9]+\.[0-9]+\.[0-9]+\.[0-9]+',
-            str(
-                sed(
-                    # TODO: this would be cleaner with 'adb shell netcfg' which I discovered too late
-
-                    # dump the routing table
-                    adb(['shell', 'ip', 'route']),
-
-                    # print only lines containing 'src', and only the part after the 'src'
-                    ['-n', r's#^.*src\(.*\)$#\1#p']
-                    )
-                ).strip()))
-
-        for ip_str in device_ip_strs:
+        # keep only the addresses that follow 'src' in the routing table
+        routes = str(adb(['shell', 'ip', 'route']))
+        for ip_str in set(re.findall(r'src\s+([0-9]+\.[0-9]+\.[0-9]+\.[0-9]+)', routes)):
             address = read_ip("route entry",  ip_str, printer)
             if address is not None:
                 device_addresses.add(address)
@@ -318,46 +447,73 @@ def get_local_remote_ip(printer=StatusPrinter()):
     def subnet_distance(ip_a, ip_b):
         return ip_a.int ^ ip_b.int
 
-    # Ping local from remote, and ping remote from local
-    # Return true if both succeed
-    def can_talk(local, remote, printer):
+    # set once some pair succeeds, so the other probes can stop early
+    found = threading.Event()
 
-        printer("Pinging {} -> {}".format(remote, local))
-        with Indent(printer):
-            printer('''adb shell 'ping -c 4 {} && echo SUCCESS || echo FAIL' '''.format(local))
-            with Indent(printer):
-                remote2local = str(adb(['shell', 'ping -c 4 {} && echo SUCCESS || echo FAIL'.format(local)]))
-                printer(remote2local)
-
-        if 'SUCCESS' in remote2local:
-            printer("Pinging {} -> {}".format(local, remote))
-            with Indent(printer):
-                printer('ping -c 4 {}'.format(local))
-                with Indent(printer):
-                    try:
-                        local2remote = ping(['-c', '4', remote])
-                    except sh.ErrorReturnCode as err:
-                        local2remote = err
-                    printer(local2remote)
-
-            if local2remote.exit_code == 0:
-                return True
-        return False
+    # a refused connection still means the packets made it there and back
+    def local_reaches(remote):
+        try:
+            socket.create_connection((remote, adb_tcp_port), timeout=1).close()
+            return True
+        except ConnectionRefusedError:
+            return True
+        except OSError:
+            pass
+
+        # maybe something is filtering tcp, fall back to a single ping
+        try:
+            ping(['-c', '1', remote], _timeout=2)
+            return True
+        except (sh.ErrorReturnCode, sh.TimeoutException):
+            return False
+
+    def remote_reaches(local):
+        result = str(adb(['shell', 'ping -c 1 -W 1 {} > /dev/null && echo SUCCESS || echo FAIL'.format(local)]))
+        return 'SUCCESS' in result
+
+    # one packet each way, return true if both make it
+    def can_talk(local, remote):
+        if found.is_set():
+            return False
+        return remote_reaches(local.ip_str) and not found.is_set() and local_reaches(remote.ip_str)
 
-    # sort local/remote pairs by distance
-    matches = SortedDict()
-    for local_ip, remote_ip in cross_product(local_addresses, device_addresses):
-        matches[subnet_distance(local_ip, remote_ip)] = (local_ip.ip_str, remote_ip.ip_str)
+    # nearest first, and keep every pair (two pairs can be equally distant)
+    candidates = sorted(cross_product(local_addresses, device_addresses), key=lambda x : subnet_distance(*x))
+    if not candidates:
+        return None
 
-    # check connectivity (nearest first)
-    for local, remote in matches.values():
-        if can_talk(local, remote, printer):
-            return (local, remote)
+    printer("Pinging {} candidate pairs".format(len(candidates)))
+    with Indent(printer):
+        executor = ThreadPoolExecutor(max_workers=min(len(candidates), 8))
+        futures = { executor.submit(can_talk, local, remote) : (local.ip_str, remote.ip_str)
+                                                                for local, remote in candidates }
+        try:
+            for future in as_completed(futures):
+                local, remote = futures[future]
+                try:
+                    success = future.result()
+                except sh.ErrorReturnCode as err:
+                    printer("{} <-> {}: {}".format(local, remote, err))
+                    continue
+
+                if success:
+                    printer("{} <-> {}: OK".format(local, remote))
+                    found.set()
+                    network_cache.put(cache_key, [local, remote])
+                    return (local, remote)
+                elif not found.is_set():
+                    printer("{} <-> {}: no route".format(local, remote))
+        finally:
+            # don't start any probes that haven't started yet, and don't wait on the ones in flight
+            found.set()
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
 
 def probe_network(selector=lambda x : x, printer=StatusPrinter()):
 
     with Indent(printer):
-        local_remote = get_local_remote_ip()
+        local_remote = get_local_remote_ip(printer=printer)
 
     if local_remote:
         return selector({ "local_ip" : local_remote[0],
@@ -389,12 +545,141 @@ def print_local_ip():
         local_ip = probe_network(selector = lambda x : x['local_ip'], printer=printer)
     print(local_ip)
 
+Package = namedtuple('Package', 'name version_name version_code')
+
+# remember each device's packages until something gets installed
+# (the key is the device serial, the fingerprint is a hash of the apk paths, which change on install/update)
+package_cache = Cache('packages')
+
+def attached_serials():
+    listing = str(adb('devices'))
+    return re.findall(r'^(\S+)\s+device$', listing, flags=re.MULTILINE)
+
+# talk to a particular device if there are several
+def adb_for(serial=None):
+    if serial:
+        return adb.bake('-s', serial)
+    return adb
+
+# one pass over `dumpsys package packages` output
+# an updated system app is listed twice (the second time under 'Hidden system packages'), keep the first
+def parse_packages(listing, prefix='com.clover'):
+    packages = {}
+    current = None
+    for line in listing.splitlines():
+        match = re.match(r'^\s*Package \[(.*)\]', line)
+        if match:
+            name = match.group(1)
+            if name.startswith(prefix) and name not in packages:
+                current = { 'name' : name, 'version_name' : None, 'version_code' : None }
+                packages[name] = current
+            else:
+                current = None
+            continue
+
+        if current is None:
+            continue
+
+        match = re.search(r'versionCode=(\d+)', line)
+        if match:
+            current['version_code'] = int(match.group(1))
+
+        match = re.search(r'versionName=(.*)$', line)
+        if match:
+            current['version_name'] = match.group(1).strip()
+
+    return { name : Package(**fields) for name, fields in packages.items() }
+
+# with refresh, whatever was cached for the device is dropped first
+def get_device_packages(serial=None, prefix='com.clover', refresh=False, printer=StatusPrinter()):
+
+    device_adb = adb_for(serial)
+    if not serial:
+        serial = str(device_adb('get-serialno')).strip()
+    if refresh:
+        invalidate_device_packages(serial)
+
+    printer("Getting {}'s {}* packages".format(serial, prefix))
+    with Indent(printer):
+
+        fingerprint = hashlib.sha1(
+                str(device_adb(['shell', 'pm list packages -f {}'.format(prefix)])).encode('utf-8')).hexdigest()
+
+        cached = package_cache.get(serial)
+        if cached and cached['fingerprint'] == fingerprint and cached['prefix'] == prefix:
+            printer("Nothing installed since last time, using cached inventory")
+            return { name : Package(*fields) for name, fields in cached['packages'].items() }
+
+        # filter on the device so that only a few lines come back over adb
+        try:
+            listing = str(device_adb(['shell',
+                "dumpsys package packages | grep -E '^ *Package \\[|versionCode=|versionName='"]))
+        except sh.ErrorReturnCode:
+            listing = ''
+
+        # older devices might not have grep -E, filter here instead
+        # (older adb versions exit 0 even when the remote grep fails, so look at what came back, not just how)
+        if not listing.strip() or 'not found' in listing or 'Package [' not in listing:
+            printer("Device-side filter failed, filtering locally")
+            listing = str(device_adb(['shell', 'dumpsys', 'package', 'packages']))
+
+        packages = parse_packages(listing, prefix)
+        printer("Found {} packages".format(len(packages)))
+
+        package_cache.put(serial, { 'fingerprint' : fingerprint,
+                                    'prefix'      : prefix,
+                                    'packages'    : { name : list(p) for name, p in packages.items() } })
+    return packages
+
+def invalidate_device_packages(serial):
+    package_cache.invalidate(serial)
+
+def _version(package, version_codes):
+    if version_codes:
+        return { 'versionName' : package.version_name,
+                 'versionCode' : package.version_code }
+    return package.version_name
+
 def print_device_packages():
+    parsed_args = parse(Parseable.version_codes, Parseable.refresh,
+                        description="Print the versions of the com.clover packages on the connected device")
+    printer = StatusPrinter(indent=0)
 
-    listing = str(grep(egrep(adb(['shell', 'dumpsys', 'package', '*']), r'Package..com\.clover|versionName'), ['Package', '-A1']))
-    package_names = re.findall(r'Package \[(.*)\].*', listing)
-    versions = list(map(lambda x : x.strip(), re.findall(r'versionName=(.*)', listing)))
-    package2version = {}
-    for p, v in zip(package_names, versions):
-        package2version[p] = v
+    packages = get_device_packages(refresh=parsed_args.refresh, printer=printer)
+
+    package2version = { name : _version(package, parsed_args.versioncodes)
+                        for name, package in sorted(packages.items()) }
     print(json.dumps(package2version, indent=4))
+
+# inventory every attached device at once
+# returns { 'serials' : [...], 'packages' : { package : { serial : version } } }
+def get_fleet_packages(prefix='com.clover', version_codes=False, refresh=False, printer=StatusPrinter()):
+
+    serials = attached_serials()
+    printer("Getting packages from {} attached devices".format(len(serials)))
+    if not serials:
+        return { 'serials' : [], 'packages' : {} }
+
+    with ThreadPoolExecutor(max_workers=len(serials)) as executor:
+        inventories = executor.map(lambda serial : get_device_packages(serial, prefix, refresh=refresh,
+                                                                       printer=QuietPrinter()),
+                                   serials)
+
+        matrix = {}
+        for serial, packages in zip(serials, inventories):
+            for name, package in packages.items():
+                matrix.setdefault(name, {})[serial] = _version(package, version_codes)
+
+    return { 'serials' : serials,
+             'packages' : { name : matrix[name] for name in sorted(matrix) } }
+
+def print_fleet_packages():
+    parsed_args = parse(Parseable.version_codes, Parseable.refresh,
+                        description="Print a package x device matrix of the com.clover packages on all attached devices")
+    printer = StatusPrinter(indent=0)
+
+    with Indent(printer):
+        fleet = get_fleet_packages(version_codes=parsed_args.versioncodes, refresh=parsed_args.refresh,
+                                   printer=printer)
+
+    print(json.dumps(fleet, indent=4))
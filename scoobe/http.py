@@ -3,8 +3,10 @@ import json
 import pprint as pp
 import os
 import sys
+import threading
 from copy import deepcopy
 from enum import Enum
+from scoobe import trace, stats, cassette
 from scoobe.common import StatusPrinter, Indent, shorten, pretty_shorten, is_identity
 from scoobe.ssh import SshConfig, UserPass
 
@@ -64,13 +66,22 @@ def _do_request(verb, endpoint, headers, data, print_data=None, printer=StatusPr
     printer("[Http]")
     with Indent(printer):
         print_request(printer, endpoint, headers, print_data)
-        if data:
-            if 'json' in ''.join(headers.values()).lower():
-                response = verb(endpoint, headers=headers, json=data)
-            else:
-                response = verb(endpoint, headers=headers, data=data)
-        else:
-            response = verb(endpoint, headers=headers)
+        with trace.span('{} {}'.format(getattr(verb, '__name__', 'http').upper(), endpoint), 'http',
+                        phase='http') as request_span:
+            kwargs = { 'headers' : headers }
+            if data:
+                if 'json' in ''.join(headers.values()).lower():
+                    kwargs['json'] = data
+                else:
+                    kwargs['data'] = data
+            # sent as usual unless a cassette is recording or replaying (see scoobe/cassette.py)
+            response = cassette.http_request(verb, endpoint, kwargs)
+            if request_span is not None:
+                request_span.attrs['status'] = response.status_code
+        stats.count('http_requests')
+        stats.count('http_status_{}'.format(response.status_code))
+        stats.count('http_bytes_sent', len(response.request.body or b''))
+        stats.count('http_bytes_received', len(response.content))
         print_response(printer, response)
     return response
 
@@ -143,6 +154,7 @@ def internal_auth(target,
                   'Connection' : 'keep-alive' }
 
     data = creds
+    stats.count('logins')
 
     # first try with with a nonsense user
     printer("Attempting cloverDevAuth")
@@ -176,12 +188,47 @@ def make_uri(path, target):
         target.get_http_port(),
         path)
 
+# logging in is a round trip (two, without cloverDevAuth), so each process does it once per target
+# (one lock per target, so logging in to one doesn't hold up requests to another)
+_cookies = {}
+_cookie_locks = {}
+_cookies_lock = threading.Lock()
+
+def _cookie_lock(key):
+    with _cookies_lock:
+        return _cookie_locks.setdefault(key, threading.Lock())
+
+def _cookie(target, printer=StatusPrinter()):
+    key = target.get_cli_arg()
+    with _cookie_lock(key):
+        if key not in _cookies:
+            _cookies[key] = internal_auth(target, printer=printer)
+        return _cookies[key]
+
+# the session behind `cookie` is over (it expired, or the server restarted), so the next request logs in again
+# (unless another thread has already replaced it)
+def _forget_cookie(target, cookie):
+    key = target.get_cli_arg()
+    with _cookie_lock(key):
+        if _cookies.get(key) == cookie:
+            del _cookies[key]
+
 def _headers(target, printer=StatusPrinter()):
 
     return { 'Content-Type' : 'application/json ',
                    'Accept' : 'application/json, text/javascript, */*; q=0.01',
                'Connection' : 'keep-alive',
-                   'Cookie' : internal_auth(target, printer=printer) }
+                   'Cookie' : _cookie(target, printer=printer) }
+
+# send(headers) with the target's login cookie, and once more with a new one if the server has forgotten the old one
+def _send_authorized(target, send, printer=StatusPrinter()):
+    headers = _headers(target, printer=printer)
+    response = send(headers)
+    if response.status_code == 401:
+        printer("[Logging in again]")
+        _forget_cookie(target, headers['Cookie'])
+        response = send(_headers(target, printer=printer))
+    return response
 
 def _finish(response, verb_str, uri, descend_once, printer=StatusPrinter()):
 
@@ -194,23 +241,27 @@ def _finish(response, verb_str, uri, descend_once, printer=StatusPrinter()):
 
 def get_response_as_dict(path, target, descend_once='elements', printer=StatusPrinter()):
 
+    stored = target.get_stored_response(path)
+    if stored is not None:
+        printer("[GET {} from {}]".format(path, target.get_name()))
+        if descend_once:
+            return stored[descend_once]
+        return stored
+
     uri = make_uri(path, target)
-    headers = _headers(target, printer=printer)
-    response = get(uri, headers, printer=printer)
+    response = _send_authorized(target, lambda headers : get(uri, headers, printer=printer), printer=printer)
 
     return _finish(response, 'GET', uri, descend_once)
 
 def put_response_as_dict(path, target, data, descend_once=None, printer=StatusPrinter()):
 
     uri = make_uri(path, target)
-    headers = _headers(target, printer=printer)
-    response = put(uri, headers, data, printer=printer)
+    response = _send_authorized(target, lambda headers : put(uri, headers, data, printer=printer), printer=printer)
     return _finish(response, 'PUT', uri, descend_once)
 
 def post_response_as_dict(path, target, data, descend_once=None, printer=StatusPrinter()):
 
     uri = make_uri(path, target)
-    headers = _headers(target, printer=printer)
-    response = post(uri, headers, data, printer=printer)
+    response = _send_authorized(target, lambda headers : post(uri, headers, data, printer=printer), printer=printer)
 
     return _finish(response, 'POST', uri, descend_once)
@@ -0,0 +1,126 @@
+import os
+import math
+import time
+import fcntl
+import atexit
+import datetime
+from os.path import join
+from scoobe import stats
+from scoobe.cache import scoobe_dir
+
+# Each command is over in seconds, so whether one got slower only shows up across many runs.
+# When a command that parses its arguments exits, it appends a line to ~/.scoobe/latency/latency.log:
+#
+#   <epoch seconds> <command> <target> <total> <tunnel> <connect> <query> <http> <adb>
+#
+# (tab separated, times in milliseconds). Lines are short enough that appends from concurrent commands don't
+# interleave. When the log reaches max_log_bytes it becomes latency.log.1 (replacing the one before), so at most
+# twice that is kept. Set SCOOBE_LATENCY=0 to not record anything.
+#
+# `scoobe_stats` (scoobe/latency_stats.py) reports on them.
+
+max_log_bytes = 1024 * 1024
+
+columns = ['total'] + stats.phases
+
+def log_path():
+    return join(scoobe_dir('latency'), 'latency.log')
+
+# commands without a target get '-'
+def _field(value):
+    if value is None:
+        return '-'
+    return str(value).replace('\t', ' ').replace('\n', ' ') or '-'
+
+def record_line(command, target, timings, now=None):
+    fields = [ '{:.3f}'.format(now if now is not None else time.time()), _field(command), _field(target) ]
+    fields += [ str(int(round(timings.get(column, 0) * 1000))) for column in columns ]
+    return '\t'.join(fields) + '\n'
+
+def parse_line(line):
+    fields = line.rstrip('\n').split('\t')
+    if len(fields) != 3 + len(columns):
+        return None
+    try:
+        record = { 'time' : float(fields[0]), 'command' : fields[1], 'target' : fields[2] }
+        record.update({ column : int(value) for column, value in zip(columns, fields[3:]) })
+    except ValueError:
+        return None
+    return record
+
+def _rotate_if_full(path):
+    try:
+        if os.path.getsize(path) < max_log_bytes:
+            return
+    except OSError:
+        return
+
+    # only one process gets to rotate, the rest see the fresh log when they check again
+    with open(path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if os.path.getsize(path) >= max_log_bytes:
+                os.replace(path, path + '.1')
+        except OSError:
+            pass
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def append(line, path=None):
+    path = path or log_path()
+    _rotate_if_full(path)
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line.encode('utf-8'))
+    finally:
+        os.close(fd)
+
+def record_at_exit(command, target):
+    if os.environ.get('SCOOBE_LATENCY') == '0':
+        return
+
+    def record():
+        try:
+            append(record_line(command, target, stats.timings()))
+        except OSError:
+            # not worth failing a command over
+            pass
+
+    atexit.register(record)
+
+def read_records(path=None):
+    path = path or log_path()
+    records = []
+    for each_path in [path + '.1', path]:
+        try:
+            with open(each_path) as log_file:
+                records += [ x for x in map(parse_line, log_file) if x is not None ]
+        except OSError:
+            pass
+    return records
+
+# nearest-rank
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    rank = max(1, math.ceil(fraction * len(ordered)))
+    return ordered[rank - 1]
+
+# { (day, command, target, phase) : { 'n', 'p50', 'p95', 'p99' } }, phases that never took any time are left out
+def summarize(records):
+    groups = {}
+    for record in records:
+        day = datetime.date.fromtimestamp(record['time']).isoformat()
+        for column in columns:
+            groups.setdefault((day, record['command'], record['target'], column), []).append(record[column])
+
+    summary = {}
+    for key, values in sorted(groups.items()):
+        if not any(values):
+            continue
+        ordered = sorted(values)
+        summary[key] = { 'n'   : len(ordered),
+                         'p50' : percentile(ordered, 0.50),
+                         'p95' : percentile(ordered, 0.95),
+                         'p99' : percentile(ordered, 0.99) }
+    return summary
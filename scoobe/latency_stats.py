@@ -0,0 +1,25 @@
+import sys
+import json
+import time
+from scoobe.cli import parse, Parseable
+from scoobe.common import StatusPrinter
+from scoobe.latency import read_records, summarize, log_path
+
+def print_latency_stats():
+
+    parsed_args = parse(Parseable.days, Parseable.command,
+                        description="Show how long commands have been taking (p50/p95/p99 in milliseconds), "
+                                    "per day, target and phase")
+    printer = StatusPrinter(indent=0)
+
+    since = time.time() - parsed_args.days * 24 * 3600
+    records = [ x for x in read_records()
+                if x['time'] >= since and (parsed_args.command is None or x['command'] == parsed_args.command) ]
+    if not records:
+        printer("Nothing recorded in {} for the last {} day(s)".format(log_path(), parsed_args.days))
+        sys.exit(30)
+
+    for (day, command, target, phase), figures in summarize(records).items():
+        line = { 'day' : day, 'command' : command, 'target' : target, 'phase' : phase }
+        line.update(figures)
+        print(json.dumps(line))
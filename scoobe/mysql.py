@@ -1,12 +1,18 @@
+import sys
 import MySQLdb
 import MySQLdb.cursors
 import pprint as pp
 from enum import Enum
+from contextlib import contextmanager
 from textwrap import dedent
+from scoobe import trace, stats, cassette
 from scoobe.common import StatusPrinter, Indent, shorten, pretty_shorten, is_identity
 from scoobe.properties import LocalServer
 from scoobe.ssh import SshConfig, PossibleSshTunnel
 
+# what a statement raises when it would break a unique key (so callers needn't import the driver)
+IntegrityError = MySQLdb.IntegrityError
+
 # encapsulates the feedback you might expect from a mysql query
 class Feedback(Enum):
 
@@ -85,14 +91,235 @@ class Feedback(Enum):
 
         return change_ct
 
+    # the auto-increment id of the row the statement inserted (no read-back query needed)
+    def InsertId(cursor, rowtransform, print_transform=False, printer=StatusPrinter()):
+
+        if not is_identity(rowtransform):
+            printer("InsertId got nontrivial row transform.  It will be ignored.")
+
+        insert_id = cursor.lastrowid
+
+        printer('[Inserted Id]')
+        with Indent(printer):
+            printer(insert_id)
+
+        return insert_id
+
+
+# `round_trip_ct` round trips, carrying `statement_ct` statements between them
+def count_sql(statement_ct, byte_ct, round_trip_ct=1):
+    stats.count('sql_round_trips', round_trip_ct)
+    stats.count('sql_statements', statement_ct)
+    stats.count('sql_bytes', byte_ct)
+
+# executemany sends an INSERT ... VALUES as one multi-row statement if mysqlclient can rewrite it
+# (everything in its VALUES is a placeholder), and anything else as one statement per row
+def executemany_round_trips(sql, row_ct):
+    if MySQLdb.cursors.RE_INSERT_VALUES.match(sql):
+        return 1
+    return row_ct
+
+# times a round trip as a span, and counts the ones mysql rejects
+@contextmanager
+def _statement(name, **attrs):
+    try:
+        with trace.span(name, 'mysql', phase='query', **attrs):
+            yield
+    except MySQLdb.Error:
+        stats.count('sql_errors')
+        raise
+
+# holds one tunnel and one connection open for several statements
+# (opening a tunnel takes seconds, so statements that go together should share one)
+#
+# with transaction=True, the statements are committed together when the block exits
+# or rolled back together if it exits with an exception
+class Session:
+    def __init__(self, target, mysql_user, mysql_pass, printer=StatusPrinter(), transaction=False):
+        self.target = target
+        self.mysql_user = mysql_user
+        self.mysql_pass = mysql_pass
+        self.printer = printer
+        self.transaction = transaction
+
+    def __enter__(self):
+        # a replayed session's statements are answered from the cassette, there's nothing to connect to
+        if cassette.replaying():
+            self.db = cassette.CassetteConnection()
+            return self
+
+        # some targets bring their own database
+        self.db = self.target.get_db_connection()
+        if self.db is not None:
+            if cassette.recording():
+                self.db = cassette.CassetteConnection(self.db)
+            return self
+
+        # open an ssh tunnel
+        with trace.span('tunnel', 'ssh', phase='tunnel', target=self.target.get_name()):
+            self.tunnel = PossibleSshTunnel(self.target, self.printer)
+            self.tunnel.__enter__()
+        self.indent = Indent(self.printer)
+        self.indent.__enter__()
+
+        try:
+            host = Query.get_mysql_host(self.tunnel.mysql().host)
+
+            # open a mysql connection
+            with trace.span('connect', 'mysql', phase='connect', user=self.mysql_user):
+                self.db = MySQLdb.connect(user=self.mysql_user,
+                                          host=host,
+                                          port=self.tunnel.mysql().port,
+                                          db=self.tunnel.mysql().db,
+                                          passwd=self.mysql_pass,
+                                          autocommit=not self.transaction,
+                                          cursorclass=MySQLdb.cursors.DictCursor)
+            stats.count('mysql_connections')
+            if cassette.recording():
+                self.db = cassette.CassetteConnection(self.db)
+        except:
+            self.__exit__(*sys.exc_info())
+            raise
+        return self
+
+    # params, if given, fill the sql's %s placeholders (and are escaped by the driver)
+    def execute(self, sql, feedback, rowtransform=lambda x : x, print_transform=False, params=None):
+        c = self.db.cursor()
+
+        # show the query then run it
+        self.printer("[Query]")
+        with Indent(self.printer):
+            self.printer(dedent(sql).strip())
+            if params is not None:
+                self.printer(params)
+        with _statement('sql', sql=shorten(dedent(sql).strip())):
+            if params is None:
+                c.execute(sql)
+            else:
+                c.execute(sql, params)
+            count_sql(1, len(sql))
+
+            # do what the caller wanted
+            return feedback(c, rowtransform, print_transform=print_transform, printer=self.printer)
+
+    # runs one parameterized statement for many rows of parameters
+    # (mysqlclient sends an INSERT ... VALUES as one multi-row statement, but only if everything in its VALUES
+    # is a placeholder, otherwise it sends one statement per row)
+    def execute_many(self, sql, rows):
+        c = self.db.cursor()
+
+        self.printer("[Query x {}]".format(len(rows)))
+        with Indent(self.printer):
+            self.printer(dedent(sql).strip())
+        with _statement('sql x {}'.format(len(rows)), sql=shorten(dedent(sql).strip())):
+            c.executemany(dedent(sql).strip(), rows)
+            count_sql(len(rows), len(sql) * len(rows), executemany_round_trips(dedent(sql).strip(), len(rows)))
+
+        self.printer('[Rows Changed]')
+        with Indent(self.printer):
+            self.printer(c.rowcount)
+
+        return c.rowcount
+
+    # sends several statements in one round trip, returns the number of rows each one changed
+    # (mysqlclient enables multi-statement queries by default, each result set is one statement's outcome)
+    def execute_batch(self, statements):
+        c = self.db.cursor()
+
+        self.printer("[Batch]")
+        with Indent(self.printer):
+            for sql in statements:
+                self.printer(dedent(sql).strip())
+        with _statement('sql batch', statements=len(statements)):
+            batch = ';\n'.join(dedent(sql).strip().rstrip(';') for sql in statements) + ';'
+            c.execute(batch)
+            count_sql(len(statements), len(batch))
+
+            change_cts = [c.rowcount]
+            while c.nextset():
+                change_cts.append(c.rowcount)
+
+        self.printer('[Rows Changed]')
+        with Indent(self.printer):
+            self.printer(change_cts)
+
+        return change_cts
+
+    def __exit__(self, type, value, traceback):
+        if getattr(self, 'db', None) is not None:
+            try:
+                if self.transaction:
+                    if type is None:
+                        with trace.span('commit', 'mysql', phase='query'):
+                            self.db.commit()
+                        self.printer("[Committed]")
+                    else:
+                        with trace.span('rollback', 'mysql', phase='query'):
+                            self.db.rollback()
+                        self.printer("[Rolled Back]")
+            finally:
+                self.db.close()
+        if hasattr(self, 'tunnel'):
+            self.indent.__exit__(type, value, traceback)
+            self.tunnel.__exit__(type, value, traceback)
+
+# queues up writes that belong together and sends them in one round trip, in one transaction
+# nothing is sent until the block exits, and nothing is kept unless every statement changed the expected number of rows
+#
+#   with UnitOfWork(target, 'metaRW', 'test789', printer) as work:
+#       work.add("UPDATE ...", expect=1)
+#       work.add("INSERT IGNORE ...")
+#
+# afterwards, work.change_cts holds each statement's change count
+class UnitOfWork:
+    def __init__(self, target, mysql_user, mysql_pass, printer=StatusPrinter()):
+        self.target = target
+        self.mysql_user = mysql_user
+        self.mysql_pass = mysql_pass
+        self.printer = printer
+        self.statements = []
+        self.change_cts = None
+
+    # expect=None means any change count is fine
+    def add(self, sql, expect=None):
+        self.statements.append((sql, expect))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        # the block failed before anything was sent, so there's nothing to undo
+        if type is not None or not self.statements:
+            return
+
+        with Session(self.target, self.mysql_user, self.mysql_pass, self.printer, transaction=True) as session:
+            change_cts = session.execute_batch([ sql for sql, _ in self.statements ])
+
+            # raising here rolls the whole batch back
+            for (sql, expected), change_ct in zip(self.statements, change_cts):
+                if expected is not None and change_ct != expected:
+                    raise ValueError("Expected {} rows changed, instead got {}, by: {}".format(
+                                     expected, change_ct, dedent(sql).strip()))
+
+        self.change_cts = change_cts
+
+# use the caller's session if they have one, otherwise open one just for this
+@contextmanager
+def session_or_new(session, target, mysql_user, mysql_pass, printer=StatusPrinter()):
+    if session:
+        yield session
+    else:
+        with Session(target, mysql_user, mysql_pass, printer) as session:
+            yield session
 
 # encapsulates a mysql query
 class Query:
-    def __init__(self, ssh_config, mysql_user, mysql_pass, sql):
+    def __init__(self, ssh_config, mysql_user, mysql_pass, sql, params=None):
         self.ssh_config = ssh_config
         self.mysql_user = mysql_user
         self.mysql_pass = mysql_pass
         self.sql = sql
+        self.params = params
 
     # If host='localhost' then mysql tries to use the socket (local fs) and doesn't actually connect through the tunnel
     # This forces everything through the network socket (slower, but consistent between ssh-tunneled and
@@ -106,27 +333,7 @@ class Query:
     # called externally when the user doesn't need to read data
     # called internally, parameter will be called with post-query connection string
     def execute(self, feedback, rowtransform=lambda x : x, print_transform=False, printer=StatusPrinter()):
-        # open an ssh tunnel
-        with PossibleSshTunnel(self.ssh_config, printer) as tun:
-            with Indent(printer):
-
-                host = Query.get_mysql_host(tun.mysql().host)
-
-                # open a mysql connection
-                db = MySQLdb.connect(user=self.mysql_user,
-                                    host=host,
-                                    port=tun.mysql().port,
-                                    db=tun.mysql().db,
-                                    passwd=self.mysql_pass,
-                                    autocommit=True,
-                                    cursorclass=MySQLdb.cursors.DictCursor)
-                c = db.cursor()
-
-                # show the query then run it
-                printer("[Query]")
-                with Indent(printer):
-                    printer(dedent(self.sql).strip())
-                c.execute(self.sql)
-
-                # do what the caller wanted
-                return feedback(c, rowtransform, print_transform=print_transform, printer=printer)
+        with trace.span('Query', 'mysql', target=self.ssh_config.get_name()), \
+             Session(self.ssh_config, self.mysql_user, self.mysql_pass, printer) as session:
+            return session.execute(self.sql, feedback, rowtransform=rowtransform, print_transform=print_transform,
+                                   params=self.params)
@@ -0,0 +1,140 @@
+import os
+import re
+import sys
+import fcntl
+import atexit
+from scoobe import stats
+from scoobe.cache import atomic_write
+
+# Adds each command's numbers to a file for node_exporter's textfile collector, e.g.
+#
+#   SCOOBE_PROMETHEUS=/var/lib/node_exporter/textfile/scoobe.prom merchant 12 stg1
+#
+# (or `--prometheus FILE` on any command that parses its arguments).
+#
+# Everything here is a counter or a histogram, so runs are combined by adding their samples to the ones already
+# in the file. Concurrent commands take turns with an flock on FILE.lock, and the file is replaced in one rename
+# so node_exporter never reads half of it.
+
+# name : (type, help)
+metrics = { 'scoobe_command_duration_seconds' : ('histogram', "How long scoobe commands took"),
+            'scoobe_phase_duration_seconds'   : ('histogram', "Time spent opening tunnels, connecting to mysql, "
+                                                              "querying, making http requests and calling adb"),
+            'scoobe_http_responses_total'     : ('counter',   "Http responses by status code"),
+            'scoobe_sql_errors_total'         : ('counter',   "Sql statements that mysql rejected"),
+            'scoobe_device_ready_seconds'     : ('histogram', "How long devices took to be ready (after a reboot, "
+                                                              "say) when scoobe had to wait for them") }
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                          for k, v in labels) + '}'
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+# { (sample name, ((label, value), ...)) : value } for a run that took these timings, counts and observations
+# (observations are { name : stats.Histogram })
+def samples(command, target, timings, counts, observations):
+    result = {}
+
+    def add(name, labels, value):
+        key = (name, tuple(labels))
+        result[key] = result.get(key, 0) + value
+
+    def histogram(name, labels, observed):
+        for bound, count in zip(stats.buckets + ['+Inf'], observed.cumulative()):
+            add(name + '_bucket', labels + [('le', str(bound))], count)
+        add(name + '_sum', labels, observed.sum)
+        add(name + '_count', labels, observed.count)
+
+    histogram('scoobe_command_duration_seconds', [('command', command), ('target', target or '-')],
+              stats.Histogram([timings['total']]))
+    for phase in stats.phases:
+        if phase in observations:
+            histogram('scoobe_phase_duration_seconds', [('command', command), ('phase', phase)],
+                      observations[phase])
+    for name, value in counts.items():
+        if name.startswith('http_status_'):
+            add('scoobe_http_responses_total', [('command', command), ('code', name[len('http_status_'):])], value)
+    add('scoobe_sql_errors_total', [('command', command)], counts.get('sql_errors', 0))
+    if 'device_ready' in observations:
+        histogram('scoobe_device_ready_seconds', [], observations['device_ready'])
+
+    return result
+
+sample_line = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})? (\S+)$')
+label_pair = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+def parse_samples(text):
+    result = {}
+    for line in text.splitlines():
+        match = sample_line.match(line)
+        if not match:
+            continue
+        name, labels, value = match.groups()
+        labels = tuple((k, v.replace('\\n', '\n').replace('\\"', '"').replace('\\\\', '\\'))
+                       for k, v in label_pair.findall(labels or ''))
+        try:
+            result[(name, labels)] = float(value)
+        except ValueError:
+            pass
+    return result
+
+def _family(name):
+    for suffix in ['_bucket', '_sum', '_count']:
+        if name.endswith(suffix) and name[:-len(suffix)] in metrics:
+            return name[:-len(suffix)]
+    return name
+
+# histogram buckets in order of their bound, everything else by label
+def _sort_key(item):
+    (name, labels), value = item
+    bound = dict(labels).get('le')
+    plain = tuple(x for x in labels if x[0] != 'le')
+    return (plain, name, float(bound) if bound is not None else 0)
+
+def render(all_samples):
+    families = {}
+    for key, value in all_samples.items():
+        families.setdefault(_family(key[0]), []).append((key, value))
+
+    lines = []
+    for family in list(metrics) + sorted(x for x in families if x not in metrics):
+        if family not in families:
+            continue
+        if family in metrics:
+            kind, help_text = metrics[family]
+            lines.append('# HELP {} {}'.format(family, help_text))
+            lines.append('# TYPE {} {}'.format(family, kind))
+        for (name, labels), value in sorted(families[family], key=_sort_key):
+            lines.append('{}{} {}'.format(name, _labels(labels), _format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+# add `new_samples` to what's in `path`
+def merge_into(path, new_samples):
+    with open(path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            try:
+                with open(path) as prom_file:
+                    existing = parse_samples(prom_file.read())
+            except OSError:
+                existing = {}
+            for key, value in new_samples.items():
+                existing[key] = existing.get(key, 0) + value
+            atomic_write(path, render(existing))
+            # node_exporter might not run as whoever ran scoobe
+            os.chmod(path, 0o644)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def export_at_exit(path, command, target):
+    def export():
+        try:
+            merge_into(os.path.abspath(path), samples(command, target, stats.timings(), stats.snapshot(),
+                                                      stats.observations()))
+        except OSError as ex:
+            print("Couldn't write metrics to {} ({})".format(path, ex), file=sys.stderr)
+    atexit.register(export)
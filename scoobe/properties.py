@@ -44,6 +44,9 @@ class LocalServer(ServerTarget):
     def get_name(self):
         return self._name
 
+    def get_cli_arg(self):
+        return self._file
+
     def get_db_name(self):
         return self._db_name
 
@@ -0,0 +1,205 @@
+import sys
+import json
+import time
+from scoobe.cache import Cache
+from scoobe.cli import parse, Parseable
+from scoobe.common import StatusPrinter, Indent
+from scoobe.mysql import Query, Feedback
+
+# The reseller hierarchy, indexed so that questions like "everything under X" don't mean re-walking the whole table
+#
+# Each reseller gets an interval from an Euler tour (the order a depth-first walk enters them in, and the last
+# descendant it visits before leaving), so "is A above B" is two comparisons and a subtree is one slice.
+
+class ResellerTree:
+
+    # rows are [db_id, uuid, name, parent_db_id], parent_db_id is None for the roots
+    def __init__(self, rows=None):
+        self.rows = {}
+        self.by_uuid = {}
+        self.max_db_id = 0
+        self.add(rows or [])
+
+    def add(self, rows):
+        for row in rows:
+            db_id, uuid, name, parent_id = row
+            self.rows[db_id] = list(row)
+            self.by_uuid[uuid] = db_id
+            self.max_db_id = max(self.max_db_id, db_id)
+        self._index()
+
+    def _index(self):
+        self.children = { db_id : [] for db_id in self.rows }
+        roots = []
+        for db_id in sorted(self.rows):
+            parent_id = self.rows[db_id][3]
+            if parent_id in self.rows and parent_id != db_id:
+                self.children[parent_id].append(db_id)
+            else:
+                # a parent we've never heard of makes this a root as far as we can tell
+                roots.append(db_id)
+
+        self.order = []
+        self.enter = {}
+        self.leave = {}
+        self.depth = {}
+
+        # anything left over after walking from the roots is in a cycle, walk from there too so it gets indexed
+        for start in roots + sorted(self.rows):
+            if start in self.enter:
+                continue
+            stack = [(start, 0, False)]
+            while stack:
+                db_id, depth, leaving = stack.pop()
+                if leaving:
+                    self.leave[db_id] = len(self.order) - 1
+                    continue
+                if db_id in self.enter:
+                    continue
+                self.enter[db_id] = len(self.order)
+                self.depth[db_id] = depth
+                self.order.append(db_id)
+                stack.append((db_id, depth, True))
+                for child in reversed(self.children[db_id]):
+                    stack.append((child, depth + 1, False))
+
+    # a db_id or a uuid
+    def resolve(self, reseller):
+        if reseller in self.by_uuid:
+            return self.by_uuid[reseller]
+        try:
+            if int(reseller) in self.rows:
+                return int(reseller)
+        except ValueError:
+            pass
+        raise ValueError("Reseller {} isn't in the tree".format(reseller))
+
+    def parent(self, db_id):
+        parent_id = self.rows[db_id][3]
+        if parent_id in self.rows and self.is_ancestor(parent_id, db_id) and parent_id != db_id:
+            return parent_id
+        return None
+
+    # is `above` equal to, or an ancestor of, `below`
+    def is_ancestor(self, above, below):
+        return self.enter[above] <= self.enter[below] and self.leave[below] <= self.leave[above]
+
+    # `db_id` and everything below it, parents before children
+    def subtree(self, db_id):
+        return self.order[self.enter[db_id] : self.leave[db_id] + 1]
+
+    # from `db_id`'s parent up to its root
+    def ancestors(self, db_id):
+        result = []
+        parent_id = self.parent(db_id)
+        while parent_id is not None:
+            result.append(parent_id)
+            parent_id = self.parent(parent_id)
+        return result
+
+    def root(self, db_id):
+        return ([db_id] + self.ancestors(db_id))[-1]
+
+    # up from `start` to the lowest common ancestor, then down to `end`
+    # (None if they don't share a root)
+    def path(self, start, end):
+        up = [start] + self.ancestors(start)
+        common = next((x for x in up if self.is_ancestor(x, end)), None)
+        if common is None:
+            return None
+        down = [end] + self.ancestors(end)
+        return up[:up.index(common) + 1] + down[:down.index(common)][::-1]
+
+    def describe(self, db_id):
+        db_id, uuid, name, parent_id = self.rows[db_id]
+        return { 'db_id' : db_id, 'id' : uuid, 'name' : name, 'parent_db_id' : parent_id, 'depth' : self.depth[db_id] }
+
+# Trees are kept on disk per target. Resellers are added far more often than they're moved, so the tree is
+# topped up with rows newer than the newest one it has, and rebuilt from scratch once a day to pick up moves.
+reseller_trees = Cache('reseller_tree')
+tree_refresh_age = 60
+tree_rebuild_age = 24 * 3600
+
+def get_reseller_rows(target, after_db_id=0, printer=StatusPrinter()):
+    q = Query(target, 'metaRO', 'test321',
+            """
+            SELECT id, uuid, name, parent_id FROM reseller WHERE id > {} ORDER BY id;
+            """.format(after_db_id))
+    return q.execute(Feedback.ManyRows, lambda row : [row['id'], row['uuid'], row['name'], row['parent_id']],
+                     printer=printer) or []
+
+def get_reseller_tree(target, printer=StatusPrinter()):
+
+    key = target.get_cli_arg()
+    now = time.time()
+    cached = reseller_trees.get(key)
+    if cached and now - cached['built'] > tree_rebuild_age:
+        cached = None
+
+    if cached is None:
+        printer("Building the reseller tree for {}".format(target.get_name()))
+        with Indent(printer):
+            cached = { 'built' : now, 'refreshed' : now, 'rows' : get_reseller_rows(target, printer=printer) }
+            tree = ResellerTree(cached['rows'])
+        reseller_trees.put(key, cached)
+        return tree
+
+    tree = ResellerTree(cached['rows'])
+    if now - cached['refreshed'] > tree_refresh_age:
+        printer("Looking for resellers newer than {} on {}".format(tree.max_db_id, target.get_name()))
+        with Indent(printer):
+            new_rows = get_reseller_rows(target, tree.max_db_id, printer=printer)
+        tree.add(new_rows)
+        cached['rows'] += new_rows
+        cached['refreshed'] = now
+        reseller_trees.put(key, cached)
+
+    return tree
+
+def _print_resellers(db_ids, tree):
+    for db_id in db_ids:
+        print(json.dumps(tree.describe(db_id)))
+
+def print_reseller_subtree():
+
+    parsed_args = parse(Parseable.reseller, Parseable.target,
+                        description="Print a reseller and every reseller under it, one json line each")
+    printer = StatusPrinter(indent=0)
+
+    try:
+        tree = get_reseller_tree(parsed_args.target, printer=printer)
+        _print_resellers(tree.subtree(tree.resolve(parsed_args.reseller)), tree)
+    except ValueError as ex:
+        printer(str(ex))
+        sys.exit(30)
+
+def print_reseller_ancestors():
+
+    parsed_args = parse(Parseable.reseller, Parseable.target,
+                        description="Print a reseller's parent, its parent, and so on up to the root, one json line each")
+    printer = StatusPrinter(indent=0)
+
+    try:
+        tree = get_reseller_tree(parsed_args.target, printer=printer)
+        _print_resellers(tree.ancestors(tree.resolve(parsed_args.reseller)), tree)
+    except ValueError as ex:
+        printer(str(ex))
+        sys.exit(30)
+
+def print_reseller_path():
+
+    parsed_args = parse(Parseable.reseller, Parseable.other_reseller, Parseable.target,
+                        description="Print the resellers between two resellers (up to their common ancestor, "
+                                    "then down), one json line each")
+    printer = StatusPrinter(indent=0)
+
+    try:
+        tree = get_reseller_tree(parsed_args.target, printer=printer)
+        path = tree.path(tree.resolve(parsed_args.reseller), tree.resolve(parsed_args.otherreseller))
+        if path is None:
+            raise ValueError("{} and {} aren't in the same tree".format(parsed_args.reseller,
+                                                                        parsed_args.otherreseller))
+        _print_resellers(path, tree)
+    except ValueError as ex:
+        printer(str(ex))
+        sys.exit(30)
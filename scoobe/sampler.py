@@ -0,0 +1,158 @@
+import os
+import sys
+import time
+import random
+import hashlib
+import subprocess
+from os.path import join
+from argparse import ArgumentParser
+from scoobe.cache import Cache, scoobe_dir
+from scoobe.cli import parse, Parseable, target_from_arg
+from scoobe.common import StatusPrinter, QuietPrinter, Indent
+from scoobe.mysql import Query, Feedback
+from scoobe.server import Merchant
+
+# Picking a random merchant used to mean a big join with ORDER BY RAND(), which takes seconds on a large database.
+# Instead, the eligible merchants are listed once per target and kept on disk, then picked from locally.
+#
+# Eligible means what it always has: boarded, not closed, has a device, and belongs to one of the `recent_accounts`
+# most recently logged-in accounts. That keeps the pool (and the cache file it's kept in) small, however big the
+# merchant table is. Which accounts are recent keeps changing, so the pool is rebuilt rather than added to, once
+# it's an hour old, in a detached process so that the stale pool is used right away rather than waited on.
+
+merchant_pools = Cache('merchant_pool')
+pool_refresh_age = 3600
+recent_accounts = 100
+
+# a refresh that has been running this long has probably died
+refresh_timeout = 600
+
+def pool_key(target):
+    return target.get_cli_arg()
+
+# (db_id, uuid) of each active merchant (boarded, not closed, has a device and a recently logged-in account)
+def get_eligible_merchants(target, printer=StatusPrinter()):
+
+    printer("Listing eligible merchants among the {} most recent logins on {}".format(recent_accounts,
+                                                                                      target.get_name()))
+    with Indent(printer):
+        q = Query(target, 'metaRO', 'test321',
+                """
+                SELECT DISTINCT m.id AS db_id, m.uuid AS id
+                FROM
+                    ( SELECT primary_merchant_role_id FROM account
+                      WHERE primary_merchant_role_id IS NOT NULL
+                      ORDER BY last_login DESC LIMIT {}
+                    ) AS active_accounts
+                    JOIN merchant_role AS mr
+                        ON mr.id = active_accounts.primary_merchant_role_id
+                    JOIN merchant AS m
+                        ON m.id = mr.merchant_id
+                    JOIN merchant_boarding AS mb
+                        ON mb.merchant_id = m.id
+                            AND mb.account_status NOT IN (13, 'C', 'D', '2', '02', '3', '03')
+                WHERE EXISTS (SELECT 1 FROM merchant_device AS md WHERE md.merchant_id = m.id)
+                ORDER BY m.id;
+                """.format(recent_accounts))
+
+        return q.execute(Feedback.ManyRows, lambda row : [row['db_id'], row['id']], printer=printer) or []
+
+# rebuild the pool and store it
+def refresh_pool(target, printer=StatusPrinter()):
+
+    merchants = get_eligible_merchants(target, printer=printer)
+    pool = { 'refreshed' : time.time(), 'recent_accounts' : recent_accounts, 'merchants' : merchants }
+
+    printer("{} in the pool".format(len(merchants)))
+    merchant_pools.put(pool_key(target), pool)
+    return pool
+
+def _refresh_marker(key):
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return join(scoobe_dir('cache'), '.merchant_pool.{}.refreshing'.format(digest))
+
+# start `python -m scoobe.sampler` in its own session, unless one is already running for this target
+def start_background_refresh(target):
+
+    marker = _refresh_marker(pool_key(target))
+    try:
+        if time.time() - os.path.getmtime(marker) < refresh_timeout:
+            return False
+        os.remove(marker)
+    except OSError:
+        pass
+
+    try:
+        os.close(os.open(marker, os.O_CREAT | os.O_EXCL))
+    except FileExistsError:
+        # somebody else just started one
+        return False
+
+    args = [sys.executable, '-m', 'scoobe.sampler', pool_key(target)]
+    subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                     start_new_session=True)
+    return True
+
+# the pool as it stands, building it first if there isn't one yet
+def get_pool(target, printer=StatusPrinter()):
+
+    pool = merchant_pools.get(pool_key(target))
+
+    # one built with different criteria (or before eligibility went back to recent logins) doesn't count
+    if pool is not None and pool.get('recent_accounts') != recent_accounts:
+        pool = None
+
+    if pool is None:
+        printer("No merchant pool for {} yet, building one".format(target.get_name()))
+        with Indent(printer):
+            return refresh_pool(target, printer=printer)
+
+    age = time.time() - pool['refreshed']
+    if age > pool_refresh_age:
+        if start_background_refresh(target):
+            printer("Merchant pool is {} minutes old, rebuilding it in the background".format(int(age / 60)))
+
+    return pool
+
+# k distinct merchants, uniformly at random
+def sample_merchants(target, k=1, rng=random, printer=StatusPrinter()):
+
+    printer("Picking {} random active merchant(s) from {}".format(k, target.get_name()))
+    with Indent(printer):
+        merchants = get_pool(target, printer=printer)['merchants']
+
+    if k > len(merchants):
+        raise ValueError("Asked for {} merchants, but only {} are eligible".format(k, len(merchants)))
+
+    return [ Merchant({ 'db_id' : db_id, 'id' : uuid }) for db_id, uuid in rng.sample(merchants, k) ]
+
+def print_random_merchant():
+
+    parsed_args = parse(Parseable.target, Parseable.sample,
+                        description="Pick merchants at random (from a list of active merchants kept in ~/.scoobe)")
+    printer = StatusPrinter(indent=0)
+
+    try:
+        for merchant in sample_merchants(parsed_args.target, parsed_args.sample, printer=printer):
+            print(merchant)
+
+    except ValueError as ex:
+        printer(str(ex))
+        sys.exit(30)
+
+# what the background refresh runs
+def main():
+    parser = ArgumentParser(description="Bring the random_merchant pool for a target up to date")
+    parser.add_argument("target", type=str, help="an ssh host or the path to a *.properties file")
+    args = parser.parse_args()
+
+    try:
+        refresh_pool(target_from_arg(args.target), printer=QuietPrinter())
+    finally:
+        try:
+            os.remove(_refresh_marker(args.target))
+        except OSError:
+            pass
+
+if __name__ == '__main__':
+    main()
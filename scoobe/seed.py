@@ -0,0 +1,204 @@
+import sys
+import json
+import time
+import uuid
+import random
+import string
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from scoobe.cli import parse, Parseable
+from scoobe.common import StatusPrinter, QuietPrinter, Indent
+from scoobe.mysql import Session, Feedback
+from scoobe.properties import LocalServer
+from scoobe.server import Reseller, set_reseller, make_reseller_channel, create_plan_group, new_plan, \
+                          create_partner_control, create_merchants, register_devices, set_device_resellers, \
+                          sql_placeholders
+
+# Fills a server with made-up resellers, merchants and devices, so that there's something to load-test against
+#
+# Real data is lopsided: a few resellers own most of the merchants, most merchants have one or two devices.
+# Counts are handed out with a zipf-ish skew to get something similar.
+
+# split `total` into `buckets` integers, each at least `minimum`, with the first few buckets getting most of it
+def skewed_split(total, buckets, minimum=1, rng=random):
+    if buckets < 1:
+        return []
+    if total < buckets * minimum:
+        raise ValueError("Can't split {} into {} parts of at least {}".format(total, buckets, minimum))
+
+    counts = [minimum] * buckets
+    weights = [ 1 / (rank + 1) for rank in range(buckets) ]
+    for bucket in rng.choices(range(buckets), weights=weights, k=total - buckets * minimum):
+        counts[bucket] += 1
+    return counts
+
+# one reseller's share of the dataset
+SeedReseller = namedtuple('SeedReseller', 'name marker plans devices_per_merchant')
+
+# decide the shape of the dataset up front, so that a run can be described (and repeated, given a seed)
+def seed_plan(resellers, merchants, devices, plans_per_group=2, run_id=None, rng=random):
+    run_id = run_id or ''.join(rng.choice(string.ascii_lowercase) for _ in range(6))
+    merchant_counts = skewed_split(merchants, resellers, minimum=1, rng=rng)
+    device_counts = skewed_split(devices, merchants, minimum=0, rng=rng)
+
+    # boarding finds a reseller by its BankMarker channel, so each one gets its own
+    first_marker = rng.randrange(100000, 900000)
+
+    plan = []
+    for index, merchant_ct in enumerate(merchant_counts):
+        mine, device_counts = device_counts[:merchant_ct], device_counts[merchant_ct:]
+        plan.append(SeedReseller('seed_{}_{}'.format(run_id, index), str(first_marker + index), plans_per_group, mine))
+    return plan
+
+# made up, but they pass the serial regex in scoobe.cli
+# (they're one contiguous run, so a seed's devices never share a serial with each other)
+def seed_devices(count, rng=random):
+    first = rng.randrange(0, 10**8 - count)
+    return [ { 'serial' : 'CSED' + 'UQ' + '{:08d}'.format(first + x), 'cpuid' : uuid.UUID(int=rng.getrandbits(128)).hex }
+             for x in range(count) ]
+
+# devices for (merchant, how many) pairs, from one range that each merchant gets a slice of
+# returns (devices, serial -> reseller db id)
+def seed_merchant_devices(merchant_cts, rng=random):
+    devices = seed_devices(sum(device_ct for _, device_ct in merchant_cts), rng=rng)
+    serial2reseller = {}
+    position = 0
+    for merchant, device_ct in merchant_cts:
+        for device in devices[position:position + device_ct]:
+            device['merchant'] = merchant.id
+            serial2reseller[device['serial']] = merchant.reseller_db_id
+        position += device_ct
+    return devices, serial2reseller
+
+# times each phase of a seed, and runs the http-bound ones in parallel
+class Phases:
+
+    def __init__(self, concurrency=4, on_phase=lambda stats : None, printer=StatusPrinter()):
+        self.concurrency = concurrency
+        self.on_phase = on_phase
+        self.printer = printer
+        self.stats = []
+
+    def record(self, name, count, began):
+        elapsed = time.monotonic() - began
+        stats = { 'phase'      : name,
+                  'count'      : count,
+                  'ms'         : int(elapsed * 1000),
+                  'per_second' : round(count / max(elapsed, 1e-6), 1) }
+        self.printer("{}: {} in {} ms ({} per second)".format(name, count, stats['ms'], stats['per_second']))
+        self.stats.append(stats)
+        self.on_phase(stats)
+
+    # call fn on each item, `concurrency` at a time, and return the results in order
+    def fan_out(self, name, items, fn):
+        began = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            results = list(executor.map(fn, items))
+        self.record(name, len(results), began)
+        return results
+
+def seed(target, region, plan, concurrency=4, on_phase=lambda stats : None, rng=random, printer=StatusPrinter()):
+
+    phases = Phases(concurrency, on_phase, printer)
+    quiet = QuietPrinter()
+
+    printer("Seeding {} with {} resellers, {} merchants and {} devices".format(
+            target.get_name(), len(plan), sum(len(x.devices_per_merchant) for x in plan),
+            sum(sum(x.devices_per_merchant) for x in plan)))
+    with Indent(printer):
+
+        created = phases.fan_out('resellers', plan,
+                                 lambda x : set_reseller({ 'name' : x.name }, target, printer=quiet))
+
+        # one query for all of their row ids
+        began = time.monotonic()
+        uuids = [ x['id'] for x in created ]
+        with Session(target, 'metaRO', 'test321', printer=quiet) as session:
+            db_ids = session.execute(
+                    """
+                    SELECT id, uuid FROM reseller WHERE uuid IN ({});
+                    """.format(sql_placeholders(uuids)), Feedback.ManyRows, params=uuids)
+        db_ids = { row['uuid'] : row['id'] for row in db_ids or [] }
+        resellers = [ Reseller({ 'db_id' : db_ids[x['id']], 'id' : x['id'] }) for x in created ]
+        phases.record('reseller lookup', len(resellers), began)
+
+        phases.fan_out('channels', zip(resellers, plan),
+                       lambda x : make_reseller_channel(x[0], { 'marker' : x[1].marker }, target, printer=quiet))
+
+        plan_groups = phases.fan_out('plan groups', plan,
+                                     lambda x : create_plan_group(x.name, target, trial_days=30, printer=quiet))
+
+        plan_jobs = [ { 'name'              : '{}_plan_{}'.format(x.name, index),
+                        'description'       : 'seeded',
+                        'merchantPlanGroup' : { 'id' : group['id'] } }
+                      for x, group in zip(plan, plan_groups) for index in range(x.plans) ]
+        phases.fan_out('plans', plan_jobs, lambda x : new_plan(x, target, printer=quiet))
+
+        phases.fan_out('partner controls', zip(plan, plan_groups),
+                       lambda x : create_partner_control({ 'name'              : x[0].name,
+                                                           'enabled'           : True,
+                                                           'criteria'          : { 'BankMarker' : x[0].marker },
+                                                           'merchantPlanGroup' : { 'id' : x[1]['id'] } },
+                                                         target, printer=quiet))
+
+        # create_merchants already works in parallel, and retries shard collisions
+        began = time.monotonic()
+        merchants = []
+        failures = []
+        for reseller, seed_reseller in zip(resellers, plan):
+            reseller.channel = { 'BankMarker' : seed_reseller.marker }
+            made, failed = create_merchants(len(seed_reseller.devices_per_merchant), target, region, reseller,
+                                            concurrency=concurrency, printer=quiet)
+            merchants.append(made)
+            failures += failed
+        phases.record('merchants', sum(len(x) for x in merchants), began)
+
+        # devices are written straight to the database, a chunk at a time, then pointed at their merchants' resellers
+        began = time.monotonic()
+        devices, serial2reseller = seed_merchant_devices(
+                [ (merchant, device_ct) for made, seed_reseller in zip(merchants, plan)
+                                        for merchant, device_ct in zip(made, seed_reseller.devices_per_merchant) ],
+                rng=rng)
+        phases.record('device generation', len(devices), began)
+
+        began = time.monotonic()
+        register_devices(devices, target, printer=quiet)
+        with Session(target, 'metaRW', 'test789', printer=quiet) as session:
+            set_device_resellers(serial2reseller, session, printer=quiet)
+        phases.record('devices', len(devices), began)
+
+    return { 'resellers' : [ x.id for x in resellers ],
+             'merchants' : [ x.id for made in merchants for x in made ],
+             'devices'   : devices,
+             'failures'  : failures,
+             'phases'    : phases.stats }
+
+def print_seed():
+
+    parsed_args = parse(Parseable.seed_size, Parseable.region, Parseable.target, Parseable.concurrency,
+                        Parseable.random_seed, Parseable.force,
+                        description="Fill a local server with made-up resellers, plans, partner controls, merchants "
+                                    "and devices. Prints per-phase throughput as json lines, then a manifest of the "
+                                    "devices (for provision_many) on the last line")
+    printer = StatusPrinter(indent=0)
+
+    if not isinstance(parsed_args.target, LocalServer) and not parsed_args.force:
+        printer("{} is not a local server, use --force if you really want to fill it with junk".format(
+                parsed_args.target.get_name()))
+        sys.exit(10)
+
+    size = parsed_args.seedsize
+    rng = random.Random(parsed_args.randomseed)
+    plan = seed_plan(size.resellers, size.merchants, size.devices, rng=rng)
+
+    result = seed(parsed_args.target, parsed_args.region, plan, concurrency=parsed_args.concurrency,
+                  on_phase=lambda stats : print(json.dumps(stats), flush=True), rng=rng, printer=printer)
+
+    print(json.dumps({ 'resellers' : result['resellers'],
+                       'merchants' : result['merchants'],
+                       'devices'   : result['devices'] }))
+
+    if result['failures']:
+        for failure in result['failures']:
+            printer(json.dumps(failure))
+        sys.exit(20)
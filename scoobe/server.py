@@ -9,16 +9,27 @@ import time
 import random
 import string
 import uuid
+import zlib
+import fcntl
+import hashlib
+import socket
+import itertools
+import threading
+import functools
 import pprint as pp
 import urllib
 from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape as xml_escape
 from scoobe.cli import parse, print_or_warn, Parseable, Region
-from scoobe.common import StatusPrinter, Indent
+from scoobe.common import StatusPrinter, QuietPrinter, Indent, RateLimiter, max_line
 from scoobe.http import get, put, post, get_response_as_dict, put_response_as_dict, post_response_as_dict, Verb, internal_auth, get_creds, make_uri
 from scoobe.ssh import SshConfig, UserPass
-from scoobe.mysql import Query, Feedback
+from scoobe.mysql import Query, Session, UnitOfWork, Feedback, IntegrityError, session_or_new
 from scoobe.properties import LocalServer
+from scoobe.snapshot import export_snapshot, snapshot_suffix
+from scoobe.cache import scoobe_dir
 
 # Just verbose plumbing
 class ServerObject:
@@ -200,6 +211,21 @@ def print_device_merchant():
         printer(str(ex))
         sys.exit(30)
 
+def print_snapshot():
+
+    parsed_args = parse(Parseable.target, Parseable.output, Parseable.concurrency,
+                        description="Save the target's reference data (resellers, plans, partner controls, "
+                                    "permissions, apps...) to a file that can be used in place of the target "
+                                    "by read-only commands")
+    printer = StatusPrinter(indent=0)
+
+    target = parsed_args.target
+    path = parsed_args.output or os.path.basename(target.get_cli_arg()) + snapshot_suffix
+    if not path.endswith(snapshot_suffix):
+        path += snapshot_suffix
+
+    print(export_snapshot(target, path, concurrency=parsed_args.concurrency, printer=printer))
+
 def get_resellers(target, printer=StatusPrinter()):
 
     q = Query(target, 'metaRO', 'test321',
@@ -256,23 +282,7 @@ def get_reseller(reseller, target, identifiers_only=False, boarding_channels=Fal
     with Indent(printer):
 
         path='v3/resellers/{}'.format(reseller.id)
-
-        endpoint = '{}://{}:{}/{}'.format(
-                    target.get_hypertext_protocol(),
-                    target.get_hostname(),
-                    target.get_http_port(),
-                    path)
-
-        headers = { 'Content-Type' : 'application/json ',
-                          'Accept' : 'application/json, text/javascript, */*; q=0.01',
-                      'Connection' : 'keep-alive',
-                          'Cookie' : internal_auth(target, printer=printer) }
-
-        response = get(endpoint, headers, printer=printer)
-        if response.status_code < 200 or response.status_code > 299:
-            raise Exception("GET on {} returned code {}".format(endpoint, response.status_code))
-
-        printer(reseller.apply_response(json.loads(response.content.decode('utf-8'))))
+        printer(reseller.apply_response(get_response_as_dict(path, target, descend_once=None, printer=printer)))
 
     if boarding_channels:
 
@@ -330,26 +340,11 @@ def set_reseller(reseller_dict, target, printer=StatusPrinter()):
 
         path='v3/resellers'
 
-        endpoint = '{}://{}:{}/{}'.format(
-                    target.get_hypertext_protocol(),
-                    target.get_hostname(),
-                    target.get_http_port(),
-                    path)
-
-        headers = { 'Content-Type' : 'application/json',
-                          'Accept' : 'application/json, text/javascript, */*; q=0.01',
-                      'Connection' : 'keep-alive',
-                          'Cookie' : internal_auth(target, printer=printer) }
-
         data = reseller_dict
         printer(data)
 
-        response = post(endpoint, headers, data, printer=printer)
-
-        if response.status_code < 200 or response.status_code > 299:
-            raise Exception("POST on {} returned code {}".format(endpoint, response.status_code))
-
-        return json.loads(response.content.decode('utf-8'))
+        # shares the target's login with every other request (seed calls this once per reseller)
+        return post_response_as_dict(path, target, data, printer=printer)
 
 def print_set_reseller():
 
@@ -543,43 +538,51 @@ def print_acceptedness():
 
     print(acceptedness)
 
+# the read and the write happen in one transaction, with the row locked in between
 def set_acceptedness(target, merchant_id, value, printer=StatusPrinter()):
 
-    printer("Checking Current Value")
-    with Indent(printer):
-        current_value = get_acceptedness(target, merchant_id, printer=printer)
-
-    # if no setting exists to frob
-    if not(current_value):
+    with Session(target, 'metaRW', 'test789', printer, transaction=True) as session:
 
-        # warn, loudness depends on desired setting
-        printer("Acceptedness is undefined for this merchant.  Have they gone through OOBE once already?")
-        if value == '1':
-            raise ValueError("Acceptedness setting does not exist, cannot enable it")
-        else:
-            # missing setting is equivaluent to disabled acceptedness, fail quietly
-            pass
+        printer("Checking Current Value")
+        with Indent(printer):
+            current_value = session.execute(
+                    """
+                    SELECT value
+                    FROM setting
+                    WHERE merchant_id = {} AND name = 'ACCEPTED_BILLING_TERMS'
+                    FOR UPDATE;
+                     """.format(merchant_id), Feedback.OneRow, lambda row: row['value'])
+
+        # if no setting exists to frob
+        if not(current_value):
+
+            # warn, loudness depends on desired setting
+            printer("Acceptedness is undefined for this merchant.  Have they gone through OOBE once already?")
+            if value == '1':
+                raise ValueError("Acceptedness setting does not exist, cannot enable it")
+            else:
+                # missing setting is equivaluent to disabled acceptedness, fail quietly
+                pass
 
-        return
+            return
 
-    # if this action would produce an actual change, go ahead
-    if str(current_value) != str(value):
+        # if this action would produce an actual change, go ahead
+        if str(current_value) != str(value):
 
-        printer("Updating Value")
-        with Indent(printer):
-            q = Query(target, 'metaRW', 'test789',
-                    """
-                    UPDATE setting SET value = '{}'
-                    WHERE merchant_id = {} AND name = 'ACCEPTED_BILLING_TERMS';
-                     """.format(value, merchant_id))
+            printer("Updating Value")
+            with Indent(printer):
+                rows_changed = session.execute(
+                        """
+                        UPDATE setting SET value = '{}'
+                        WHERE merchant_id = {} AND name = 'ACCEPTED_BILLING_TERMS';
+                         """.format(value, merchant_id), Feedback.ChangeCount)
 
-            rows_changed = q.execute(Feedback.ChangeCount, printer=printer)
-            if rows_changed != 1:
-                raise ValueError("Expected 1 change to table: setting, instead made {}".format(rows_changed))
+                if rows_changed != 1:
+                    raise ValueError("Expected 1 change to table: setting, instead made {}".format(rows_changed))
 
-    # Otherwise warn and quietly continue
-    else:
-        printer("No Change Needed")
+        # Otherwise warn and quietly continue
+        else:
+            printer("No Change Needed")
 
 def set_activation_code(target, serial, value, printer=StatusPrinter()):
 
@@ -589,31 +592,14 @@ def set_activation_code(target, serial, value, printer=StatusPrinter()):
 
     if old_value != value:
 
-        printer("Setting New Value")
-        with Indent(printer):
-            q = Query(target, 'metaRW', 'test789',
-                    """
-                    UPDATE device_provision SET activation_code = {}
-                    WHERE serial_number = '{}';
-                     """.format(value, serial))
-
-            rows_changed = q.execute(Feedback.ChangeCount, printer=printer)
-
-            if rows_changed != 1:
-                raise ValueError("Expected 1 change to device_provision, instead got {}".format(rows_changed))
-
-        printer("Updating Historical Value")
-        with Indent(printer):
-            q = Query(target, 'metaRW', 'test789',
-                    """
-                    UPDATE device_provision SET last_activation_code = {}
-                    WHERE serial_number = '{}';
-                     """.format(old_value, serial))
-
-            rows_changed = q.execute(Feedback.ChangeCount, printer=printer)
-
-            if rows_changed != 1:
-                raise ValueError("Expected 1 change to device_provision, instead got {}".format(rows_changed))
+        printer("Setting New Value and Updating Historical Value")
+        with Indent(printer), UnitOfWork(target, 'metaRW', 'test789', printer) as work:
+            # one statement, so the change count is 1 even when the historical value was already old_value
+            # (mysql assigns left to right, so last_activation_code gets the code being replaced)
+            work.add("""
+                     UPDATE device_provision SET last_activation_code = activation_code, activation_code = {}
+                     WHERE serial_number = '{}';
+                     """.format(value, serial), expect=1)
 
     else:
 
@@ -716,10 +702,10 @@ def accept():
 
 
 # given a url and a server, get the auth token for that url on that server
-def get_auth_token(target, url, printer=StatusPrinter()):
+# (pass a session to use its connection instead of opening a new one)
+def get_auth_token(target, url, printer=StatusPrinter(), session=None):
 
-    q = Query(target, 'metaRO', 'test321',
-            """
+    sql = """
             SELECT HEX(at.uuid)
             FROM authtoken at
             JOIN authtoken_uri atu
@@ -728,15 +714,31 @@ def get_auth_token(target, url, printer=StatusPrinter()):
                     atu.uri = '{}'
                 AND
                     at.deleted_time IS NULL LIMIT 1;
-            """.format(url))
+            """.format(url)
 
-    auth_token = q.execute(Feedback.OneRow, lambda row: row['HEX(at.uuid)'], printer=printer)
+    if session:
+        auth_token = session.execute(sql, Feedback.OneRow, lambda row: row['HEX(at.uuid)'])
+    else:
+        auth_token = Query(target, 'metaRO', 'test321', sql).execute(
+                Feedback.OneRow, lambda row: row['HEX(at.uuid)'], printer=printer)
 
     if not re.match(r'^[A-Z0-9]+$', auth_token):
         raise ValueError("Http header: 'AUTHORIZATION : BEARER {}' doesn't seem right.".format(auth_token))
 
     return auth_token
 
+provision_uri = '/v3/partner/pp/merchants/{mId}/devices/{serialNumber}/provision'
+deprovision_uri = '/v3/partner/pp/merchants/{mId}/devices/{serialNumber}/deprovision'
+
+# action is 'provision' or 'deprovision'
+def partner_device_endpoint(target, merchant_uuid, serial, action):
+    return '{}://{}/v3/partner/pp/merchants/{}/devices/{}/{}'.format(
+            target.get_hypertext_protocol(),
+            target.get_hostname() + ":" + str(target.get_http_port()),
+            merchant_uuid,
+            serial,
+            action)
+
 # deprovision device from merchant
 def deprovision():
 
@@ -753,19 +755,14 @@ def deprovision():
 
             printer("Getting the deprovision auth token according to {}".format(parsed_args.target.get_name()))
             with Indent(printer):
-                auth_token = get_auth_token(parsed_args.target,
-                        '/v3/partner/pp/merchants/{mId}/devices/{serialNumber}/deprovision')
+                auth_token = get_auth_token(parsed_args.target, deprovision_uri)
 
             printer("Requesting that {} deprovision the device".format(parsed_args.target.get_name()))
             with Indent(printer):
 
                 merchant = get_merchant(merchant_id, parsed_args.target, printer=printer)
 
-                endpoint = '{}://{}/v3/partner/pp/merchants/{}/devices/{}/deprovision'.format(
-                            parsed_args.target.get_hypertext_protocol(),
-                            parsed_args.target.get_hostname() + ":" + str(parsed_args.target.get_http_port()),
-                            merchant.id,
-                            parsed_args.serial)
+                endpoint = partner_device_endpoint(parsed_args.target, merchant.id, parsed_args.serial, 'deprovision')
 
                 headers = { 'Authorization' : 'Bearer ' + auth_token }
 
@@ -785,6 +782,49 @@ def deprovision():
 
     printer('OK')
 
+# Everything provision needs to know, in one round trip:
+# the merchant's identifiers, its reseller, the device's current reseller, and the provision auth token
+# (device columns are NULL if the server has never heard of the device)
+def get_provision_context(serial, merchant, session):
+
+    if is_uuid(merchant):
+        key='uuid'
+    else:
+        key='id'
+
+    context = session.execute(
+            """
+            SELECT m.id AS db_id,
+                   m.uuid AS id,
+                   m.reseller_id AS reseller_db_id,
+                   r.uuid AS reseller_id,
+                   dp.serial_number AS serial,
+                   dp.reseller_id AS device_reseller_db_id,
+                   (SELECT HEX(at.uuid)
+                    FROM authtoken at
+                    JOIN authtoken_uri atu
+                        ON at.id = atu.authtoken_id
+                    WHERE
+                            atu.uri = '{}'
+                        AND
+                            at.deleted_time IS NULL LIMIT 1) AS auth_token
+            FROM merchant AS m
+            JOIN reseller AS r
+                ON m.reseller_id = r.id
+            LEFT JOIN device_provision AS dp
+                ON dp.serial_number = '{}'
+            WHERE m.{} = '{}';
+            """.format(provision_uri, serial, key, merchant),
+            Feedback.OneRow)
+
+    if not context:
+        raise ValueError("merchant {} does not exist on {}".format(merchant, session.target.get_name()))
+
+    if not re.match(r'^[A-Z0-9]+$', str(context['auth_token'])):
+        raise ValueError("Http header: 'AUTHORIZATION : BEARER {}' doesn't seem right.".format(context['auth_token']))
+
+    return context
+
 # provision device for merchant
 def provision():
 
@@ -793,43 +833,52 @@ def provision():
     printer("Provisioning Device")
     with Indent(printer):
 
-        printer("Checking Merchant Reseller")
-        with Indent(printer):
-            merchant = get_merchant(parsed_args.merchant, parsed_args.target, printer=printer)
-            merchant_reseller = get_reseller(merchant.reseller_id, parsed_args.target, printer=printer)
-
-        printer("Ensuring device/merchant resellers match")
-        with Indent(printer):
-
-            try:
-                success = set_device_reseller(parsed_args.serial, parsed_args.target, merchant_reseller, printer=printer)
-            except ValueError as err:
-                if "not associated" in str(err):
-                    printer("Device not provisioned, so no conflicting reseller exists")
-                    success = True
-
-            # only proceed to provision if target merchant's reseller doesn't conflict
-            if not success:
-                sys.exit(313)
+        try:
+            # one tunnel, one connection, and usually just one query
+            with Session(parsed_args.target, 'metaRW', 'test789', printer=printer) as session:
+
+                printer("Finding merchant, reseller, device, and auth token")
+                with Indent(printer):
+                    context = get_provision_context(parsed_args.serial, parsed_args.merchant, session)
+
+                printer("Ensuring device/merchant resellers match")
+                with Indent(printer):
+
+                    if context['serial'] is None:
+                        printer("Device not provisioned, so no conflicting reseller exists")
+
+                    elif str(context['device_reseller_db_id']) == str(context['reseller_db_id']):
+                        printer("The device's current reseller is the same as the merchant's ({}). Making no change."
+                                .format(context['reseller_db_id']))
+
+                    else:
+                        printer("Changing the device's reseller: {} -> {}".format(
+                            context['device_reseller_db_id'], context['reseller_db_id']))
+                        with Indent(printer):
+                            rows_changed = session.execute(
+                                    """
+                                    UPDATE device_provision
+                                    SET reseller_id = {}
+                                    WHERE serial_number = '{}';
+                                    """.format(context['reseller_db_id'], parsed_args.serial),
+                                    Feedback.ChangeCount)
+
+                            if rows_changed != 1:
+                                raise ValueError("Expected 1 change to device_provision, instead got {}"
+                                                 .format(rows_changed))
 
-        printer("Getting provision endpoint auth token")
-        with Indent(printer):
-            auth_token = get_auth_token(parsed_args.target,
-                    '/v3/partner/pp/merchants/{mId}/devices/{serialNumber}/provision',
-                    printer=printer)
+        except ValueError as ex:
+            printer(str(ex))
+            sys.exit(30)
 
         printer("Provisioning device to merchant")
         with Indent(printer):
 
-            endpoint = '{}://{}/v3/partner/pp/merchants/{}/devices/{}/provision'.format(
-                    parsed_args.target.get_hypertext_protocol(),
-                    parsed_args.target.get_hostname() + ":" + str(parsed_args.target.get_http_port()),
-                    merchant.id,
-                    parsed_args.serial)
+            endpoint = partner_device_endpoint(parsed_args.target, context['id'], parsed_args.serial, 'provision')
 
-            headers = {'Authorization' : 'Bearer ' + auth_token }
+            headers = {'Authorization' : 'Bearer ' + context['auth_token'] }
 
-            data = { 'merchantUuid': merchant.id,
+            data = { 'merchantUuid': context['id'],
                      'serial': parsed_args.serial,
                      'chipUid': parsed_args.cpuid }
 
@@ -841,6 +890,214 @@ def provision():
         printer('Error')
         sys.exit(20)
 
+# one %s placeholder per value, for `IN (...)` lists that are filled in by session.execute's params
+def sql_placeholders(values):
+    return ', '.join('%s' for value in values)
+
+# Everything provision_many needs to know about a batch of manifest rows, on one session:
+# one query for the merchants, one for the devices, one for the auth token
+# returns (merchants by id and uuid, devices by serial, auth token)
+def get_bulk_provision_context(rows, session, uri, printer=StatusPrinter()):
+
+    merchant_keys = set(str(row['merchant']) for row in rows if row.get('merchant'))
+    uuids = [ x for x in merchant_keys if is_uuid(x) ]
+    ids = [ int(x) for x in merchant_keys if not is_uuid(x) ]
+    serials = sorted(set(row['serial'] for row in rows))
+
+    merchants = {}
+    if merchant_keys:
+        # uuids and row ids are looked up separately, mysql would compare a uuid to the (numeric) id column as 0
+        conditions = []
+        if uuids:
+            conditions.append("uuid IN ({})".format(sql_placeholders(uuids)))
+        if ids:
+            conditions.append("id IN ({})".format(sql_placeholders(ids)))
+
+        printer("Finding {} merchants".format(len(merchant_keys)))
+        with Indent(printer):
+            found = session.execute(
+                    """
+                    SELECT id AS db_id, uuid AS id, reseller_id AS reseller_db_id
+                    FROM merchant
+                    WHERE {};
+                    """.format(' OR '.join(conditions)),
+                    Feedback.ManyRows, params=uuids + ids) or []
+        for merchant in found:
+            merchants[str(merchant['db_id'])] = merchant
+            merchants[str(merchant['id'])] = merchant
+
+    printer("Finding {} devices".format(len(serials)))
+    with Indent(printer):
+        found = session.execute(
+                """
+                SELECT dp.serial_number AS serial,
+                       dp.reseller_id AS reseller_db_id,
+                       m.uuid AS merchant_id
+                FROM device_provision AS dp
+                LEFT JOIN merchant AS m
+                    ON m.id = dp.merchant_id
+                WHERE dp.serial_number IN ({});
+                """.format(sql_placeholders(serials)),
+                Feedback.ManyRows, params=serials) or []
+    devices = { device['serial'] : device for device in found }
+
+    printer("Getting auth token for {}".format(uri))
+    with Indent(printer):
+        auth_token = get_auth_token(session.target, uri, session=session)
+
+    return (merchants, devices, auth_token)
+
+# move known devices to their merchants' resellers, in one statement
+def set_device_resellers(serial2reseller, session, printer=StatusPrinter()):
+
+    if not serial2reseller:
+        printer("All device resellers already match their merchants'")
+        return
+
+    printer("Changing {} devices' resellers".format(len(serial2reseller)))
+    with Indent(printer):
+        serials = list(serial2reseller)
+        cases = ' '.join('WHEN %s THEN %s' for serial in serials)
+        params = [ x for serial in serials for x in (serial, serial2reseller[serial]) ] + serials
+        rows_changed = session.execute(
+                """
+                UPDATE device_provision
+                SET reseller_id = CASE serial_number {} END
+                WHERE serial_number IN ({});
+                """.format(cases, sql_placeholders(serials)),
+                Feedback.ChangeCount, params=params)
+
+        if rows_changed != len(serial2reseller):
+            raise ValueError("Expected {} changes to device_provision, instead got {}".format(
+                len(serial2reseller), rows_changed))
+
+# PUT to the partner device endpoint once per job, at most `concurrency` at a time and at most `rate` per second
+# jobs are dicts with 'row', 'serial', 'merchant_uuid' and 'data' (or with 'error' if they shouldn't be attempted)
+# calls on_result with each result as it completes and returns all of them in row order
+def put_partner_devices(jobs, target, auth_token, action, concurrency=4, rate=None, on_result=lambda result : None):
+
+    limiter = RateLimiter(rate)
+    headers = { 'Authorization' : 'Bearer ' + auth_token }
+
+    def do_job(job):
+        result = { 'row' : job['row'], 'serial' : job['serial'], 'merchant' : job.get('merchant_uuid') }
+
+        if 'error' in job:
+            result.update({ 'ok' : False, 'error' : job['error'] })
+            return result
+
+        limiter.wait()
+        began = time.monotonic()
+        try:
+            endpoint = partner_device_endpoint(target, job['merchant_uuid'], job['serial'], action)
+            response = put(endpoint, headers, job['data'], printer=QuietPrinter())
+            result.update({ 'ok'     : response.status_code == 200,
+                            'status' : response.status_code })
+            if response.status_code != 200:
+                result['error'] = response.content.decode('utf-8', 'replace')[:max_line]
+        except Exception as ex:
+            result.update({ 'ok' : False, 'error' : str(ex) })
+        result['ms'] = int((time.monotonic() - began) * 1000)
+        return result
+
+    results = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in as_completed([ executor.submit(do_job, job) for job in jobs ]):
+            result = future.result()
+            on_result(result)
+            results.append(result)
+
+    return sorted(results, key=lambda result : result['row'])
+
+# provision many devices, given rows of {'serial', 'cpuid', 'merchant'}
+def provision_many(rows, target, concurrency=4, rate=None, on_result=lambda result : None, printer=StatusPrinter()):
+
+    printer("Provisioning {} devices".format(len(rows)))
+    with Indent(printer):
+
+        with Session(target, 'metaRW', 'test789', printer=printer) as session:
+            merchants, devices, auth_token = get_bulk_provision_context(rows, session, provision_uri, printer=printer)
+
+            jobs = []
+            serial2reseller = {}
+            for index, row in enumerate(rows):
+                job = { 'row' : index, 'serial' : row['serial'] }
+                merchant = merchants.get(str(row.get('merchant')))
+
+                if not merchant:
+                    job['error'] = "merchant {} does not exist on {}".format(row.get('merchant'), target.get_name())
+                else:
+                    job['merchant_uuid'] = merchant['id']
+                    job['data'] = { 'merchantUuid' : merchant['id'],
+                                    'serial'       : row['serial'],
+                                    'chipUid'      : row.get('cpuid') }
+
+                    # devices the server hasn't heard of have no conflicting reseller
+                    device = devices.get(row['serial'])
+                    if device and str(device['reseller_db_id']) != str(merchant['reseller_db_id']):
+                        serial2reseller[row['serial']] = merchant['reseller_db_id']
+                jobs.append(job)
+
+            set_device_resellers(serial2reseller, session, printer=printer)
+
+        printer("Provisioning, {} at a time{}".format(concurrency, " ({}/s max)".format(rate) if rate else ""))
+        return put_partner_devices(jobs, target, auth_token, 'provision', concurrency, rate, on_result)
+
+# deprovision many devices, given rows of {'serial'}
+def deprovision_many(rows, target, concurrency=4, rate=None, on_result=lambda result : None, printer=StatusPrinter()):
+
+    printer("Deprovisioning {} devices".format(len(rows)))
+    with Indent(printer):
+
+        with Session(target, 'metaRO', 'test321', printer=printer) as session:
+            _, devices, auth_token = get_bulk_provision_context(rows, session, deprovision_uri, printer=printer)
+
+        jobs = []
+        for index, row in enumerate(rows):
+            job = { 'row' : index, 'serial' : row['serial'] }
+            device = devices.get(row['serial'])
+
+            if not device or not device['merchant_id']:
+                job['error'] = "this device is not associated with a merchant on {}".format(target.get_name())
+            else:
+                job['merchant_uuid'] = device['merchant_id']
+                job['data'] = {}
+            jobs.append(job)
+
+        printer("Deprovisioning, {} at a time{}".format(concurrency, " ({}/s max)".format(rate) if rate else ""))
+        return put_partner_devices(jobs, target, auth_token, 'deprovision', concurrency, rate, on_result)
+
+def _print_many(verb):
+
+    parsed_args = parse(Parseable.manifest, Parseable.target, Parseable.concurrency, Parseable.rate_limit,
+                        description="{} the devices listed in a csv or json-lines manifest, ".format(verb.__name__) +
+                                    "printing one json line per row")
+    printer = StatusPrinter(indent=0)
+
+    # these look up every row's merchant and device up front, so they need the whole manifest
+    # (which is read before anything is sent, so a bad row stops the run before it starts)
+    try:
+        rows = list(parsed_args.manifest)
+        results = verb(rows, parsed_args.target,
+                       concurrency=parsed_args.concurrency,
+                       rate=parsed_args.ratelimit,
+                       on_result=lambda result : print(json.dumps(result), flush=True),
+                       printer=printer)
+    except ValueError as ex:
+        printer(str(ex))
+        sys.exit(30)
+
+    failures = len([ x for x in results if not x['ok'] ])
+    printer("{} of {} rows failed".format(failures, len(results)))
+    if failures:
+        sys.exit(20)
+
+def print_provision_many():
+    _print_many(provision_many)
+
+def print_deprovision_many():
+    _print_many(deprovision_many)
+
 us_path="/cos/v1/partner/fdc/create_merchant"
 us_xml = """
 <XMLRequest xmlns="http://soap.1dc.com/schemas/class/Crimson">
@@ -1018,32 +1275,131 @@ eu_xml = """
 </CloverBoardingRequest>
 """
 
-def create_merchant(target, region, reseller, printer=StatusPrinter()):
-
-    unique_str = str(datetime.datetime.utcnow().strftime('%s'))
-    merchant_str = "merchant_" + unique_str + "BOARD_TO_SHARD_0"
-    mid = int(unique_str)
+BoardingTemplate = namedtuple('BoardingTemplate', 'toplevel path template')
+boarding_templates = { 'US' : BoardingTemplate('XMLRequest', us_path, us_xml),
+                       'EU' : BoardingTemplate('CloverBoardingRequest', eu_path, eu_xml) }
+
+# The straightforward way to make a boarding payload:
+# fill in the template, parse it, set the channel tag, and unparse the whole thing
+# (too slow for boarding thousands of merchants, see CompiledBoardingTemplate)
+def unparse_boarding_xml(region, mid, bemid, merchant_str, channel_tag, channel_value):
+
+    toplevel, _, template = boarding_templates[region]
+
+    xml_d = xmltodict.parse(template.format(mid=mid, bemid=bemid, merchant_str=merchant_str))
+    xml_d[toplevel]['MerchantDetail'][channel_tag] = channel_value
+    return xmltodict.unparse(xml_d)
+
+# A boarding payload with the xml work done ahead of time.
+# The slow path is run once with a marker in each slot, and its output is split at the markers.
+# Rendering is then a single str.format, with the slot values escaped the way xmltodict would have escaped them.
+class CompiledBoardingTemplate:
+
+    slots = ['mid', 'bemid', 'merchant_str', 'channel_value']
+
+    def __init__(self, region, channel_tag):
+        marker2slot = { 'scOOBEslot{}marker'.format(i) : slot for i, slot in enumerate(CompiledBoardingTemplate.slots) }
+        slot2marker = { slot : marker for marker, slot in marker2slot.items() }
+
+        rendered = unparse_boarding_xml(region, channel_tag=channel_tag, **slot2marker)
+
+        # escape the literal text for str.format, then swap markers for fields
+        self.format_str = rendered.replace('{', '{{').replace('}', '}}')
+        for marker, slot in marker2slot.items():
+            self.format_str = self.format_str.replace(marker, '{' + slot + '}')
+
+    # match xmltodict.unparse's handling of non-string values
+    def _text(value):
+        if isinstance(value, bool):
+            value = 'true' if value else 'false'
+        return xml_escape(str(value))
+
+    def render(self, **values):
+        return self.format_str.format(**{ slot : CompiledBoardingTemplate._text(value)
+                                          for slot, value in values.items() })
+
+# one compiled template per region and channel tag, since the tag decides where the channel goes
+@functools.lru_cache(maxsize=None)
+def compiled_boarding_template(region, channel_tag):
+    return CompiledBoardingTemplate(region, channel_tag)
+
+# Merchant numbers that don't repeat, even when many are made at once by many processes or hosts.
+# The BE merchant number is 8000000000 - mid, so mids have to fit in about 32 bits above `base` (which is above
+# every mid the old epoch-seconds scheme made). They're handed out in ranges of 2**16:
+#   - a host claims a range at random (from its hostname, pid, clock and os.urandom) and records it in
+#     SCOOBE_HOME, so another host (or a container, with its own SCOOBE_HOME) claims the same one only 1 time in
+#     65536, and never one this host has already had
+#   - processes on the host count through the range under an flock on that record, so they never repeat a mid,
+#     however many run at once and whatever their pids
+#   - a used-up range is replaced by a newly claimed one
+# (mids stay below base + 2**32, so the BE number never drops below 1700000000)
+class MerchantIdGenerator:
+
+    base = 2000000000
+    range_bits = 16
+
+    # `entropy` replaces the host's randomness when claiming ranges (for tests)
+    def __init__(self, path=None, entropy=None):
+        self.path = path
+        self.entropy = entropy
+        self.lock = threading.Lock()
+
+    def _claim(self, claimed):
+        entropy = self.entropy or '{}:{}:{}:{}'.format(socket.gethostname(), os.getpid(), time.time(),
+                                                        os.urandom(16).hex())
+        for attempt in itertools.count():
+            digest = hashlib.sha1('{}:{}'.format(entropy, attempt).encode('utf-8')).digest()
+            candidate = int.from_bytes(digest[:4], 'big') >> (32 - MerchantIdGenerator.range_bits)
+            if candidate not in claimed:
+                return candidate
+
+    def next(self):
+        with self.lock, open(self.path or os.path.join(scoobe_dir(), 'merchant_ids.json'), 'a+') as state_file:
+            fcntl.flock(state_file, fcntl.LOCK_EX)
+            state_file.seek(0)
+            try:
+                state = json.loads(state_file.read())
+            except ValueError:
+                state = { 'ranges' : [], 'next' : 0 }
+
+            if not state['ranges'] or state['next'] >= 2 ** MerchantIdGenerator.range_bits:
+                state['ranges'].append(self._claim(state['ranges']))
+                state['next'] = 0
+            mid = (MerchantIdGenerator.base + (state['ranges'][-1] << MerchantIdGenerator.range_bits) +
+                   state['next'])
+            state['next'] += 1
+
+            state_file.seek(0)
+            state_file.truncate()
+            state_file.write(json.dumps(state))
+        return mid
+
+merchant_ids = MerchantIdGenerator()
+
+# the server sometimes tries to board to a shard that doesn't exist, trying again usually works
+class PriorPlacementError(Exception):
+    pass
+
+# returns the new merchant's uuid
+# pass a cookie to skip logging in (when creating many merchants, log in once)
+def create_merchant(target, region, reseller, mid=None, cookie=None, printer=StatusPrinter()):
+
+    if mid is None:
+        mid = merchant_ids.next()
+    merchant_str = "merchant_" + str(mid) + "BOARD_TO_SHARD_0"
     bemid = 8000000000 - mid
 
-    if str(region) == 'US':
-        toplevel='XMLRequest'
-        path=us_path
-        template=us_xml
-    elif str(region) == 'EU':
-        toplevel='CloverBoardingRequest'
-        path=eu_path
-        template=eu_xml
-    else:
+    if str(region) not in boarding_templates:
         raise ValueError("Unknown country code: {}".format(region))
-
-    xml_d = xmltodict.parse(template.format(**locals()))
+    path = boarding_templates[str(region)].path
 
     # use reseller's first channel if defined, otherwise use reseller uuid
     tag, value = list(reseller.channel.items())[0]
 
-    xml_d[toplevel]['MerchantDetail'][tag] = value
-
-    xml = xmltodict.unparse(xml_d)
+    xml = compiled_boarding_template(str(region), tag).render(mid=mid,
+                                                              bemid=bemid,
+                                                              merchant_str=merchant_str,
+                                                              channel_value=value)
 
     printer(xml)
 
@@ -1055,7 +1411,7 @@ def create_merchant(target, region, reseller, printer=StatusPrinter()):
 
     headers = { 'Content-Type' : 'text/plain',
                       'Accept' : '*/*',
-                      'Cookie' : internal_auth(target, printer=printer)}
+                      'Cookie' : cookie or internal_auth(target, printer=printer)}
 
     data = xml
 
@@ -1063,12 +1419,77 @@ def create_merchant(target, region, reseller, printer=StatusPrinter()):
 
     content = response.content.decode('utf-8')
     if 'prior placement' in content:
-        raise Exception("The remote server tried to board this merchant to a nonexistent shard, maybe try again a few times.")
+        raise PriorPlacementError("The remote server tried to board this merchant to a nonexistent shard, "
+                                  "maybe try again a few times.")
 
 
     response_dict = xmltodict.parse(content)
     return response_dict['XMLResponse']['Merchant']['UUID']
 
+# given a list of merchant uuids, get their identifiers with one query
+def get_merchants(uuids, target, printer=StatusPrinter()):
+
+    printer("Finding {} merchants' identifiers according to {}".format(len(uuids), target.get_name()))
+    with Indent(printer):
+
+        if not uuids:
+            return []
+
+        q = Query(target, 'metaRO', 'test321',
+                """
+                SELECT m.id AS db_id,
+                       m.uuid AS id,
+                       m.reseller_id AS reseller_db_id,
+                       m.merchant_plan_id AS merchant_plan_db_id,
+                       mp.uuid as plan_id,
+                       mr.uuid as reseller_id
+                FROM merchant AS m
+                JOIN merchant_plan AS mp
+                    ON m.merchant_plan_id = mp.id
+                JOIN reseller AS mr
+                    ON m.reseller_id = mr.id
+                WHERE m.uuid IN ({});
+                """.format(sql_placeholders(uuids)), params=list(uuids))
+
+        return q.execute(Feedback.ManyRows, lambda row : Merchant(row), printer=printer) or []
+
+# board `count` merchants to `reseller`, at most `concurrency` at a time
+# shard errors are retried (with a fresh mid) up to `attempts` times, backing off exponentially
+# returns (merchants, failures), where failures are dicts describing the merchants that couldn't be boarded
+def create_merchants(count, target, region, reseller, concurrency=4, attempts=5, printer=StatusPrinter()):
+
+    printer("Logging in once for all {} merchants".format(count))
+    with Indent(printer):
+        cookie = internal_auth(target, printer=printer)
+
+    def board(index):
+        backoff = 0.5
+        for attempt in range(1, attempts + 1):
+            mid = merchant_ids.next()
+            try:
+                return { 'row' : index, 'mid' : mid, 'attempts' : attempt,
+                         'uuid' : create_merchant(target, region, reseller, mid=mid, cookie=cookie,
+                                                  printer=QuietPrinter()) }
+            except PriorPlacementError as err:
+                if attempt == attempts:
+                    return { 'row' : index, 'mid' : mid, 'attempts' : attempt, 'error' : str(err) }
+                time.sleep(backoff * (1 + random.random()))
+                backoff *= 2
+            except Exception as err:
+                return { 'row' : index, 'mid' : mid, 'attempts' : attempt, 'error' : str(err) }
+
+    printer("Boarding {} merchants, {} at a time".format(count, concurrency))
+    with Indent(printer):
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(board, range(count)))
+
+        retried = sum(x['attempts'] - 1 for x in results)
+        failures = [ x for x in results if 'error' in x ]
+        printer("Boarded {}, {} failed, {} shard retries".format(count - len(failures), len(failures), retried))
+
+    merchants = get_merchants([ x['uuid'] for x in results if 'uuid' in x ], target, printer=printer)
+    return (merchants, failures)
+
 # return true if desired state is achieved
 # whether or not this function made a change
 def set_merchant_reseller(merchant, target, target_reseller, printer=StatusPrinter()):
@@ -1118,6 +1539,16 @@ def print_set_merchant_reseller():
                 set_merchant_reseller(merchant, parsed_args.target, reseller, printer=printer)
     printer("OK")
 
+# the reseller to board to, with the channel that new merchants should be boarded on
+def get_boarding_reseller(reseller, target, match_criteria=None, printer=StatusPrinter()):
+    if match_criteria:
+        reseller = get_reseller(reseller, target, boarding_channels=False, printer=printer)
+        reseller.channel = {}
+        reseller.channel.update(match_criteria)
+    else:
+        reseller = get_reseller(reseller, target, boarding_channels=True, printer=printer)
+    return reseller
+
 def print_new_merchant():
 
     parsed_args = parse(Parseable.region, Parseable.reseller, Parseable.partner_control_match_criteria, Parseable.target)
@@ -1125,12 +1556,8 @@ def print_new_merchant():
 
     printer("Creating New Merchant")
     with Indent(printer):
-        if parsed_args.partnercontrolmatchcriteria:
-            reseller = get_reseller(parsed_args.reseller, parsed_args.target, boarding_channels=False, printer=printer)
-            reseller.channel = {}
-            reseller.channel.update(parsed_args.partnercontrolmatchcriteria)
-        else:
-            reseller = get_reseller(parsed_args.reseller, parsed_args.target, boarding_channels=True, printer=printer)
+        reseller = get_boarding_reseller(parsed_args.reseller, parsed_args.target,
+                                         parsed_args.partnercontrolmatchcriteria, printer=printer)
 
         printer("Targeting reseller {}".format(reseller))
         uid = create_merchant(parsed_args.target, parsed_args.region, reseller, printer=printer)
@@ -1139,6 +1566,30 @@ def print_new_merchant():
     if merchant:
         print(merchant)
 
+def print_new_merchants():
+
+    parsed_args = parse(Parseable.quantity, Parseable.region, Parseable.reseller,
+                        Parseable.partner_control_match_criteria, Parseable.target, Parseable.concurrency,
+                        description="Create many merchants at once, printing one json line per merchant")
+    printer = StatusPrinter(indent=0)
+
+    printer("Creating {} New Merchants".format(parsed_args.quantity))
+    with Indent(printer):
+        reseller = get_boarding_reseller(parsed_args.reseller, parsed_args.target,
+                                         parsed_args.partnercontrolmatchcriteria, printer=printer)
+
+        printer("Targeting reseller {}".format(reseller))
+        merchants, failures = create_merchants(parsed_args.quantity, parsed_args.target, parsed_args.region, reseller,
+                                               concurrency=parsed_args.concurrency, printer=printer)
+
+    for merchant in merchants:
+        print(merchant)
+
+    if failures:
+        for failure in failures:
+            printer(json.dumps(failure))
+        sys.exit(20)
+
 def get_plan_groups(target, printer=StatusPrinter()):
 
     printer("Finding plan_groups according to {}".format(target.get_name()))
@@ -1209,6 +1660,20 @@ def create_plan_group(name, target, trial_days=None, enforce_plan_assignment=Fal
 
         return post_response_as_dict(path, target, data, printer=printer)
 
+# like create_plan_group, but takes the whole plan group as json
+def new_plan_group(plan_group_dict, target, printer=StatusPrinter()):
+
+    printer("[Creating a plan group from supplied json]")
+    with Indent(printer):
+        return post_response_as_dict('v3/merchant_plan_groups', target, plan_group_dict, printer=printer)
+
+def set_plan_group(plan_group_dict, target, printer=StatusPrinter()):
+
+    printer("[Updating plan group from supplied json]")
+    with Indent(printer):
+        path='v3/merchant_plan_groups/{}'.format(plan_group_dict['id'])
+        return put_response_as_dict(path, target, plan_group_dict, printer=printer)
+
 def print_new_plan_group():
 
     parsed_args = parse(Parseable.name, Parseable.trial_days, Parseable.enforce_plan_assignment, Parseable.target)
@@ -1535,21 +2000,17 @@ def print_set_partner_control_plan():
 
 def register_device(serial, cpuid, target, printer=StatusPrinter()):
     printer("Registering device: ({},{}) with {}".format(serial, cpuid, target.get_name()))
-    with Indent(printer):
-        q = Query(target, 'metaRW', 'test789',
-                """
-                INSERT IGNORE INTO device_provision (serial_number, chip_uid)
-                VALUES ('{}', '{}');
-                """.format(serial, cpuid))
-        q.execute(Feedback.ChangeCount, printer=printer)
-
-        q = Query(target, 'metaRW', 'test789',
-                """
-                UPDATE device_provision
-                SET last_activation_code='11111111', activation_code='11111111'
-                WHERE serial_number = '{}';
-                """.format(serial))
-        q.execute(Feedback.ChangeCount, printer=printer)
+    with Indent(printer), UnitOfWork(target, 'metaRW', 'test789', printer) as work:
+        work.add("""
+                 INSERT IGNORE INTO device_provision (serial_number, chip_uid)
+                 VALUES ('{}', '{}');
+                 """.format(serial, cpuid))
+
+        work.add("""
+                 UPDATE device_provision
+                 SET last_activation_code='11111111', activation_code='11111111'
+                 WHERE serial_number = '{}';
+                 """.format(serial))
 
 def print_register_device():
     parsed_args = parse(Parseable.serial, Parseable.cpuid, Parseable.target)
@@ -1557,6 +2018,104 @@ def print_register_device():
 
     register_device(parsed_args.serial, parsed_args.cpuid, parsed_args.target, printer=printer)
 
+# Registers many (serial, cpuid) pairs, a chunk at a time, with one multi-row upsert per chunk
+# rows is any iterable of dicts with 'serial' and 'cpuid', it's consumed lazily so it can be a stream
+# on_chunk gets a summary of each chunk as it's written, the return value sums them up
+def register_devices(rows, target, chunk_size=500, on_chunk=lambda summary : None, printer=StatusPrinter()):
+
+    totals = { 'rows' : 0, 'inserted' : 0, 'updated' : 0, 'unchanged' : 0 }
+    began = time.monotonic()
+    rows = iter(rows)
+
+    printer("Registering devices with {}, {} per chunk".format(target.get_name(), chunk_size))
+    with Indent(printer), Session(target, 'metaRW', 'test789', printer=QuietPrinter()) as session:
+
+        # earlier chunks are already committed when a bad row turns up, so say how far it got
+        def stop(position, problem):
+            raise ValueError("Stopped at device {} of the manifest: {} ({} devices were already registered)".format(
+                             position, problem, totals['rows']))
+
+        read_ct = 0
+        for chunk_index in itertools.count():
+            chunk = []
+            try:
+                for row in itertools.islice(rows, chunk_size):
+                    chunk.append(row)
+            except ValueError as ex:
+                stop(read_ct + len(chunk) + 1, ex)
+            if not chunk:
+                break
+            chunk_began = time.monotonic()
+
+            for index, row in enumerate(chunk):
+                if not row.get('cpuid'):
+                    stop(read_ct + index + 1, "{} has no cpuid".format(row.get('serial')))
+            read_ct += len(chunk)
+
+            # later rows win if a serial shows up twice
+            cpuids = OrderedDict((x['serial'], x['cpuid']) for x in chunk)
+
+            # the upsert's change count can't tell an unchanged row from an insert-that-failed, so count first
+            existing = session.execute(
+                    """
+                    SELECT COUNT(*) AS existing FROM device_provision
+                    WHERE serial_number IN ({});
+                    """.format(sql_placeholders(cpuids)), Feedback.OneRow, lambda row : row['existing'],
+                    params=list(cpuids))
+
+            # mysql counts 1 per inserted row, 2 per updated row, and 0 per row that was already as specified
+            # (every value is a placeholder, even the constant codes, otherwise mysqlclient sends one INSERT per row)
+            change_ct = session.execute_many(
+                    """
+                    INSERT INTO device_provision (serial_number, chip_uid, activation_code, last_activation_code)
+                    VALUES (%s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE
+                        chip_uid = VALUES(chip_uid),
+                        activation_code = VALUES(activation_code),
+                        last_activation_code = VALUES(last_activation_code);
+                    """, [ (serial, cpuid, '11111111', '11111111') for serial, cpuid in cpuids.items() ])
+
+            inserted = len(cpuids) - existing
+            updated = (change_ct - inserted) // 2
+            elapsed = time.monotonic() - chunk_began
+
+            summary = { 'chunk'     : chunk_index,
+                        'rows'      : len(cpuids),
+                        'inserted'  : inserted,
+                        'updated'   : updated,
+                        'unchanged' : existing - updated,
+                        'ms'        : int(elapsed * 1000) }
+            for key in totals:
+                totals[key] += summary[key]
+
+            printer("chunk {}: {} rows ({} new, {} updated) at {:.0f} rows/s".format(
+                    chunk_index, len(cpuids), inserted, updated, len(cpuids) / max(elapsed, 1e-6)))
+            on_chunk(summary)
+
+        elapsed = time.monotonic() - began
+        totals['ms'] = int(elapsed * 1000)
+        totals['rows_per_second'] = round(totals['rows'] / max(elapsed, 1e-6), 1)
+        printer("{rows} rows: {inserted} new, {updated} updated, {unchanged} unchanged "
+                "at {rows_per_second} rows/s".format(**totals))
+
+    return totals
+
+def print_register_devices():
+    parsed_args = parse(Parseable.manifest, Parseable.target, Parseable.chunk_size,
+                        description="Register the devices listed in a csv or json-lines manifest "
+                                    "(activation codes are set to 11111111), printing one json line per chunk")
+    printer = StatusPrinter(indent=0)
+
+    try:
+        totals = register_devices(parsed_args.manifest, parsed_args.target, chunk_size=parsed_args.chunksize,
+                                  on_chunk=lambda summary : print(json.dumps(summary), flush=True),
+                                  printer=printer)
+        print(json.dumps(totals))
+
+    except ValueError as ex:
+        printer(str(ex))
+        sys.exit(30)
+
 def get_merchant_apps(merchant, target, show_all=False, printer=StatusPrinter()):
     printer("Getting merchant {}'s apps from {}".format(merchant.id, target.get_name()))
     with Indent(printer):
@@ -1730,52 +2289,6 @@ def print_set_event_subscription():
 
     print(result)
 
-def get_random_merchant(target, printer=StatusPrinter()):
-
-    printer("Picking a random active merchant from {}".format(target.get_name()))
-
-    q = Query(target, 'metaRO', 'test321',
-            """
-            SELECT
-                    md.merchant_id as db_id, m.uuid as id
-            FROM
-                    merchant_role AS mr
-                    JOIN account AS a
-                        ON mr.id = a.primary_merchant_role_id
-                    JOIN
-                        ( SELECT primary_merchant_role_id FROM account
-                        WHERE primary_merchant_role_id IS NOT NULL
-                        ORDER BY last_login desc LIMIT 100
-                         ) AS active_accounts
-                        ON mr.id = active_accounts.primary_merchant_role_id
-                    JOIN merchant_boarding as mb
-                        ON mb.merchant_id = mr.merchant_id
-                            AND account_status not in (13, 'C', 'D', '2', '02', '3', '03')
-                    LEFT JOIN merchant_device AS md
-                        ON md.merchant_id = mr.merchant_id
-                    JOIN merchant as m
-                        ON m.id = mr.merchant_id
-            WHERE md.merchant_id IS NOT NULL
-            GROUP BY 1, 2
-            ORDER BY RAND()
-            LIMIT 1;
-            """)
-
-    return q.execute(Feedback.OneRow, lambda row : Merchant(row), printer=printer)
-
-def print_random_merchant():
-
-    parsed_args = parse(Parseable.target, description="Pick a merchant at random")
-    printer = StatusPrinter(indent=0)
-
-    try:
-        merchant = get_random_merchant(parsed_args.target, printer=printer)
-        print(merchant)
-
-    except ValueError as ex:
-        printer(str(ex))
-        sys.exit(30)
-
 def get_user_permissions(ldap_user, target, printer=StatusPrinter()):
 
     printer("Getting {}'s permissions according to {}".format(ldap_user, target.get_name()))
@@ -1879,77 +2392,66 @@ def print_set_permission():
 def new_clover_uuid():
     return ''.join((random.choice(string.ascii_uppercase + string.digits) for _ in range(13)))
 
-def get_clover_reseller_id(target, printer=StatusPrinter()):
+def get_clover_reseller_id(target, printer=StatusPrinter(), session=None):
     printer("Find the clover reseller")
     with Indent(printer):
         # find the clover reseller
-        q = Query(target, 'metaRO', 'test321',
-                """
-                SELECT id FROM reseller WHERE name = 'clover';
-                """)
-        return q.execute(Feedback.OneRow, printer=printer)['id']
+        with session_or_new(session, target, 'metaRO', 'test321', printer) as session:
+            return session.execute(
+                    """
+                    SELECT id FROM reseller WHERE name = 'clover';
+                    """, Feedback.OneRow)['id']
 
-def get_super_admin_permissions_id(target, clover_reseller_id, printer=StatusPrinter()):
+def get_super_admin_permissions_id(target, clover_reseller_id, printer=StatusPrinter(), session=None):
 
-    printer("Get the list of permissions")
-    with Indent(printer):
-        q = Query(target, 'metaRO', 'test321',
-                """
-                SELECT * FROM reseller_permissions LIMIT 1
-                """)
-        result = q.execute(Feedback.OneRow, printer=printer)
+    with session_or_new(session, target, 'metaRW', 'test789', printer) as session:
 
-        permissions_set = set(result.keys()) - set(['id', 'uuid', 'reseller_id', 'type', 'is_default', 'name'])
-        permissions = ', '.join(permissions_set)
-        ones = len(permissions_set) * '1'
-
-    def get_id():
-        printer("Which row has all permissions enabled?")
+        printer("Get the list of permissions")
         with Indent(printer):
-            q = Query(target, 'metaRO', 'test321',
+            result = session.execute(
                     """
-                    SELECT id FROM reseller_permissions WHERE CONCAT({}) = {};"
-                    """.format(permissions, ones))
-            result = q.execute(Feedback.ManyRows, printer=printer)
+                    SELECT * FROM reseller_permissions LIMIT 1
+                    """, Feedback.OneRow)
 
-            printer(result)
-            if result:
-                return result[0]['id']
-            else:
-                return None
+            permissions_set = set(result.keys()) - set(['id', 'uuid', 'reseller_id', 'type', 'is_default', 'name'])
+            permissions = ', '.join(permissions_set)
+            ones = len(permissions_set) * '1'
 
-    permission_id = get_id()
+        printer("Which row has all permissions enabled?")
+        with Indent(printer):
+            result = session.execute(
+                    """
+                    SELECT id FROM reseller_permissions WHERE CONCAT({}) = {};
+                    """.format(permissions, ones), Feedback.ManyRows)
 
-    # if it exists, return it
-    if permission_id:
-        return permission_id
+        # if it exists, return it
+        if result:
+            return result[0]['id']
 
-    # otherwise, create it
-    else:
+        # otherwise, create it
         printer("Create the super-admin permission entry")
         with Indent(printer):
             permission_uuid = new_clover_uuid()
             all_on = ','.join(ones)
 
-            q = Query(target, 'metaRW', 'test789',
+            return session.execute(
                     """
                     INSERT INTO reseller_permissions (uuid, reseller_id, type, is_default, name, {permissions})
                     VALUES ('{permission_uuid}', {clover_reseller_id}, 'Super', 1, 'Super Administrator', {all_on})
                     ;
-                    """.format(**vars()))
-            result = q.execute(Feedback.ChangeCount, printer=printer)
-
-        return get_id()
+                    """.format(**vars()), Feedback.InsertId)
 
+# everything happens in one transaction on one connection, so a failure partway through leaves no orphan rows
 def new_cs_user(name, email, target, printer=StatusPrinter()):
     printer("Creating a new cs user on {}".format(target.get_name()))
-    with Indent(printer):
+    with Indent(printer), Session(target, 'metaRW', 'test789', printer, transaction=True) as session:
 
         printer("Gathering cs user prerequisites")
         with Indent(printer):
             target_name = target.get_name()
-            clover_reseller_id = get_clover_reseller_id(target, printer=printer)
-            super_user_permission_id = get_super_admin_permissions_id(target, clover_reseller_id, printer=printer)
+            clover_reseller_id = get_clover_reseller_id(target, printer=printer, session=session)
+            super_user_permission_id = get_super_admin_permissions_id(target, clover_reseller_id,
+                                                                      printer=printer, session=session)
             role_uuid = new_clover_uuid()
             account_uuid = new_clover_uuid()
             claim_code = uuid.uuid4()
@@ -1960,55 +2462,34 @@ def new_cs_user(name, email, target, printer=StatusPrinter()):
         with Indent(printer):
 
             printer("Adding to the account table")
-            q = Query(target, 'metaRW', 'test789',
-                    """
-                    INSERT INTO account(uuid, name, email, claim_code)
-                    VALUES ('{account_uuid}', '{name}', '{email}', '{claim_code}')
-                    ;
-                    """.format(**vars()))
-            result = q.execute(Feedback.ChangeCount, printer=printer)
-
-            printer("Getting new accountid")
-            q = Query(target, 'metaRO', 'test321',
-                    """
-                    SELECT id FROM account WHERE uuid = '{account_uuid}'
-                    ;
-                    """.format(**vars()))
-            result = q.execute(Feedback.OneRow, printer=printer)
-            if result is None:
-                raise Exception("Failed to add a row to `account` (is that e-mail address already in use?)")
-            account_id = result['id']
+            try:
+                account_id = session.execute(
+                        """
+                        INSERT INTO account(uuid, name, email, claim_code)
+                        VALUES ('{account_uuid}', '{name}', '{email}', '{claim_code}')
+                        ;
+                        """.format(**vars()), Feedback.InsertId)
+            except IntegrityError as ex:
+                raise Exception("Failed to add a row to `account` (is that e-mail address already in use?)") from ex
 
             printer("Adding new reseller role")
-            q = Query(target, 'metaRW', 'test789',
+            session.execute(
                     """
                     INSERT INTO reseller_role(account_id, reseller_id, permissions_id)
-                    VALUES ('{account_id}', {clover_reseller_id}, {super_user_permission_id})
+                    VALUES ({account_id}, {clover_reseller_id}, {super_user_permission_id})
                     ;
-                    """.format(**vars()))
-            result = q.execute(Feedback.ChangeCount, printer=printer)
-
-            printer("Getting new role id")
-            q = Query(target, 'metaRO', 'test321',
-                    """
-                    SELECT id
-                    FROM reseller_role
-                    WHERE account_id = {account_id}
-                        AND reseller_id = {clover_reseller_id}
-                    ;
-                    """.format(**vars()))
-            result = q.execute(Feedback.OneRow, printer=printer)
-            reseller_role_id = result['id']
+                    """.format(**vars()), Feedback.ChangeCount)
 
             printer("Updating account with new role")
-            q = Query(target, 'metaRW', 'test789',
+            change_ct = session.execute(
                     """
                     UPDATE account
-                    SET primary_reseller_role_id = {reseller_role_id}
+                    SET primary_reseller_role_id = LAST_INSERT_ID()
                     WHERE id = {account_id}
                     ;
-                    """.format(**vars()))
-            result = q.execute(Feedback.ChangeCount, printer=printer)
+                    """.format(**vars()), Feedback.ChangeCount)
+            if change_ct != 1:
+                raise Exception("Expected to update one account row, updated {}".format(change_ct))
 
         path = 'claim?' + urllib.parse.urlencode( { 'email'     : email,
                                                     'claimCode' : claim_code } )
@@ -2023,89 +2504,86 @@ def print_new_cs_user():
     claim_uri = new_cs_user(parsed_args.name, parsed_args.emailaddress, parsed_args.target, printer=printer)
     print(json.dumps(claim_uri))
 
-def get_internal_group_id(target, group_name, printer=StatusPrinter()):
+def get_internal_group_id(target, group_name, printer=StatusPrinter(), session=None):
 
-    printer("Get the internal groups")
+    printer("Get the internal group")
     with Indent(printer):
-        q = Query(target, 'metaRO', 'test321',
-                """
-                SELECT * FROM internal_group LIMIT 1
-                """)
-        result = q.execute(Feedback.ManyRows, printer=printer)
+        with session_or_new(session, target, 'metaRO', 'test321', printer) as session:
+            result = session.execute(
+                    """
+                    SELECT id, name FROM internal_group WHERE name = '{}';
+                    """.format(group_name), Feedback.ManyRows)
 
-    ids_by_name = { x['name'] : x['id'] for x in result }
+    ids_by_name = { x['name'] : x['id'] for x in result or [] }
 
     if group_name in ids_by_name:
         printer("Found " + group_name)
 
     return ids_by_name[group_name];
 
-def get_internal_permission_ids(target, permission_names, printer=StatusPrinter()):
+def get_internal_permission_ids(target, permission_names, printer=StatusPrinter(), session=None):
 
     printer("Get the internal permission id's")
     with Indent(printer):
 
         names = "(\"" + "\",\"".join(permission_names) + "\")"
 
-        q = Query(target, 'metaRO', 'test321',
-                """
-                SELECT id FROM internal_permission where name in {};
-                """.format(names))
-        result = q.execute(Feedback.ManyRows, printer=printer)
+        with session_or_new(session, target, 'metaRO', 'test321', printer) as session:
+            result = session.execute(
+                    """
+                    SELECT id FROM internal_permission where name in {};
+                    """.format(names), Feedback.ManyRows)
 
     return [ x['id'] for x in result ]
 
+# like new_cs_user, this is one transaction on one connection
 def new_internal_user(ldap_name, target, printer=StatusPrinter()):
     printer("Creating a new internal user on {}".format(target.get_name()))
-    with Indent(printer):
+    with Indent(printer), Session(target, 'metaRW', 'test789', printer, transaction=True) as session:
 
         printer("Gathering user prerequisites")
         with Indent(printer):
             target_name = target.get_name()
             account_uuid = new_clover_uuid()
 
-            internal_group_id = get_internal_group_id(target, "admin-RO", printer=printer)
+            internal_group_id = get_internal_group_id(target, "admin-RO", printer=printer, session=session)
 
             permission_names = [ "READ_ACCOUNT", "READ_APP", "READ_DEVELOPER", "READ_DEVICE", "READ_DEVICE_BUNDLE",
                                  "READ_EVENTING_CONFIG", "READ_EVENTS", "READ_INTERNAL_ACCOUNT", "READ_MERCHANT",
                                  "READ_MERCHANT_BOARDING", "READ_PARTNER_CONTROL", "READ_ROM", "WRITE_DEVELOPER",
                                  "WRITE_MERCHANT" ]
-            permission_ids = get_internal_permission_ids(target, permission_names, printer=printer)
+            names = "(\"" + "\",\"".join(permission_names) + "\")"
 
         printer("Creating internal account {account_uuid} for {ldap_name}".format(**vars()))
         with Indent(printer):
 
             printer("Adding to the internal_account table")
-            q = Query(target, 'metaRW', 'test789',
-                    """
-                    INSERT INTO internal_account(internal_group_id, uuid, ldap_name)
-                    VALUES ('{internal_group_id}', '{account_uuid}', '{ldap_name}')
-                    ;
-                    """.format(**vars()))
-            result = q.execute(Feedback.ChangeCount, printer=printer)
-
-            printer("Getting new internal_account id")
-            q = Query(target, 'metaRO', 'test321',
+            try:
+                internal_account_id = session.execute(
+                        """
+                        INSERT INTO internal_account(internal_group_id, uuid, ldap_name)
+                        VALUES ('{internal_group_id}', '{account_uuid}', '{ldap_name}')
+                        ;
+                        """.format(**vars()), Feedback.InsertId)
+            except IntegrityError as ex:
+                raise Exception("Failed to add a row to `internal_account` (is that ldap_name already in use?)") from ex
+
+            # look up the permission ids and grant them in the same statement
+            # (the ones this server doesn't have are skipped, the user still gets the rest)
+            printer("Adding user permissions")
+            change_ct = session.execute(
                     """
-                    SELECT id FROM internal_account WHERE uuid = '{account_uuid}'
+                    INSERT INTO internal_account_permission(internal_account_id, internal_permission_id)
+                    SELECT {internal_account_id}, id FROM internal_permission WHERE name IN {names}
                     ;
-                    """.format(**vars()))
-            result = q.execute(Feedback.OneRow, printer=printer)
-            if result is None:
-                raise Exception("Failed to add a row to `internal_account` (is that ldap_name already in use?)")
-            internal_account_id = result['id']
-
-
-            printer("Adding user permissions")
-
-            sql = "INSERT INTO internal_account_permission(internal_account_id, internal_permission_id)\nVALUES "
-            for perm_id in permission_ids:
-                sql += "({}, {}),\n".format(internal_account_id, perm_id)
-            sql = sql[:-2] # trailing comma
-            sql += ";"
-
-            q = Query(target, 'metaRW', 'test789', sql)
-            result = q.execute(Feedback.ChangeCount, printer=printer)
+                    """.format(**vars()), Feedback.ChangeCount)
+            if change_ct != len(permission_names):
+                found = session.execute(
+                        """
+                        SELECT name FROM internal_permission WHERE name IN {names};
+                        """.format(**vars()), Feedback.ManyRows, lambda row : row['name']) or []
+                printer("{} has no {} permissions, granted the other {}".format(
+                        target_name, ', '.join(x for x in permission_names if x not in found), change_ct))
 
             return { 'id' : account_uuid, 'db_id' : internal_account_id }
 
@@ -2131,7 +2609,7 @@ def make_reseller_channel(reseller, channel, target, printer=StatusPrinter()):
 
         data.update(channel)
 
-        print(path, target, data)
+        printer(data)
         return post_response_as_dict(path, target, data, printer=printer)
 
 def print_make_reseller_channel():
@@ -0,0 +1,258 @@
+import os
+import gzip
+import json
+import copy
+import sqlite3
+import decimal
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from scoobe.cache import atomic_write
+from scoobe.common import StatusPrinter, QuietPrinter, Indent, ServerTarget
+from scoobe.http import get_response_as_dict
+from scoobe.mysql import Session, Feedback
+
+# Reference data changes rarely, but reading it means a tunnel and a login every time.
+# A snapshot is a gzipped json file holding a target's reference tables and the GET responses that go with them.
+# Passing one where a target is expected (e.g. `get_reseller 12 ./stg1.snapshot.json.gz`) answers
+# read-only queries from an in-memory sqlite copy of the tables, and GETs from the stored responses.
+
+snapshot_suffix = '.snapshot.json.gz'
+
+snapshot_tables = [ 'reseller', 'reseller_channels', 'merchant_plan_group', 'merchant_plan', 'partner_control',
+                    'event_subscription', 'internal_permission', 'internal_group' ]
+
+# each of these is stored as-is, and each of its elements is also stored under '<path>/<element id>',
+# which is where the single-object GETs (get_reseller, get_plan, ...) look for them
+snapshot_endpoints = [ 'v3/resellers', 'v3/merchant_plan_groups', 'v3/partner_controls',
+                       'v3/eventing/subscriptions', 'v3/apps' ]
+
+# and these are stored once per element of the listed endpoint (for get_partner_control_plan)
+snapshot_element_endpoints = { 'v3/partner_controls' : 'v3/partner_controls/{}?expand=plan' }
+
+def is_snapshot(path):
+    return path.endswith(snapshot_suffix) and os.path.isfile(path)
+
+# Values that json can't hold are stored as text, and their column is tagged with what they were.
+# The tag becomes the column's declared type, and sqlite hands the value to the matching converter when it's
+# read, so a query against a snapshot returns what the same query against the server would.
+# tag : (python type, to text, from text)
+column_types = { 'datetime'  : (datetime.datetime,  lambda x : x.isoformat(),  datetime.datetime.fromisoformat),
+                 'date'      : (datetime.date,      lambda x : x.isoformat(),  datetime.date.fromisoformat),
+                 'time'      : (datetime.time,      lambda x : x.isoformat(),  datetime.time.fromisoformat),
+                 'timedelta' : (datetime.timedelta, lambda x : str(x.total_seconds()),
+                                lambda x : datetime.timedelta(seconds=float(x))),
+                 'decimal'   : (decimal.Decimal,    str,                       decimal.Decimal),
+                 'bytes'     : ((bytes, bytearray), lambda x : bytes(x).hex(), bytes.fromhex) }
+
+for _tag, (_, _, _from_text) in column_types.items():
+    sqlite3.register_converter('snapshot_' + _tag, lambda raw, from_text=_from_text : from_text(raw.decode('utf-8')))
+
+def _column_tag(values):
+    for value in values:
+        if value is None:
+            continue
+        for tag, (python_type, _, _) in column_types.items():
+            # (a datetime is a date too)
+            if isinstance(value, python_type) and not (tag == 'date' and isinstance(value, datetime.datetime)):
+                return tag
+        return None
+    return None
+
+def _stored(value, tag):
+    if value is None or tag is None:
+        return value
+    return column_types[tag][1](value)
+
+def _sqlite_type(values, tag=None):
+    if tag is not None:
+        return 'snapshot_{} TEXT'.format(tag)
+    for value in values:
+        if isinstance(value, (bool, int)):
+            return 'INTEGER'
+        if isinstance(value, float):
+            return 'REAL'
+        if value is not None:
+            return 'TEXT'
+    return ''
+
+# tables are { name : { 'columns' : [...], 'rows' : [[...], ...], 'types' : { column : tag } } }
+def build_db(tables):
+    db = sqlite3.connect(':memory:', check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+
+    for name, table in tables.items():
+        columns = table['columns']
+        tags = table.get('types', {})
+        types = [ _sqlite_type((row[index] for row in table['rows']), tags.get(column))
+                  for index, column in enumerate(columns) ]
+        db.execute('CREATE TABLE "{}" ({})'.format(name, ', '.join('"{}" {}'.format(column, column_type)
+                                                                 for column, column_type in zip(columns, types))))
+        db.executemany('INSERT INTO "{}" VALUES ({})'.format(name, ', '.join('?' * len(columns))), table['rows'])
+        for column in ['id', 'uuid', 'name']:
+            if column in columns:
+                db.execute('CREATE INDEX "{0}_{1}" ON "{0}" ("{1}")'.format(name, column))
+
+    db.commit()
+    db.execute('PRAGMA query_only = ON')
+
+    # rows as dicts, like MySQLdb's DictCursor
+    db.row_factory = lambda cursor, row : { column[0] : value for column, value in zip(cursor.description, row) }
+    return db
+
+# MySQLdb's placeholders are %s, sqlite's are ?
+# (and a table that isn't there was left out of the snapshot, it isn't missing from the server)
+class _Cursor:
+
+    def __init__(self, cursor, name):
+        self.cursor = cursor
+        self.name = name
+
+    def execute(self, sql, args=None):
+        try:
+            if args is None:
+                return self.cursor.execute(sql)
+            return self.cursor.execute(sql.replace('%s', '?'), args)
+        except sqlite3.OperationalError as ex:
+            if str(ex).startswith('no such table'):
+                raise ValueError("{} isn't in {} (only read-only reference data is)".format(
+                                 str(ex)[len('no such table: '):], self.name))
+            raise
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+# the snapshot's db is built once and shared, so a Session closing it shouldn't actually close it
+class _SharedConnection:
+
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+
+    def cursor(self):
+        return _Cursor(self.db.cursor(), self.name)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+class Snapshot(ServerTarget):
+
+    def __init__(self, path):
+        with gzip.open(path, 'rt') as snapshot_file:
+            self.data = json.load(snapshot_file)
+        self._file = str(path)
+        self._name = "the snapshot of {} taken {}".format(self.data['source'], self.data['taken'])
+        self._db = None
+        self._lock = threading.Lock()
+
+    def get_name(self):
+        return self._name
+
+    def get_cli_arg(self):
+        return self._file
+
+    def get_db_connection(self):
+        with self._lock:
+            if self._db is None:
+                self._db = build_db(self.data['tables'])
+        return _SharedConnection(self._db, self.get_name())
+
+    def get_stored_response(self, path):
+        if path not in self.data['endpoints']:
+            raise ValueError("GET {} isn't in {} (only read-only reference data is)".format(path, self.get_name()))
+        return copy.deepcopy(self.data['endpoints'][path])
+
+    def _no_server(self):
+        raise ValueError("{} is a file, not a server (only read-only reference data can come from it)".format(
+                         self.get_name()))
+
+    def get_hostname(self):
+        self._no_server()
+
+    def get_http_port(self):
+        self._no_server()
+
+    def get_hypertext_protocol(self):
+        self._no_server()
+
+    def get_mysql_port(self):
+        self._no_server()
+
+    def get_db_name(self):
+        self._no_server()
+
+    def get_admin_hostname(self):
+        self._no_server()
+
+    def get_admin_http_port(self):
+        self._no_server()
+
+    def get_readonly_mysql_creds(self):
+        self._no_server()
+
+    def get_readwrite_mysql_creds(self):
+        self._no_server()
+
+# read the reference tables and endpoints from `target` and write them to `path`
+def export_snapshot(target, path, concurrency=4, printer=StatusPrinter()):
+
+    quiet = QuietPrinter()
+    data = { 'source'    : target.get_cli_arg(),
+             'taken'     : datetime.datetime.now().isoformat(timespec='seconds'),
+             'tables'    : {},
+             'endpoints' : {} }
+
+    printer("Reading tables from {}".format(target.get_name()))
+    with Indent(printer), Session(target, 'metaRO', 'test321', printer=quiet) as session:
+        for table in snapshot_tables:
+            rows = session.execute("SELECT * FROM {};".format(table), Feedback.ManyRows) or []
+            if rows:
+                columns = list(rows[0].keys())
+            else:
+                columns = [ x['Field'] for x in session.execute("SHOW COLUMNS FROM {};".format(table),
+                                                                 Feedback.ManyRows) ]
+            tags = { x : _column_tag(row[x] for row in rows) for x in columns }
+            data['tables'][table] = { 'columns' : columns,
+                                      'rows'    : [ [ _stored(row[x], tags[x]) for x in columns ] for row in rows ],
+                                      'types'   : { x : tag for x, tag in tags.items() if tag is not None } }
+            printer("{}: {} rows".format(table, len(rows)))
+
+    def store(path, response):
+        data['endpoints'][path] = response
+        for element in (response or {}).get('elements', []):
+            if 'id' in element:
+                data['endpoints']['{}/{}'.format(path, element['id'])] = element
+
+    def fetch(path):
+        try:
+            return path, get_response_as_dict(path, target, descend_once=None, printer=quiet)
+        except Exception as ex:
+            printer("Skipping {} ({})".format(path, ex))
+            return path, None
+
+    printer("Reading endpoints from {}".format(target.get_name()))
+    with Indent(printer), ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for path, response in executor.map(fetch, snapshot_endpoints):
+            if response is not None:
+                store(path, response)
+
+        # plans are listed per group
+        groups = (data['endpoints'].get('v3/merchant_plan_groups') or {}).get('elements', [])
+        element_paths = [ 'v3/merchant_plan_groups/{}/merchant_plans'.format(x['id']) for x in groups ]
+        for listed, element_path in snapshot_element_endpoints.items():
+            elements = (data['endpoints'].get(listed) or {}).get('elements', [])
+            element_paths += [ element_path.format(x['id']) for x in elements if 'id' in x ]
+        for path, response in executor.map(fetch, element_paths):
+            if response is not None:
+                store(path, response)
+
+        printer("{} responses".format(len(data['endpoints'])))
+
+    atomic_write(path, gzip.compress(json.dumps(data).encode('utf-8')), mode='wb')
+    printer("Wrote {} ({} bytes)".format(path, os.path.getsize(path)))
+    return path
@@ -7,6 +7,7 @@ from sh import ErrorReturnCode
 from collections import namedtuple
 from sshconf import read_ssh_config
 from os.path import expanduser, join
+from scoobe import stats
 from scoobe.common import StatusPrinter, Indent, ServerTarget, UserPass
 
 # returns true if the specified port is open on the local machine
@@ -129,6 +130,9 @@ class SshConfig(ServerTarget):
     def get_name(self):
         return self._ssh_host
 
+    def get_cli_arg(self):
+        return self._ssh_host
+
     def get_hostname(self):
         return self.hostname
 
@@ -183,6 +187,7 @@ class PossibleSshTunnel:
 
             # begin connecting
             self._process = ssh(self.target.get_name(), _bg=True)
+            stats.count('tunnels')
 
 
     # These calls let the caller be agnostic about whether the ssh tunnel is in use or not
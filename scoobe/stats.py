@@ -0,0 +1,112 @@
+import sys
+import time
+import bisect
+import itertools
+import atexit
+import threading
+from textwrap import indent
+from contextlib import contextmanager
+
+# Counts the round trips a command makes (tunnels, connections, statements, http requests, adb calls)
+# and the bytes they move, so that a change that quietly adds one shows up.
+#
+# Pass --stats to any command that parses its arguments to see them on stderr when it exits,
+# or use `counted()` to get the counts for a block of code.
+
+names = [ 'tunnels', 'mysql_connections', 'sql_statements', 'sql_round_trips', 'sql_bytes', 'sql_errors',
+          'http_requests', 'logins', 'http_bytes_sent', 'http_bytes_received',
+          'adb_calls', 'adb_bytes_received' ]
+
+# where the time goes, roughly (see `span(..., phase=...)` in scoobe/trace.py)
+phases = [ 'tunnel', 'connect', 'query', 'http', 'adb' ]
+
+# as near to when the command started as scoobe can tell
+started = time.perf_counter()
+
+# seconds, the bounds of the histograms that observations are kept in
+buckets = [ 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300 ]
+
+# how many observations fell at or under each bound (and over all of them), and their sum
+# (a fixed size, however many there are, so a long-running command doesn't grow one per query)
+class Histogram:
+
+    def __init__(self, values=()):
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        for value in values:
+            self.add(value)
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # the count at or under each bound, then the count overall (prometheus' le="+Inf")
+    def cumulative(self):
+        return list(itertools.accumulate(self.counts))
+
+    def copy(self):
+        result = Histogram()
+        result.counts = list(self.counts)
+        result.sum = self.sum
+        result.count = self.count
+        return result
+
+_lock = threading.Lock()
+_counts = { name : 0 for name in names }
+_seconds = { phase : 0.0 for phase in phases }
+_observations = {}
+
+def count(name, n=1):
+    with _lock:
+        _counts[name] = _counts.get(name, 0) + n
+
+# something that took a while (counted into a histogram)
+def observe(name, seconds):
+    with _lock:
+        _observations.setdefault(name, Histogram()).add(seconds)
+
+def add_time(phase, seconds):
+    with _lock:
+        _seconds[phase] = _seconds.get(phase, 0.0) + seconds
+        _observations.setdefault(phase, Histogram()).add(seconds)
+
+# { name : Histogram }
+def observations():
+    with _lock:
+        return { name : histogram.copy() for name, histogram in _observations.items() }
+
+# seconds spent in each phase so far, and in total
+def timings():
+    with _lock:
+        result = dict(_seconds)
+    result['total'] = time.perf_counter() - started
+    return result
+
+# the counts so far in this process
+def snapshot():
+    with _lock:
+        return dict(_counts)
+
+# the counts from within the block, in a dict that's filled in when the block exits
+# (counts from other threads running at the same time are included)
+@contextmanager
+def counted():
+    before = snapshot()
+    result = {}
+    try:
+        yield result
+    finally:
+        after = snapshot()
+        result.update({ name : after[name] - before.get(name, 0) for name in after })
+
+def describe(counts):
+    return '\n'.join('{}: {}'.format(name, value) for name, value in counts.items())
+
+# (plain prints, scoobe.common's printers trace themselves and the tracer counts adb calls here)
+def print_at_exit(file=sys.stderr):
+    def print_stats():
+        print('[Stats]', file=file)
+        print(indent(describe(snapshot()), ' ' * 4), file=file)
+    atexit.register(print_stats)
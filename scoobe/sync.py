@@ -0,0 +1,320 @@
+import sys
+import json
+import hashlib
+from collections import namedtuple, OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor
+from scoobe.cli import parse, Parseable
+from scoobe.common import StatusPrinter, QuietPrinter, Indent
+from scoobe.http import get_response_as_dict
+from scoobe.mysql import Query, Feedback
+from scoobe.server import new_plan_group, set_plan_group, new_plan, set_plan, create_partner_control, \
+                          set_partner_control, new_event_subscription, set_event_subscription
+
+# Copies plan groups, plans, partner controls and event subscriptions from one target to another
+#
+# Objects are matched up by name rather than by uuid (uuids differ between servers), and references to other
+# objects are rewritten the same way: a plan's merchantPlanGroup is looked up by the group's name on the destination.
+# Only objects that are missing or different on the destination are touched.
+
+# these differ between servers even when the objects are the same
+volatile_fields = ['id', 'db_id', 'href', 'createdTime', 'modifiedTime', 'deletedTime']
+
+# fields that point at other objects, and which collection they point into
+reference_fields = { 'merchantPlanGroup' : 'plan_groups',
+                     'appBundle'         : 'app_bundles' }
+
+# a collection that can be synced, in dependency order (plans need their groups to exist first)
+# key gives an object's identity across servers, given the object in normalized form
+Kind = namedtuple('Kind', 'name key create update')
+
+def _name(obj):
+    return obj.get('name')
+
+def _plan_key(obj):
+    return '{}/{}'.format((obj.get('merchantPlanGroup') or {}).get('name'), obj.get('name'))
+
+kinds = [ Kind('plan_groups',         _name,      new_plan_group,         set_plan_group),
+          Kind('plans',               _plan_key,  new_plan,               set_plan),
+          Kind('partner_controls',    _name,      create_partner_control, set_partner_control),
+          Kind('event_subscriptions', _name,      new_event_subscription, set_event_subscription) ]
+
+# { uuid : name } for app bundles, which aren't synced but are referred to by plans
+def get_app_bundle_names(target, printer=StatusPrinter()):
+    q = Query(target, 'metaRO', 'test321',
+            """
+            SELECT uuid, name FROM app_bundle;
+            """)
+    rows = q.execute(Feedback.ManyRows, printer=printer) or []
+    return { row['uuid'] : row['name'] for row in rows }
+
+# everything the sync needs to know about one target, fetched in parallel
+def snapshot_config(target, concurrency=4, printer=StatusPrinter()):
+
+    quiet = QuietPrinter()
+    printer("Reading configuration from {}".format(target.get_name()))
+    with Indent(printer), ThreadPoolExecutor(max_workers=concurrency) as executor:
+
+        def get(path):
+            return get_response_as_dict(path, target, printer=quiet) or []
+
+        plan_groups = executor.submit(get, 'v3/merchant_plan_groups')
+        partner_controls = executor.submit(get, 'v3/partner_controls')
+        event_subscriptions = executor.submit(get, 'v3/eventing/subscriptions')
+        app_bundles = executor.submit(get_app_bundle_names, target, printer=quiet)
+
+        # plans are listed per group
+        def get_plans(plan_group):
+            plans = get('v3/merchant_plan_groups/{}/merchant_plans'.format(plan_group['id']))
+            for plan in plans:
+                plan.setdefault('merchantPlanGroup', { 'id' : plan_group['id'] })
+            return plans
+
+        snapshot = { 'plan_groups'         : plan_groups.result(),
+                     'partner_controls'    : partner_controls.result(),
+                     'event_subscriptions' : event_subscriptions.result() }
+        snapshot['plans'] = [ plan for plans in executor.map(get_plans, snapshot['plan_groups']) for plan in plans ]
+
+        try:
+            snapshot['app_bundles'] = app_bundles.result()
+        except Exception as ex:
+            printer("Couldn't read app bundles ({}), references to them will need --uuidmap".format(ex))
+            snapshot['app_bundles'] = {}
+
+        for kind in kinds:
+            printer("{} {}".format(len(snapshot[kind.name]), kind.name.replace('_', ' ')))
+
+    return snapshot
+
+# the names that references are translated through, { collection : { uuid : name } }
+def reference_names(snapshot):
+    return { 'plan_groups' : { x['id'] : x.get('name') for x in snapshot['plan_groups'] },
+             'app_bundles' : snapshot['app_bundles'] }
+
+# the object without anything server-specific, with references by name where the name is known
+def normalize(obj, names):
+    normalized = {}
+    for field, value in obj.items():
+        if field in volatile_fields:
+            continue
+        if field in reference_fields and isinstance(value, dict) and 'id' in value:
+            name = names[reference_fields[field]].get(value['id'])
+            value = { 'name' : name } if name is not None else { 'id' : value['id'] }
+        normalized[field] = value
+    return normalized
+
+# { key : (normalized, original) } for one collection, and the keys that more than one object has
+def index(kind, snapshot, names):
+    indexed = OrderedDict()
+    ambiguous = set()
+    for obj in snapshot[kind.name]:
+        normalized = normalize(obj, names)
+        key = kind.key(normalized)
+        if key in indexed:
+            ambiguous.add(key)
+        indexed[key] = (normalized, obj)
+    return indexed, ambiguous
+
+# the smallest list of creates and updates that makes dest match source
+def plan_sync(source, dest):
+
+    source_names = reference_names(source)
+    dest_names = reference_names(dest)
+
+    steps = []
+    for kind in kinds:
+        source_index, source_ambiguous = index(kind, source, source_names)
+        dest_index, dest_ambiguous = index(kind, dest, dest_names)
+
+        for key, (normalized, _) in source_index.items():
+            step = { 'kind' : kind.name, 'key' : key }
+
+            if key in source_ambiguous or key in dest_ambiguous:
+                step.update({ 'action' : 'skip', 'reason' : 'more than one {} is called {}'.format(kind.name, key) })
+            elif key not in dest_index:
+                step.update({ 'action' : 'create', 'body' : normalized })
+            else:
+                dest_normalized, dest_obj = dest_index[key]
+                if dest_normalized == normalized:
+                    continue
+                changed = sorted(field for field in set(normalized) | set(dest_normalized)
+                                 if normalized.get(field) != dest_normalized.get(field))
+                step.update({ 'action' : 'update', 'body' : normalized, 'dest_id' : dest_obj['id'],
+                              'fields' : changed })
+            steps.append(step)
+
+    return steps
+
+# identical objects get identical hashes, whatever order their fields came in
+def content_hash(normalized):
+    return hashlib.sha1(json.dumps(normalized, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+# { 'a.b' : (left, right) } for each (possibly nested) field that differs, None meaning absent
+def field_changes(left, right, prefix=''):
+    changes = OrderedDict()
+    for field in sorted(set(left) | set(right)):
+        left_value, right_value = left.get(field), right.get(field)
+        if left_value == right_value:
+            continue
+        if isinstance(left_value, dict) and isinstance(right_value, dict):
+            changes.update(field_changes(left_value, right_value, prefix + field + '.'))
+        else:
+            changes[prefix + field] = (left_value, right_value)
+    return changes
+
+# what's on the left and not the right, the other way round, and what differs between objects with the same key
+# objects are hashed first, so that the (usually many) identical ones are set aside without comparing fields
+def diff_snapshots(left, right):
+
+    left_names = reference_names(left)
+    right_names = reference_names(right)
+
+    differences = []
+    for kind in kinds:
+        left_objs = [ (content_hash(x), x) for x in (normalize(x, left_names) for x in left[kind.name]) ]
+        right_objs = [ (content_hash(x), x) for x in (normalize(x, right_names) for x in right[kind.name]) ]
+
+        # cancel out identical pairs
+        common = Counter(x for x, _ in left_objs) & Counter(x for x, _ in right_objs)
+        def unmatched(objs):
+            remaining = Counter(common)
+            result = OrderedDict()
+            for digest, obj in objs:
+                if remaining[digest]:
+                    remaining[digest] -= 1
+                else:
+                    result.setdefault(kind.key(obj), []).append(obj)
+            return result
+
+        left_rest, right_rest = unmatched(left_objs), unmatched(right_objs)
+
+        for key in list(left_rest) + [ x for x in right_rest if x not in left_rest ]:
+            lefts, rights = left_rest.get(key, []), right_rest.get(key, [])
+            for left_obj, right_obj in zip(lefts, rights):
+                differences.append({ 'kind' : kind.name, 'key' : key, 'change' : 'changed',
+                                     'fields' : field_changes(left_obj, right_obj) })
+            for left_obj in lefts[len(rights):]:
+                differences.append({ 'kind' : kind.name, 'key' : key, 'change' : 'removed', 'object' : left_obj })
+            for right_obj in rights[len(lefts):]:
+                differences.append({ 'kind' : kind.name, 'key' : key, 'change' : 'added', 'object' : right_obj })
+
+    return differences
+
+# turn references by name back into references by (destination) uuid
+# uuid_map is for references that couldn't be named: { source uuid : dest uuid }
+def resolve(body, dest_ids, uuid_map=None):
+    uuid_map = uuid_map or {}
+    resolved = dict(body)
+    for field, collection in reference_fields.items():
+        value = resolved.get(field)
+        if not isinstance(value, dict):
+            continue
+        if 'name' in value:
+            if value['name'] not in dest_ids[collection]:
+                raise ValueError("No {} called {} on the destination".format(collection, value['name']))
+            resolved[field] = { 'id' : dest_ids[collection][value['name']] }
+        elif 'id' in value:
+            if value['id'] not in uuid_map:
+                raise ValueError("Don't know what {} {} is on the destination (add it to --uuidmap)".format(
+                                 field, value['id']))
+            resolved[field] = { 'id' : uuid_map[value['id']] }
+    return resolved
+
+# carry out the steps, one kind at a time, each kind's steps in parallel
+def apply_sync(steps, dest_target, dest, uuid_map=None, concurrency=4, on_result=lambda result : None,
+               printer=StatusPrinter()):
+
+    uuid_map = uuid_map or {}
+
+    # { collection : { name : dest uuid } }, grows as things are created
+    dest_ids = { collection : { name : uuid for uuid, name in names.items() }
+                 for collection, names in reference_names(dest).items() }
+
+    def do_step(step, kind):
+        result = { 'kind' : step['kind'], 'key' : step['key'], 'action' : step['action'] }
+        if step['action'] == 'skip':
+            result.update({ 'ok' : False, 'error' : step['reason'] })
+            return result
+        try:
+            body = resolve(step['body'], dest_ids, uuid_map)
+            if step['action'] == 'create':
+                response = kind.create(body, dest_target, printer=QuietPrinter())
+            else:
+                body['id'] = step['dest_id']
+                response = kind.update(body, dest_target, printer=QuietPrinter())
+            result.update({ 'ok' : True, 'id' : (response or {}).get('id', step.get('dest_id')) })
+        except Exception as ex:
+            result.update({ 'ok' : False, 'error' : str(ex) })
+        return result
+
+    results = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for kind in kinds:
+            kind_steps = [ x for x in steps if x['kind'] == kind.name ]
+            if not kind_steps:
+                continue
+
+            printer("Syncing {} {}".format(len(kind_steps), kind.name.replace('_', ' ')))
+            for result in executor.map(lambda step : do_step(step, kind), kind_steps):
+                if result['ok'] and kind.name == 'plan_groups':
+                    dest_ids['plan_groups'][result['key']] = result['id']
+                on_result(result)
+                results.append(result)
+
+    return results
+
+def print_sync_targets():
+
+    parsed_args = parse(Parseable.source_target, Parseable.dest_target, Parseable.uuid_map, Parseable.dry_run,
+                        Parseable.concurrency,
+                        description="Make the destination's plan groups, plans, partner controls and event "
+                                    "subscriptions match the source's. Prints the planned steps as json lines, "
+                                    "then the outcome of each one")
+    printer = StatusPrinter(indent=0)
+
+    source_target, dest_target = parsed_args.sourcetarget, parsed_args.desttarget
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        source = executor.submit(snapshot_config, source_target, parsed_args.concurrency, printer=printer)
+        dest = executor.submit(snapshot_config, dest_target, parsed_args.concurrency, printer=printer)
+        source, dest = source.result(), dest.result()
+
+    steps = plan_sync(source, dest)
+    printer("{} steps to make {} match {}".format(len(steps), dest_target.get_name(), source_target.get_name()))
+    for step in steps:
+        print(json.dumps({ k : v for k, v in step.items() if k != 'body' }), flush=True)
+
+    if parsed_args.dryrun or not steps:
+        return
+
+    results = apply_sync(steps, dest_target, dest, parsed_args.uuidmap, concurrency=parsed_args.concurrency,
+                         on_result=lambda result : print(json.dumps(result), flush=True), printer=printer)
+
+    failures = len([ x for x in results if not x['ok'] ])
+    printer("{} of {} steps failed".format(failures, len(results)))
+    if failures:
+        sys.exit(20)
+
+def print_diff_targets():
+
+    parsed_args = parse(Parseable.target, Parseable.other_target, Parseable.concurrency,
+                        description="Show how the second target's plan groups, plans, partner controls and event "
+                                    "subscriptions differ from the first's (ignoring uuids and other server-specific "
+                                    "fields), one json line per difference")
+    printer = StatusPrinter(indent=0)
+
+    # both targets are read at once, so their progress would interleave; report each in one line instead
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        left = executor.submit(snapshot_config, parsed_args.target, parsed_args.concurrency, printer=QuietPrinter())
+        right = executor.submit(snapshot_config, parsed_args.othertarget, parsed_args.concurrency,
+                                printer=QuietPrinter())
+        left, right = left.result(), right.result()
+
+    for target, snapshot in [(parsed_args.target, left), (parsed_args.othertarget, right)]:
+        counts = [ "{} {}".format(len(snapshot[kind.name]), kind.name.replace('_', ' ')) for kind in kinds ]
+        printer("{}: {}".format(target.get_name(), ', '.join(counts)))
+
+    differences = diff_snapshots(left, right)
+    for difference in differences:
+        print(json.dumps(difference), flush=True)
+
+    printer("{} differences between {} and {}".format(len(differences), parsed_args.target.get_name(),
+                                                      parsed_args.othertarget.get_name()))
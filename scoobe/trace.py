@@ -0,0 +1,202 @@
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+from scoobe import stats
+from scoobe.cache import atomic_write
+
+# Times the steps that StatusPrinter/Indent already describe, plus each query, http request and adb call,
+# so that a slow command can be blamed on the tunnel, mysql, the server or the device.
+#
+# Turn it on with `--trace FILE` (any command that parses its arguments) or SCOOBE_TRACE=FILE (any command).
+# FILE gets written when the command exits:
+#   - *.folded or *.collapsed: one "outer;inner;innermost <microseconds>" line per stack, for flamegraph.pl
+#     and speedscope
+#   - anything else: chrome trace-event json, for chrome://tracing or https://ui.perfetto.dev
+
+# spans nest per thread, each remembers its parent so stacks can be rebuilt afterwards
+class Span:
+    def __init__(self, name, category, parent, attrs):
+        self.name = name
+        self.category = category
+        self.parent = parent
+        self.attrs = attrs
+        self.thread = threading.get_ident()
+        self.start = time.perf_counter()
+        self.end = None
+
+    def stack(self):
+        span, names = self, []
+        while span is not None:
+            names.append(span.name.replace(';', ',').replace('\n', ' '))
+            span = span.parent
+        return ';'.join(reversed(names))
+
+class Tracer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.spans = []
+        self.epoch = time.perf_counter()
+
+    def _open(self):
+        if not hasattr(self.local, 'open'):
+            self.local.open = []
+        return self.local.open
+
+    def begin(self, name, category, attrs):
+        open_spans = self._open()
+        span = Span(name, category, open_spans[-1] if open_spans else None, attrs)
+        open_spans.append(span)
+        with self.lock:
+            self.spans.append(span)
+        return span
+
+    def end(self, span):
+        span.end = time.perf_counter()
+        open_spans = self._open()
+        # normally the innermost one, but not if something exited out of order
+        if span in open_spans:
+            open_spans.remove(span)
+
+    def _micros(self, seconds):
+        return int(round(seconds * 1000000))
+
+    def _finished(self):
+        now = time.perf_counter()
+        with self.lock:
+            spans = list(self.spans)
+        for span in spans:
+            if span.end is None:
+                span.attrs['unfinished'] = True
+                span.end = now
+        return spans
+
+    def chrome(self):
+        pid = os.getpid()
+        events = []
+        for span in self._finished():
+            events.append({ 'name' : span.name,
+                            'cat'  : span.category,
+                            'ph'   : 'X',
+                            'ts'   : self._micros(span.start - self.epoch),
+                            'dur'  : self._micros(span.end - span.start),
+                            'pid'  : pid,
+                            'tid'  : span.thread,
+                            'args' : { k : str(v) for k, v in span.attrs.items() } })
+        return { 'traceEvents' : events, 'displayTimeUnit' : 'ms' }
+
+    # time spent in each stack, not counting time spent in the spans under it
+    def collapsed(self):
+        spans = self._finished()
+        own = { span : span.end - span.start for span in spans }
+        for span in spans:
+            if span.parent in own:
+                own[span.parent] -= span.end - span.start
+
+        totals = {}
+        for span, seconds in own.items():
+            stack = span.stack()
+            totals[stack] = totals.get(stack, 0) + max(0, seconds)
+        return ''.join('{} {}\n'.format(stack, self._micros(seconds)) for stack, seconds in totals.items())
+
+    def write(self, path):
+        if path.endswith('.folded') or path.endswith('.collapsed'):
+            data = self.collapsed()
+        else:
+            data = json.dumps(self.chrome())
+        atomic_write(os.path.abspath(path), data)
+
+# the active tracer (None when not tracing, which makes all of the below nearly free)
+tracer = None
+
+def start(path):
+    global tracer
+    if tracer is not None:
+        if tracer.path == path:
+            return tracer
+        # --trace overrides SCOOBE_TRACE, keep what was traced so far
+        tracer.path = path
+        return tracer
+
+    tracer = Tracer()
+    tracer.path = path
+    root = tracer.begin(os.path.basename(sys.argv[0]) or 'scoobe', 'command', { 'argv' : ' '.join(sys.argv[1:]) })
+
+    def finish():
+        tracer.end(root)
+        try:
+            tracer.write(tracer.path)
+        except OSError as ex:
+            print("Couldn't write trace to {} ({})".format(tracer.path, ex), file=sys.stderr)
+
+    atexit.register(finish)
+    return tracer
+
+# for things that don't fit in a with block, pass whatever begin returned to end
+def begin(name, category='step', **attrs):
+    if tracer is None:
+        return None
+    return tracer.begin(name, category, attrs)
+
+def end(span, **attrs):
+    if span is not None:
+        span.attrs.update(attrs)
+        tracer.end(span)
+
+# spans with a phase (see scoobe.stats.phases) are timed whether or not there's a tracer
+@contextmanager
+def span(name, category='step', phase=None, **attrs):
+    this_span = begin(name, category, **attrs)
+    began = time.perf_counter()
+    try:
+        yield this_span
+    except BaseException as ex:
+        end(this_span, error=type(ex).__name__)
+        raise
+    finally:
+        if phase:
+            stats.add_time(phase, time.perf_counter() - began)
+    end(this_span)
+
+# wraps an sh command (like sh.adb) so each call is a span, and is counted as '<category>_calls' in scoobe.stats
+# (subcommands and baked commands are wrapped too, calls with _bg=True only time the launch)
+class TracedCommand:
+    def __init__(self, command, category, name=None):
+        self._command = command
+        self._category = category
+        self._name = name or os.path.basename(str(command).split(' ')[0])
+
+    def __call__(self, *args, **kwargs):
+        stats.count(self._category + '_calls')
+        words = []
+        for arg in args:
+            words += [ str(x) for x in arg ] if isinstance(arg, (list, tuple)) else [str(arg)]
+        with span(' '.join([self._name] + words)[:120], self._category, phase=self._category):
+            return self._counted(self._command(*args, **kwargs), kwargs)
+
+    # a finished command's output is already in memory (unless it went to _out)
+    # asking a background command for its output would wait for it, so those aren't counted
+    def _counted(self, result, kwargs):
+        if kwargs.get('_bg') or kwargs.get('_iter'):
+            return result
+        stdout = getattr(result, 'stdout', None)
+        if isinstance(stdout, bytes):
+            stats.count(self._category + '_bytes_received', len(stdout))
+        return result
+
+    def bake(self, *args, **kwargs):
+        return TracedCommand(self._command.bake(*args, **kwargs), self._category,
+                             ' '.join([self._name] + [ str(x) for x in args ]))
+
+    def __getattr__(self, name):
+        return TracedCommand(getattr(self._command, name), self._category, '{} {}'.format(self._name, name))
+
+    def __str__(self):
+        return str(self._command)
+
+if os.environ.get('SCOOBE_TRACE'):
+    start(os.environ['SCOOBE_TRACE'])
@@ -1,42 +1,300 @@
 import xml.etree.ElementTree as ET
 import re
 import sys
+import time
+import json
 import itertools
-from time import sleep
 from uiautomator import device as ui
 from collections import namedtuple
-from argparse import ArgumentParser
-from sh import adb, egrep, ErrorReturnCode
+from argparse import ArgumentParser, FileType
+import sh
+from scoobe.common import StatusPrinter, Indent
+from scoobe.trace import TracedCommand
+from scoobe.cassette import RecordedCommand
+from scoobe.cli import add_command_options, start_command_options
 
-def has_text(text):
+adb = TracedCommand(RecordedCommand(sh.adb), 'adb')
+
+# one element of the ui hierarchy
+# bounds is (left, top, right, bottom)
+Node = namedtuple('Node', 'text resource_id content_desc clickable bounds')
+
+def parse_bounds(bounds_str):
+    match = re.match(r'\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]', bounds_str or '')
+    if match:
+        return tuple(int(x) for x in match.groups())
+    return None
+
+# the ui hierarchy, parsed once and indexed so that many questions can be asked of a single dump
+class Snapshot:
+
+    def __init__(self, xml):
+        self.xml = xml
+        self.nodes = []
+        self.by_text = {}
+        self.by_resource_id = {}
+
+        # `uiautomator dump /dev/tty` appends a status line after the closing tag
+        start = xml.find('<')
+        end = xml.rfind('>')
+        if start < 0 or end < start:
+            raise ValueError("Not a ui hierarchy dump: {}".format(xml.strip()[:80]))
+        root = ET.fromstring(xml[start:end + 1])
+
+        for element in root.iter('node'):
+            node = Node(element.get('text', ''),
+                        element.get('resource-id', ''),
+                        element.get('content-desc', ''),
+                        element.get('clickable') == 'true',
+                        parse_bounds(element.get('bounds')))
+            self.nodes.append(node)
+            if node.text:
+                self.by_text.setdefault(node.text, []).append(node)
+            if node.resource_id:
+                self.by_resource_id.setdefault(node.resource_id, []).append(node)
+
+    # `text` is a regex, as it was when we grepped the dump for it
+    # exact matches are looked up directly, the rest are searched for
+    def find_text(self, text):
+        if text in self.by_text:
+            return self.by_text[text]
+        pattern = re.compile(text)
+        return [ node for node in self.nodes if
+                    (node.text and pattern.search(node.text)) or
+                    (node.content_desc and pattern.search(node.content_desc)) or
+                    (node.resource_id and pattern.search(node.resource_id)) ]
+
+    def has_text(self, text):
+        return len(self.find_text(text)) > 0
+
+    def find_resource_id(self, resource_id):
+        return self.by_resource_id.get(resource_id, [])
+
+def dump_hierarchy():
+    return str(adb.shell(['uiautomator dump /dev/tty']))
+
+def snapshot(dump=dump_hierarchy):
+    return Snapshot(dump())
+
+# a dump taken while the screen is changing can fail, come back empty, or be cut off
+# that's a poll that didn't see anything, not a reason to stop polling (None)
+def try_snapshot(dump=dump_hierarchy):
     try:
-        egrep(adb.shell(['uiautomator dump /dev/tty']), ".*" + text + ".*")
-        return True
-    except ErrorReturnCode:
-        pass
-    return False
+        return snapshot(dump)
+    except (ET.ParseError, ValueError, sh.ErrorReturnCode):
+        return None
+
+def has_text(text):
+    snap = try_snapshot()
+    return snap is not None and snap.has_text(text)
+
+# how a set of texts should be judged against a snapshot
+class Mode:
+
+    # at least one of them is on the screen
+    def any(snap, texts):
+        return any(snap.has_text(text) for text in texts)
+
+    # all of them are on the screen
+    def all(snap, texts):
+        return all(snap.has_text(text) for text in texts)
+
+    # none of them are on the screen
+    def absent(snap, texts):
+        return not any(snap.has_text(text) for text in texts)
+
+modes = { 'any' : Mode.any, 'all' : Mode.all, 'absent' : Mode.absent }
+
+# Poll the ui hierarchy (one dump per poll) until `texts` satisfy `mode`
+# Polls quickly at first and while the screen is changing, then backs off while it sits still
+# Returns the satisfying snapshot, or None if `timeout` seconds pass first
+def wait_for(texts, mode=Mode.any, timeout=None, min_interval=0.25, max_interval=2.0, dump=dump_hierarchy,
+             on_poll=lambda : None):
+
+    start = time.monotonic()
+    interval = min_interval
+    last_xml = None
+
+    while True:
+        snap = try_snapshot(dump)
+        if snap is not None and mode(snap, texts):
+            return snap
+
+        if timeout is not None and time.monotonic() - start >= timeout:
+            return None
+
+        # something moved, it's probably about to move again
+        xml = snap.xml if snap is not None else None
+        if xml is None or xml != last_xml:
+            interval = min_interval
+        else:
+            interval = min(interval * 2, max_interval)
+        last_xml = xml
+
+        on_poll()
+        if timeout is not None:
+            interval = min(interval, max(0, start + timeout - time.monotonic()))
+        time.sleep(interval)
 
 def wait_text():
     parser = ArgumentParser()
-    parser.add_argument("text", type=str, help="wait for this to appear on the screen (examines xml UI dump)")
+    parser.add_argument("text", type=str, nargs='+',
+                        help="wait for this to appear on the screen (examines xml UI dump)")
+    parser.add_argument("-m", "--mode", choices=list(modes), default='any',
+                        help="wait for any of the texts (default), all of them, or for all of them to be absent")
+    parser.add_argument("-t", "--timeout", type=float, default=None,
+                        help="give up after this many seconds (exits nonzero)")
+    add_command_options(parser)
     args = parser.parse_args()
+    start_command_options(args)
+
+    spinner = itertools.cycle(['-', '\\', '|', '/'])
+    started = [False]
 
-    if not has_text(args.text):
-        print('waiting for "{}" '.format(args.text), end='')
-        spinner = itertools.cycle(['-', '\\', '|', '/'])
-        while not has_text(args.text):
-            sys.stdout.write(next(spinner))
-            sys.stdout.flush()
-            sleep(1)
+    def spin():
+        if not started[0]:
+            print('waiting for {} of "{}" '.format(args.mode, '", "'.join(args.text)), end='')
+            started[0] = True
+        else:
             sys.stdout.write('\b')
-            sys.stdout.flush()
-        sleep(1)
-        print(' ... found')
+        sys.stdout.write(next(spinner))
+        sys.stdout.flush()
+
+    snap = wait_for(args.text, modes[args.mode], timeout=args.timeout, on_poll=spin)
+
+    if started[0]:
+        sys.stdout.write('\b')
+        if snap:
+            # give the new screen a moment to finish drawing
+            time.sleep(1)
+            print(' ... found')
+        else:
+            print(' ... timed out')
+
+    if not snap:
+        sys.exit(50)
 
 def press():
     parser = ArgumentParser()
     parser.add_argument("button_text", type=str, help="Press the button that shows this text")
+    add_command_options(parser)
     args = parser.parse_args()
+    start_command_options(args)
 
     ui.screen.on()
     ui(text=args.button_text).click()
+
+# Runs a script of ui steps against one uiautomator session
+# (the rpc server on the device is started once, rather than once per press_button/wait_text process)
+#
+# A script is a json list of steps, like so:
+#
+#   [ { "wait" : "Pick Language" },
+#     { "press" : "Pick Language" },
+#     { "wait" : ["Next", "Skip"], "mode" : "any", "timeout" : 60 },
+#     { "press" : "Next" },
+#     { "type" : "some text", "into" : "com.clover.setupwizard:id/name" },
+#     { "screenshot" : "after_name.png" },
+#     { "sleep" : 2 } ]
+#
+# "into" is a resource-id if it looks like one, otherwise it is the text currently shown in the field
+class ScriptRunner:
+
+    def __init__(self, device=ui, printer=StatusPrinter()):
+        self.device = device
+        self.printer = printer
+
+    def wait(self, step):
+        texts = step['wait']
+        if isinstance(texts, str):
+            texts = [texts]
+        snap = wait_for(texts, modes[step.get('mode', 'any')], timeout=step.get('timeout'), dump=self.device.dump)
+        if not snap:
+            raise TimeoutError("Gave up waiting for {} of {}".format(step.get('mode', 'any'), texts))
+
+    def press(self, step):
+        self.device.screen.on()
+        self.device(text=step['press']).click()
+
+    def type(self, step):
+        into = step['into']
+        if ':id/' in into:
+            field = self.device(resourceId=into)
+        else:
+            field = self.device(text=into)
+        field.set_text(step['type'])
+
+    def screenshot(self, step):
+        # imported here because scoobe.device pulls in a lot that the other steps don't need
+        from scoobe.device import capture_png
+        with open(step['screenshot'], 'wb') as outfile:
+            outfile.write(capture_png())
+
+    def sleep(self, step):
+        time.sleep(step['sleep'])
+
+    actions = ['wait', 'press', 'type', 'screenshot', 'sleep']
+
+    # returns one timing record per step, stops at the first failure
+    def run(self, steps, on_step=lambda record : None):
+        records = []
+        for index, step in enumerate(steps):
+            action = next((x for x in ScriptRunner.actions if x in step), None)
+            if not action:
+                raise ValueError("Step {} has none of {}: {}".format(index, ScriptRunner.actions, step))
+
+            self.printer("[{}] {} {}".format(index, action, json.dumps(step[action])))
+            began = time.monotonic()
+            error = None
+            try:
+                getattr(self, action)(step)
+            except Exception as ex:
+                error = ex
+
+            record = { 'step'   : index,
+                       'action' : action,
+                       'arg'    : step[action],
+                       'ms'     : int((time.monotonic() - began) * 1000),
+                       'ok'     : error is None }
+            if error:
+                record['error'] = str(error)
+
+            with Indent(self.printer):
+                self.printer("{} ms{}".format(record['ms'], '' if error is None else ', failed: ' + str(error)))
+
+            records.append(record)
+            on_step(record)
+            if error:
+                break
+        return records
+
+def read_script(script_file):
+    content = script_file.read()
+    if script_file.name.endswith(('.yml', '.yaml')):
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError("Reading yaml scripts requires pyyaml (try: pip install pyyaml), or use json instead")
+        return yaml.safe_load(content)
+    return json.loads(content)
+
+def run_script():
+    parser = ArgumentParser(description="Run a list of wait/press/type/screenshot/sleep steps with one uiautomator session, "
+                                        "printing each step's latency as a json line")
+    parser.add_argument("script", type=FileType('r'), nargs='?', default=sys.stdin,
+                        help="a json (or yaml, if pyyaml is installed) list of steps, reads stdin if omitted")
+    add_command_options(parser)
+    args = parser.parse_args()
+    start_command_options(args)
+    printer = StatusPrinter(indent=0)
+
+    steps = read_script(args.script)
+
+    printer("Running {} steps".format(len(steps)))
+    with Indent(printer):
+        began = time.monotonic()
+        records = ScriptRunner(printer=printer).run(steps, on_step=lambda record : print(json.dumps(record), flush=True))
+        printer("Total: {} ms".format(int((time.monotonic() - began) * 1000)))
+
+    if not all(record['ok'] for record in records) or len(records) < len(steps):
+        sys.exit(60)
@@ -0,0 +1,180 @@
+import sys
+import json
+import time
+import hashlib
+import datetime
+from collections import namedtuple
+from scoobe.cli import parse, Parseable
+from scoobe.common import StatusPrinter, QuietPrinter, Indent, json_safe
+from scoobe.mysql import Session, Feedback
+from scoobe.server import is_uuid, sql_placeholders
+
+# Follows changes to the tables that provisioning touches, on one connection, by polling for rows past a
+# high-water mark: ids above the highest one seen, or modification times at or after the latest one seen.
+# Rows that were already seen at the latest time are told apart from new changes by a hash of their contents.
+# (those are two queries rather than one with an OR, which mysql can't answer from either column's index)
+
+# serial_column and merchant_column are how the --serials and --merchants filters apply to the table
+WatchedTable = namedtuple('WatchedTable', 'name serial_column merchant_column')
+
+watched_tables = [ WatchedTable('device_provision', 'serial_number', 'merchant_id'),
+                   WatchedTable('merchant',         None,            'id'),
+                   WatchedTable('setting',          None,            'merchant_id') ]
+
+time_column = 'modified_time'
+
+def row_hash(row):
+    return hashlib.sha1(json.dumps(row, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+class TableWatcher:
+
+    # `where` is extra sql conditions, starting with AND (or empty), and `where_params` fill its placeholders
+    def __init__(self, table, session, where='', where_params=()):
+        self.table = table
+        self.session = session
+        self.where = where
+        self.where_params = tuple(where_params)
+
+        self.timed = bool(session.execute("SHOW COLUMNS FROM {} LIKE '{}';".format(table, time_column),
+                                          Feedback.ManyRows))
+
+        self.max_id = session.execute("SELECT MAX(id) AS max_id FROM {} WHERE 1=1 {};".format(table, where),
+                                      Feedback.OneRow, lambda row : row['max_id'], params=self.where_params) or 0
+
+        # the rows at the latest time have been seen already
+        self.latest = None
+        self.seen = {}
+        if self.timed:
+            self.latest = session.execute(
+                    "SELECT MAX({0}) AS latest FROM {1} WHERE 1=1 {2};".format(time_column, table, where),
+                    Feedback.OneRow, lambda row : row['latest'], params=self.where_params)
+            if self.latest is not None:
+                rows = session.execute("SELECT * FROM {} WHERE {} = %s {};".format(table, time_column, where),
+                                       Feedback.ManyRows, params=(self.latest,) + self.where_params) or []
+                self.seen = { row['id'] : row_hash(row) for row in rows }
+
+    # the rows that changed since the last poll, as events
+    def poll(self):
+        rows = self.session.execute("SELECT * FROM {} WHERE id > %s {} ORDER BY id;".format(self.table, self.where),
+                                    Feedback.ManyRows, params=(self.max_id,) + self.where_params) or []
+
+        if self.timed and self.latest is not None:
+            rows += self.session.execute("SELECT * FROM {} WHERE {} >= %s {};".format(
+                                         self.table, time_column, self.where),
+                                         Feedback.ManyRows, params=(self.latest,) + self.where_params) or []
+
+            # a new row that's also recent comes back from both
+            rows = sorted({ row['id'] : row for row in rows }.values(), key=lambda row : row['id'])
+
+        events = []
+        latest, seen = self.latest, dict(self.seen)
+        for row in rows:
+            digest = row_hash(row)
+            row_time = row.get(time_column) if self.timed else None
+
+            if row_time is not None and row_time == self.latest and self.seen.get(row['id']) == digest:
+                continue
+
+            events.append({ 'table'  : self.table,
+                            'change' : 'insert' if row['id'] > self.max_id else 'update',
+                            'seen'   : datetime.datetime.now().isoformat(),
+                            'row'    : { k : json_safe(v) for k, v in row.items() } })
+
+            if row_time is not None and (latest is None or row_time > latest):
+                latest, seen = row_time, {}
+            if row_time is not None and row_time == latest:
+                seen[row['id']] = digest
+
+        self.max_id = max([self.max_id] + [ row['id'] for row in rows ])
+        self.latest, self.seen = latest, seen
+        return events
+
+# the sql that limits a table to the rows the user asked about, and the params for its placeholders
+# (or None, if the table can't be limited that way)
+def filter_condition(table, serials, merchant_ids):
+    conditions = []
+    params = []
+    if serials and table.serial_column:
+        conditions.append("{} IN ({})".format(table.serial_column, sql_placeholders(serials)))
+        params += serials
+    if merchant_ids and table.merchant_column:
+        conditions.append("{} IN ({})".format(table.merchant_column, sql_placeholders(merchant_ids)))
+        params += merchant_ids
+    if not conditions:
+        return None
+    return ('AND (' + ' OR '.join(conditions) + ')', params)
+
+# the row ids of the given merchant uuids and ids
+# (looked up separately, mysql would compare a uuid to the numeric id column as 0)
+def get_merchant_ids(merchants, session):
+    uuids = [ x for x in merchants if is_uuid(x) ]
+    ids = [ int(x) for x in merchants if not is_uuid(x) ]
+
+    conditions = []
+    if uuids:
+        conditions.append("uuid IN ({})".format(sql_placeholders(uuids)))
+    if ids:
+        conditions.append("id IN ({})".format(sql_placeholders(ids)))
+
+    return [ row['id'] for row in session.execute("SELECT id FROM merchant WHERE {};".format(' OR '.join(conditions)),
+                                                  Feedback.ManyRows, params=uuids + ids) or [] ]
+
+# calls on_event with each change until `timeout` seconds pass (or forever, if there isn't one)
+# with `once`, stops after the first poll that sees a change and returns False if the timeout comes first
+def watch(target, serials=[], merchants=[], interval=1.0, timeout=None, once=False,
+          on_event=lambda event : None, printer=StatusPrinter()):
+
+    printer("Watching {} on {}".format(', '.join(x.name for x in watched_tables), target.get_name()))
+    with Indent(printer), Session(target, 'metaRO', 'test321', printer) as session:
+
+        # the connection is worth hearing about, the queries every second aren't
+        session.printer = QuietPrinter()
+
+        merchant_ids = []
+        if merchants:
+            merchant_ids = get_merchant_ids(merchants, session)
+            if not merchant_ids:
+                raise ValueError("None of {} are merchants on {}".format(', '.join(merchants), target.get_name()))
+
+        watchers = []
+        for table in watched_tables:
+            condition = filter_condition(table, serials, merchant_ids)
+            if (serials or merchants) and condition is None:
+                continue
+            watchers.append(TableWatcher(table.name, session, *(condition or ())))
+        printer("Watching for changes to {}".format(', '.join(x.table for x in watchers)))
+
+        began = time.monotonic()
+        while True:
+            polled = time.monotonic()
+            events = [ event for watcher in watchers for event in watcher.poll() ]
+            for event in events:
+                on_event(event)
+
+            if once and events:
+                return True
+            if timeout is not None and time.monotonic() - began >= timeout:
+                return not once
+            time.sleep(max(0, interval - (time.monotonic() - polled)))
+
+def print_watch():
+
+    parsed_args = parse(Parseable.target, Parseable.serials, Parseable.merchants, Parseable.interval,
+                        Parseable.timeout, Parseable.once,
+                        description="Print a json line for each change to device_provision, merchant or setting "
+                                    "rows (for the given serials/merchants, if any), as it happens")
+    printer = StatusPrinter(indent=0)
+
+    try:
+        ok = watch(parsed_args.target, parsed_args.serials, parsed_args.merchants, parsed_args.interval,
+                   parsed_args.timeout, parsed_args.once,
+                   on_event=lambda event : print(json.dumps(event), flush=True), printer=printer)
+    except ValueError as ex:
+        printer(str(ex))
+        sys.exit(30)
+    except KeyboardInterrupt:
+        return
+
+    if not ok:
+        printer("Timed out")
+        sys.exit(50)
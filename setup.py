@@ -7,7 +7,7 @@ setup(name='scoobe',
       author_email='matt.rixman@clover.com',
       packages=['scoobe'],
       python_requires= '>=3',
-      install_requires=['uiautomator', 'sh', 'mysqlclient', 'sshconf', 'requests', 'ifaddr', 'sortedcontainers', 'xmltodict'],
+      install_requires=['uiautomator', 'sh', 'mysqlclient', 'sshconf', 'requests', 'ifaddr', 'xmltodict'],
       entry_points={'console_scripts' : [
           # press the button with the given text
           'press_button = scoobe.ui:press',
@@ -15,6 +15,9 @@ setup(name='scoobe',
           # wait for the given text to appear on the screen
           'wait_text = scoobe.ui:wait_text',
 
+          # run a json list of wait/press/type/screenshot steps in one uiautomator session, timing each
+          'ui_script = scoobe.ui:run_script',
+
           # reset device, clear storage
           'master_clear = scoobe.device:master_clear',
 
@@ -36,6 +39,9 @@ setup(name='scoobe',
           # dump the device screen to png
           'screenshot = scoobe.device:print_screenshot',
 
+          # dump a series of screenshots (at a target rate) to a directory or a zip file
+          'burst_screenshot = scoobe.device:print_burst_screenshot',
+
           # find an IP address pair that can ping the other.
           # One goes with a network interface on the device,
           # the other that goes with a network interface on localhost.
@@ -53,6 +59,9 @@ setup(name='scoobe',
           # given a serial number and a server, see which merchant the server thinks the device goes with
           'register_device = scoobe.server:print_register_device',
 
+          # register every (serial, cpuid) row in a csv/json-lines manifest, a chunk at a time
+          'register_devices = scoobe.server:print_register_devices',
+
           # given a merchant uuid or a merchant id, print the other
           'merchant = scoobe.server:print_merchant',
 
@@ -62,6 +71,9 @@ setup(name='scoobe',
           # print the version names for all packages on the device matching 'com.clover*'
           'device_packages = scoobe.device:print_device_packages',
 
+          # like device_packages, but for every attached device (prints a package x serial matrix)
+          'fleet_packages = scoobe.device:print_fleet_packages',
+
           # given a serial number, a server, and a reseller id, set this device to that reseller according to that server
           'set_device_reseller = scoobe.server:print_set_device_reseller',
 
@@ -74,6 +86,12 @@ setup(name='scoobe',
           # attach the specified device to the specified merchant (modifies device reseller if necessary)
           'provision_device = scoobe.server:provision',
 
+          # provision every (serial, cpuid, merchant) row in a csv/json-lines manifest, printing a json line per row
+          'provision_many = scoobe.server:print_provision_many',
+
+          # deprovision every serial in a csv/json-lines manifest, printing a json line per row
+          'deprovision_many = scoobe.server:print_deprovision_many',
+
           # see whether this merchant has accepted billing terms
           'terms_accepted= scoobe.server:print_acceptedness',
 
@@ -95,12 +113,42 @@ setup(name='scoobe',
           # create a new merchant
           'new_merchant = scoobe.server:print_new_merchant',
 
+          # create many merchants in parallel
+          'new_merchants = scoobe.server:print_new_merchants',
+
+          # fill a local server with made-up resellers, plans, merchants and devices
+          'seed = scoobe.seed:print_seed',
+
+          # make one server's plan groups, plans, partner controls and event subscriptions match another's
+          'sync_targets = scoobe.sync:print_sync_targets',
+
+          # show how two servers' plan groups, plans, partner controls and event subscriptions differ
+          'diff_targets = scoobe.sync:print_diff_targets',
+
+          # show how long commands have been taking, by day, target and phase (tunnel, query, http, adb...)
+          'scoobe_stats = scoobe.latency_stats:print_latency_stats',
+
+          # print device_provision, merchant and setting changes as json lines while they happen
+          'watch = scoobe.watch:print_watch',
+
           # get a session cookie (asks the user to initialize some environment varibles if they are not set)
           'internal_login = scoobe.server:print_cookie',
 
+          # save a server's reference data to a file that read-only commands can use in its place
+          'snapshot = scoobe.server:print_snapshot',
+
           # describe the resellers on this server
           'resellers = scoobe.server:print_resellers',
 
+          # print a reseller and everything under it
+          'reseller_subtree = scoobe.reseller_tree:print_reseller_subtree',
+
+          # print a reseller's parents, up to the root
+          'reseller_ancestors = scoobe.reseller_tree:print_reseller_ancestors',
+
+          # print the resellers between two resellers
+          'reseller_path = scoobe.reseller_tree:print_reseller_path',
+
           # assign a reseller to a merchant
           'set_merchant_reseller = scoobe.server:print_set_merchant_reseller',
 
@@ -165,7 +213,7 @@ setup(name='scoobe',
           'new_event_subscription = scoobe.server:print_new_event_subscription',
 
           # pick a merchant at random
-          'random_merchant = scoobe.server:print_random_merchant',
+          'random_merchant = scoobe.sampler:print_random_merchant',
 
           # what are your permissions on this server?
           'my_permissions = scoobe.server:print_my_permissions',
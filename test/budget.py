@@ -0,0 +1,16 @@
+from contextlib import contextmanager
+from scoobe import stats
+
+# fails `test` if the block makes more round trips than allowed, e.g.
+#
+#   with assert_budget(self, sql_statements=1, http_requests=0):
+#       get_merchant(...)
+#
+# counts that aren't mentioned aren't limited
+@contextmanager
+def assert_budget(test, **limits):
+    with stats.counted() as counts:
+        yield counts
+    for name, limit in limits.items():
+        test.assertIn(name, counts, "{} isn't something scoobe.stats counts".format(name))
+        test.assertLessEqual(counts[name], limit, "{} went over budget".format(name))
@@ -0,0 +1,92 @@
+import unittest
+import os
+import json
+import tempfile
+import threading
+from scoobe.server import unparse_boarding_xml, compiled_boarding_template, MerchantIdGenerator
+
+class CompiledBoardingTemplateTest(unittest.TestCase):
+
+    # the compiled template has to produce exactly what the xmltodict round trip does
+    def assert_same(self, region, tag, value, mid=2000012345):
+        merchant_str = "merchant_" + str(mid) + "BOARD_TO_SHARD_0"
+        bemid = 8000000000 - mid
+        expected = unparse_boarding_xml(region, mid, bemid, merchant_str, tag, value)
+        actual = compiled_boarding_template(region, tag).render(mid=mid, bemid=bemid,
+                                                                merchant_str=merchant_str,
+                                                                channel_value=value)
+        self.assertEqual(expected, actual)
+
+    def test_existing_tag(self):
+        for region in ['US', 'EU']:
+            self.assert_same(region, 'Bank', 'SOME_BANK')
+
+    def test_appended_tag(self):
+        for region in ['US', 'EU']:
+            self.assert_same(region, 'BankMarker', '9d1f4ca9-6c6e-4c5b-b2d4-8f1a6a1b6e2e')
+
+    def test_escaping(self):
+        for region in ['US', 'EU']:
+            self.assert_same(region, 'Bank', 'A&B <"Bank\'s"> {not a field}')
+
+    def test_non_strings(self):
+        for region in ['US', 'EU']:
+            self.assert_same(region, 'Bank', 12345)
+            self.assert_same(region, 'Bank', True)
+            self.assert_same(region, 'Bank', False)
+
+class MerchantIdGeneratorTest(unittest.TestCase):
+
+    def test_no_repeats_across_generators(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'merchant_ids')
+            # separate generators sharing the file, as separate processes on one host would
+            generators = [ MerchantIdGenerator(path) for i in range(4) ]
+            mids = []
+            def run(generator):
+                for i in range(50):
+                    mids.append(generator.next())
+            threads = [ threading.Thread(target=run, args=(x,)) for x in generators ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(200, len(set(mids)))
+        self.assertTrue(all(MerchantIdGenerator.base < mid < 8000000000 for mid in mids))
+
+    def test_hosts_never_overlap(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # two hosts, each with its own record, and a process apiece
+            generators = [ MerchantIdGenerator(os.path.join(directory, 'a'), entropy='host-a:1234'),
+                           MerchantIdGenerator(os.path.join(directory, 'b'), entropy='host-b:1234') ]
+            mids = [ [], [] ]
+            def run(index):
+                for i in range(3000):
+                    mids[index].append(generators[index].next())
+            threads = [ threading.Thread(target=run, args=(i,)) for i in range(2) ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(set(), set(mids[0]) & set(mids[1]))
+        self.assertEqual(3000, len(set(mids[0])))
+
+    def test_used_up_range_is_replaced(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'merchant_ids.json')
+            generator = MerchantIdGenerator(path, entropy='host-a:1234')
+            first = generator.next()
+            with open(path) as state_file:
+                state = json.load(state_file)
+            state['next'] = 2 ** MerchantIdGenerator.range_bits
+            with open(path, 'w') as state_file:
+                json.dump(state, state_file)
+
+            second = generator.next()
+            with open(path) as state_file:
+                self.assertEqual(2, len(json.load(state_file)['ranges']))
+
+        self.assertNotEqual(first >> MerchantIdGenerator.range_bits, second >> MerchantIdGenerator.range_bits)
+        self.assertLess(second, MerchantIdGenerator.base + 2 ** 32)
@@ -0,0 +1,148 @@
+import os
+import gzip
+import json
+import tempfile
+import threading
+import unittest
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from scoobe import http
+from scoobe.cli import target_from_arg
+from scoobe.common import StatusPrinter, ServerTarget
+from scoobe.http import get_response_as_dict
+from scoobe.server import get_merchant
+from test.budget import assert_budget
+
+data = { 'source'    : 'stg1',
+         'taken'     : '2020-01-01T00:00:00',
+         'tables'    : { 'merchant'      : { 'columns' : ['id', 'uuid', 'reseller_id', 'merchant_plan_id'],
+                                             'rows'    : [ [3, 'MERCHANTAAAAA', 1, 5] ] },
+                         'merchant_plan' : { 'columns' : ['id', 'uuid'],
+                                             'rows'    : [ [5, 'PLANAAAAAAAAA'] ] },
+                         'reseller'      : { 'columns' : ['id', 'uuid'],
+                                             'rows'    : [ [1, 'RESELLERAAAAA'] ] } },
+         'endpoints' : {} }
+
+# logs anybody in, answers every GET with an empty list
+class Handler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Set-Cookie', 'internalSession=abc')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        body = json.dumps({ 'elements' : [] }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+# like Handler, but its sessions can be ended (as if it had restarted) by bumping `generation`
+class ExpiringHandler(Handler):
+
+    generation = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Set-Cookie', 'internalSession={}'.format(ExpiringHandler.generation))
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        if self.headers.get('Cookie') != 'internalSession={}'.format(ExpiringHandler.generation):
+            self.send_response(401)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        super().do_GET()
+
+class LocalHttp(ServerTarget):
+
+    def __init__(self, port):
+        self.port = port
+
+    def get_name(self):
+        return 'localhost:{}'.format(self.port)
+
+    def get_cli_arg(self):
+        return self.get_name()
+
+    def get_hostname(self):
+        return 'localhost'
+
+    def get_http_port(self):
+        return self.port
+
+    def get_hypertext_protocol(self):
+        return 'http'
+
+    def get_mysql_port(self):
+        pass
+
+    def get_db_name(self):
+        pass
+
+    def get_admin_hostname(self):
+        pass
+
+    def get_admin_http_port(self):
+        pass
+
+    def get_readonly_mysql_creds(self):
+        pass
+
+    def get_readwrite_mysql_creds(self):
+        pass
+
+class BudgetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.printer = StatusPrinter(file=open(os.devnull, 'w'))
+
+    def tearDown(self):
+        self.printer.file.close()
+
+    def test_get_merchant(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'stg1.snapshot.json.gz')
+            with gzip.open(path, 'wt') as snapshot_file:
+                json.dump(data, snapshot_file)
+
+            with assert_budget(self, sql_statements=1, sql_round_trips=1, http_requests=0, tunnels=0):
+                merchant = get_merchant('MERCHANTAAAAA', target_from_arg(path), printer=self.printer)
+            self.assertEqual('PLANAAAAAAAAA', merchant.plan_id)
+
+    def test_one_login_per_target(self):
+        server = HTTPServer(('localhost', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            target = LocalHttp(server.server_address[1])
+            with assert_budget(self, logins=1, http_requests=3) as counts:
+                for i in range(2):
+                    self.assertEqual([], get_response_as_dict('v3/resellers', target, printer=self.printer))
+            self.assertEqual(3, counts['http_requests'])
+            self.assertGreater(counts['http_bytes_received'], 0)
+        finally:
+            server.shutdown()
+            server.server_close()
+            http._cookies.clear()
+
+    def test_log_in_again_when_the_session_ends(self):
+        server = HTTPServer(('localhost', 0), ExpiringHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            target = LocalHttp(server.server_address[1])
+            with assert_budget(self, logins=2, http_requests=5):
+                self.assertEqual([], get_response_as_dict('v3/resellers', target, printer=self.printer))
+                ExpiringHandler.generation += 1
+                self.assertEqual([], get_response_as_dict('v3/resellers', target, printer=self.printer))
+        finally:
+            server.shutdown()
+            server.server_close()
+            http._cookies.clear()
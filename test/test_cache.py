@@ -0,0 +1,34 @@
+import os
+import tempfile
+import unittest
+import multiprocessing
+from scoobe.cache import Cache
+
+def put_many(home, prefix):
+    os.environ['SCOOBE_HOME'] = home
+    cache = Cache('shared')
+    for i in range(20):
+        cache.put('{}{}'.format(prefix, i), i)
+
+class CacheTest(unittest.TestCase):
+
+    def test_concurrent_processes_keep_each_others_entries(self):
+        with tempfile.TemporaryDirectory() as home:
+            context = multiprocessing.get_context('fork')
+            processes = [ context.Process(target=put_many, args=(home, prefix)) for prefix in 'abcd' ]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+
+            saved = os.environ.get('SCOOBE_HOME')
+            os.environ['SCOOBE_HOME'] = home
+            try:
+                cache = Cache('shared')
+                self.assertEqual(80, len([ x for x in (cache.get(p + str(i)) for p in 'abcd' for i in range(20))
+                                           if x is not None ]))
+            finally:
+                if saved is None:
+                    del os.environ['SCOOBE_HOME']
+                else:
+                    os.environ['SCOOBE_HOME'] = saved
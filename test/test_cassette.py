@@ -0,0 +1,119 @@
+import os
+import gzip
+import json
+import decimal
+import datetime
+import tempfile
+import threading
+import unittest
+import sh
+from http.server import HTTPServer
+from scoobe import http, cassette
+from scoobe.cassette import Cassette, RecordedCommand
+from scoobe.common import StatusPrinter
+from scoobe.http import get_response_as_dict
+from scoobe.server import get_merchant
+from scoobe.snapshot import Snapshot
+from test.budget import assert_budget
+from test.test_budget import Handler, LocalHttp, data
+
+# a command that mustn't be run
+class Unreachable:
+
+    def __call__(self, *args, **kwargs):
+        raise AssertionError("replaying ran the command")
+
+    def __str__(self):
+        return '/usr/bin/echo'
+
+class CassetteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.printer = StatusPrinter(file=open(os.devnull, 'w'))
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'cassette.json.gz')
+
+    def tearDown(self):
+        cassette.active = None
+        http._cookies.clear()
+        self.directory.cleanup()
+        self.printer.file.close()
+
+    def record(self):
+        cassette.active = Cassette(self.path, 'record')
+
+    def replay(self):
+        cassette.active.save()
+        cassette.active = Cassette(self.path, 'replay')
+
+    def test_http(self):
+        server = HTTPServer(('localhost', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        target = LocalHttp(server.server_address[1])
+        try:
+            self.record()
+            self.assertEqual([], get_response_as_dict('v3/resellers', target, printer=self.printer))
+        finally:
+            server.shutdown()
+            server.server_close()
+        http._cookies.clear()
+
+        # the server is gone, so these can only come from the cassette
+        self.replay()
+        with gzip.open(self.path, 'rt') as cassette_file:
+            self.assertNotIn('internalSession=abc', cassette_file.read())
+        with assert_budget(self, logins=1, http_requests=2):
+            self.assertEqual([], get_response_as_dict('v3/resellers', target, printer=self.printer))
+
+    def test_sql(self):
+        path = os.path.join(self.directory.name, 'stg1.snapshot.json.gz')
+        with gzip.open(path, 'wt') as snapshot_file:
+            json.dump(data, snapshot_file)
+
+        self.record()
+        merchant = get_merchant('MERCHANTAAAAA', Snapshot(path), printer=self.printer)
+        os.remove(path)
+
+        self.replay()
+        replayed = get_merchant('MERCHANTAAAAA', LocalHttp(0), printer=self.printer)
+        self.assertEqual(vars(merchant), vars(replayed))
+
+        with self.assertRaises(ValueError):
+            get_merchant('MERCHANTBBBBB', LocalHttp(0), printer=self.printer)
+
+    def test_adb(self):
+        self.record()
+        echo = RecordedCommand(sh.echo)
+        self.assertEqual('one two\n', str(echo('one', 'two')))
+        with self.assertRaises(sh.ErrorReturnCode_1):
+            RecordedCommand(sh.false)()
+
+        self.replay()
+        self.assertEqual('one two\n', str(RecordedCommand(Unreachable())('one', 'two')))
+        self.assertEqual(['one two\n'], list(RecordedCommand(Unreachable())(['one', 'two'])))
+        with self.assertRaises(sh.ErrorReturnCode_1):
+            RecordedCommand(Unreachable(), ['false'])()
+
+    def test_cookie_values_are_not_kept(self):
+        headers = cassette._safe_headers({ 'Set-Cookie'    : 'internalSession=abc; Path=/, lb=xyz; '
+                                                             'Expires=Wed, 21 Oct 2026 07:28:00 GMT',
+                                           'Authorization' : 'Bearer abc',
+                                           'Content-Type'  : 'application/json' })
+        self.assertEqual({ 'Set-Cookie'   : 'internalSession=replayed; Path=/, lb=replayed; '
+                                            'Expires=Wed, 21 Oct 2026 07:28:00 GMT',
+                           'Content-Type' : 'application/json' }, headers)
+
+    def test_values_round_trip(self):
+        row = { 'created' : datetime.datetime(2020, 1, 2, 3, 4, 5), 'amount' : decimal.Decimal('1.50'),
+                'blob' : b'\x00\x01', 'day' : datetime.date(2020, 1, 2), 'id' : 3, 'name' : None }
+        encoded = json.loads(json.dumps(cassette._encode_row(row)))
+        self.assertEqual(row, cassette._decode_row(encoded))
+
+    def test_repeats_replay_in_order(self):
+        self.record()
+        for answer in ['first', 'second']:
+            cassette.play('adb', ['x'], 'x', lambda : answer, lambda x : x, lambda x : x)
+
+        self.replay()
+        answers = [ cassette.play('adb', ['x'], 'x', None, None, lambda x : x) for i in range(3) ]
+        self.assertEqual(['first', 'second', 'second'], answers)
@@ -0,0 +1,59 @@
+import os
+import time
+import tempfile
+import unittest
+from scoobe import latency, stats, trace
+
+class LatencyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'latency.log')
+        self.max_log_bytes = latency.max_log_bytes
+
+    def tearDown(self):
+        latency.max_log_bytes = self.max_log_bytes
+        self.dir.cleanup()
+
+    def test_round_trip(self):
+        line = latency.record_line('provision_device', 'stg1', { 'total' : 2.5, 'http' : 0.25 }, now=86400.0)
+        self.assertEqual(1, line.count('\n'))
+        latency.append(line, self.path)
+        latency.append('garbage\n', self.path)
+
+        records = latency.read_records(self.path)
+        self.assertEqual(1, len(records))
+        self.assertEqual(('provision_device', 'stg1', 2500, 250, 0),
+                         tuple(records[0][x] for x in ['command', 'target', 'total', 'http', 'adb']))
+
+    def test_bounded(self):
+        latency.max_log_bytes = 200
+        for i in range(20):
+            latency.append(latency.record_line('merchant', 'stg1', { 'total' : i }), self.path)
+
+        self.assertLess(os.path.getsize(self.path), 200 + 100)
+        self.assertLess(os.path.getsize(self.path + '.1'), 200 + 100)
+        records = latency.read_records(self.path)
+        self.assertLess(len(records), 20)
+        self.assertEqual(19000, records[-1]['total'])
+
+    def test_percentiles(self):
+        ordered = list(range(1, 101))
+        self.assertEqual((50, 95, 99), tuple(latency.percentile(ordered, x) for x in [0.5, 0.95, 0.99]))
+        self.assertEqual(7, latency.percentile([7], 0.99))
+
+    def test_summary(self):
+        now = time.time()
+        records = [ { 'time' : now, 'command' : 'merchant', 'target' : 'stg1', 'total' : x, 'tunnel' : 0,
+                      'connect' : 0, 'query' : x // 2, 'http' : 0, 'adb' : 0 } for x in range(1, 11) ]
+        summary = latency.summarize(records)
+
+        self.assertEqual({'total', 'query'}, { key[3] for key in summary })
+        total = next(figures for key, figures in summary.items() if key[3] == 'total')
+        self.assertEqual({ 'n' : 10, 'p50' : 5, 'p95' : 10, 'p99' : 10 }, total)
+
+    def test_phases_are_timed_without_a_tracer(self):
+        before = stats.timings()['adb']
+        with trace.span('adb shell getprop', 'adb', phase='adb'):
+            time.sleep(0.01)
+        self.assertGreaterEqual(stats.timings()['adb'] - before, 0.009)
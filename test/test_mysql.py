@@ -0,0 +1,70 @@
+import unittest
+from scoobe import mysql
+from scoobe.common import StatusPrinter
+
+# stands in for a transactional Session, remembers whether it would have committed
+class FakeSession:
+
+    def __init__(self, change_cts):
+        self.change_cts = change_cts
+        self.batches = []
+        self.outcome = None
+
+    def __call__(self, target, mysql_user, mysql_pass, printer=StatusPrinter(), transaction=False):
+        self.transaction = transaction
+        return self
+
+    def __enter__(self):
+        return self
+
+    def execute_batch(self, statements):
+        self.batches.append(statements)
+        return self.change_cts
+
+    def __exit__(self, type, value, traceback):
+        self.outcome = 'commit' if type is None else 'rollback'
+
+class UnitOfWorkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.real_session = mysql.Session
+
+    def tearDown(self):
+        mysql.Session = self.real_session
+
+    def run_work(self, change_cts, expectations):
+        mysql.Session = FakeSession(change_cts)
+        with mysql.UnitOfWork('target', 'user', 'pass') as work:
+            for i, expect in enumerate(expectations):
+                work.add("UPDATE t SET x = {};".format(i), expect=expect)
+        return work
+
+    def test_one_round_trip(self):
+        work = self.run_work([1, 0], [1, None])
+        self.assertEqual(1, len(mysql.Session.batches))
+        self.assertEqual(2, len(mysql.Session.batches[0]))
+        self.assertTrue(mysql.Session.transaction)
+        self.assertEqual('commit', mysql.Session.outcome)
+        self.assertEqual([1, 0], work.change_cts)
+
+    def test_rollback_on_unexpected_count(self):
+        with self.assertRaises(ValueError):
+            self.run_work([1, 0], [1, 1])
+        self.assertEqual('rollback', mysql.Session.outcome)
+
+    def test_nothing_sent_if_block_fails(self):
+        mysql.Session = FakeSession([1])
+        with self.assertRaises(KeyError):
+            with mysql.UnitOfWork('target', 'user', 'pass') as work:
+                work.add("UPDATE t SET x = 1;", expect=1)
+                raise KeyError('oops')
+        self.assertEqual([], mysql.Session.batches)
+
+class ExecuteManyTest(unittest.TestCase):
+
+    def test_batched_only_when_values_are_all_placeholders(self):
+        batched = "INSERT INTO t (a, b, c) VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE b = VALUES(b);"
+        mixed = "INSERT INTO t (a, b, c) VALUES (%s, %s, '1') ON DUPLICATE KEY UPDATE b = VALUES(b);"
+        self.assertEqual(1, mysql.executemany_round_trips(batched, 500))
+        self.assertEqual(500, mysql.executemany_round_trips(mixed, 500))
+        self.assertEqual(500, mysql.executemany_round_trips("UPDATE t SET a = %s WHERE b = %s", 500))
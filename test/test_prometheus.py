@@ -0,0 +1,76 @@
+import os
+import tempfile
+import threading
+import unittest
+from scoobe import prometheus, stats
+
+def run_samples(total=1.5, code=200):
+    return prometheus.samples('merchant', 'stg1', { 'total' : total },
+                              { 'http_status_{}'.format(code) : 2, 'sql_errors' : 1 },
+                              { 'query' : stats.Histogram([0.01, 0.2]), 'device_ready' : stats.Histogram([45.0]) })
+
+class PrometheusTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'scoobe.prom')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def read(self):
+        with open(self.path) as prom_file:
+            return prometheus.parse_samples(prom_file.read())
+
+    def test_histogram(self):
+        samples = run_samples()
+        labels = (('command', 'merchant'), ('target', 'stg1'))
+        self.assertEqual(0, samples[('scoobe_command_duration_seconds_bucket', labels + (('le', '1'),))])
+        self.assertEqual(1, samples[('scoobe_command_duration_seconds_bucket', labels + (('le', '2.5'),))])
+        self.assertEqual(1, samples[('scoobe_command_duration_seconds_count', labels)])
+        self.assertEqual(2, samples[('scoobe_phase_duration_seconds_count', (('command', 'merchant'),
+                                                                              ('phase', 'query')))])
+        self.assertEqual(1, samples[('scoobe_phase_duration_seconds_bucket', (('command', 'merchant'),
+                                                                               ('phase', 'query'), ('le', '0.05')))])
+        self.assertEqual(2, samples[('scoobe_phase_duration_seconds_bucket', (('command', 'merchant'),
+                                                                               ('phase', 'query'), ('le', '0.25')))])
+
+    def test_observations_stay_the_same_size(self):
+        histogram = stats.Histogram()
+        for i in range(10000):
+            histogram.add(i / 100.0)
+        self.assertEqual(len(stats.buckets) + 1, len(histogram.counts))
+        self.assertEqual(10000, histogram.cumulative()[-1])
+        self.assertEqual(6, histogram.cumulative()[0])
+
+    def test_render_parses_back(self):
+        samples = run_samples()
+        text = prometheus.render(samples)
+        self.assertIn('# TYPE scoobe_http_responses_total counter', text)
+        self.assertIn('scoobe_http_responses_total{command="merchant",code="200"} 2', text)
+        self.assertEqual(samples, prometheus.parse_samples(text))
+
+    def test_runs_add_up(self):
+        prometheus.merge_into(self.path, run_samples(code=200))
+        prometheus.merge_into(self.path, run_samples(code=401))
+
+        samples = self.read()
+        self.assertEqual(2, samples[('scoobe_sql_errors_total', (('command', 'merchant'),))])
+        self.assertEqual(2, samples[('scoobe_http_responses_total', (('command', 'merchant'), ('code', '401')))])
+        self.assertEqual(90.0, samples[('scoobe_device_ready_seconds_sum', ())])
+        self.assertEqual(0o644, os.stat(self.path).st_mode & 0o777)
+
+    def test_concurrent_runs(self):
+        def run():
+            for i in range(5):
+                prometheus.merge_into(self.path, run_samples())
+
+        threads = [ threading.Thread(target=run) for i in range(8) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        labels = (('command', 'merchant'), ('target', 'stg1'))
+        self.assertEqual(40, self.read()[('scoobe_command_duration_seconds_count', labels)])
+        self.assertEqual(['scoobe.prom', 'scoobe.prom.lock'], sorted(os.listdir(self.dir.name)))
@@ -0,0 +1,134 @@
+import os
+import gzip
+import json
+import time
+import tempfile
+import threading
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from scoobe.common import QuietPrinter, RateLimiter
+from scoobe.server import provision_many, deprovision_many, provision_uri, deprovision_uri
+from scoobe.snapshot import Snapshot
+
+tables = { 'merchant'         : { 'columns' : ['id', 'uuid', 'reseller_id'],
+                                  'rows'    : [ [3, 'MERCHANTAAAAA', 1], [4, 'MERCHANTBBBBB', 1] ] },
+           'device_provision' : { 'columns' : ['id', 'serial_number', 'merchant_id', 'reseller_id'],
+                                  'rows'    : [ [9, 'C030UQ00000001', 3, 1], [10, 'C030UQ00000002', None, 1] ] },
+           'authtoken'        : { 'columns' : ['id', 'uuid', 'deleted_time'],
+                                  'rows'    : [ [11, 'token', None], [12, 'token', None] ] },
+           'authtoken_uri'    : { 'columns' : ['authtoken_id', 'uri'],
+                                  'rows'    : [ [11, provision_uri], [12, deprovision_uri] ] } }
+
+# answers partner device PUTs, failing the ones for serials in `failing`
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    failing = [ 'C030UQ00000003' ]
+    paths = []
+
+    def do_PUT(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        Handler.paths.append(self.path)
+        code = 500 if self.path.split('/')[7] in Handler.failing else 200
+        body = b'{}' if code == 200 else b'{"message" : "no"}'
+        self.send_response(code)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+# a snapshot for the queries, with a local server for the PUTs
+class LocalTarget(Snapshot):
+
+    def __init__(self, path, port):
+        super().__init__(path)
+        self.port = port
+
+    def get_hostname(self):
+        return '127.0.0.1'
+
+    def get_http_port(self):
+        return self.port
+
+    def get_hypertext_protocol(self):
+        return 'http'
+
+class RateLimiterTest(unittest.TestCase):
+
+    def test_spaces_calls_across_threads(self):
+        limiter = RateLimiter(40)
+        began = time.monotonic()
+        threads = [ threading.Thread(target=limiter.wait) for i in range(9) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # the first goes right away, the other 8 wait their turn
+        self.assertGreaterEqual(time.monotonic() - began, 8 / 40.0 - 0.01)
+
+    def test_no_limit(self):
+        limiter = RateLimiter()
+        began = time.monotonic()
+        for i in range(1000):
+            limiter.wait()
+        self.assertLess(time.monotonic() - began, 0.1)
+
+class ProvisionManyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.dir.name, 'stg1.snapshot.json.gz')
+        with gzip.open(path, 'wt') as snapshot_file:
+            json.dump({ 'source' : 'stg1', 'taken' : 'now', 'tables' : tables, 'endpoints' : {} }, snapshot_file)
+
+        Handler.paths = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.target = LocalTarget(path, self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.dir.cleanup()
+
+    def test_failures_dont_stop_the_batch(self):
+        rows = [ { 'serial' : 'C030UQ00000001', 'cpuid' : 'a', 'merchant' : 'MERCHANTAAAAA' },
+                 { 'serial' : 'C030UQ00000002', 'cpuid' : 'b', 'merchant' : 'NOSUCHMERCHANT' },
+                 { 'serial' : 'C030UQ00000003', 'cpuid' : 'c', 'merchant' : '4' },
+                 { 'serial' : 'C030UQ00000004', 'cpuid' : 'd', 'merchant' : 'MERCHANTBBBBB' } ]
+        reported = []
+
+        results = provision_many(rows, self.target, concurrency=3, on_result=reported.append,
+                                 printer=QuietPrinter())
+
+        self.assertEqual([0, 1, 2, 3], [ x['row'] for x in results ])
+        self.assertEqual([True, False, False, True], [ x['ok'] for x in results ])
+        self.assertIn('NOSUCHMERCHANT', results[1]['error'])
+        self.assertEqual(500, results[2]['status'])
+        self.assertEqual('MERCHANTBBBBB', results[2]['merchant'])
+
+        # every row is reported once, as it finishes, and the unknown merchant never reaches the server
+        self.assertEqual([0, 1, 2, 3], sorted(x['row'] for x in reported))
+        self.assertEqual(3, len(Handler.paths))
+        self.assertTrue(all(x.endswith('/provision') for x in Handler.paths))
+
+    def test_deprovision_skips_devices_without_merchants(self):
+        rows = [ { 'serial' : 'C030UQ00000001' }, { 'serial' : 'C030UQ00000002' } ]
+
+        results = deprovision_many(rows, self.target, printer=QuietPrinter())
+
+        self.assertEqual([True, False], [ x['ok'] for x in results ])
+        self.assertIn('not associated with a merchant', results[1]['error'])
+        self.assertEqual(['/v3/partner/pp/merchants/MERCHANTAAAAA/devices/C030UQ00000001/deprovision'],
+                         Handler.paths)
+
+    def test_rate_limit(self):
+        rows = [ { 'serial' : 'C030UQ0000000{}'.format(i), 'merchant' : 'MERCHANTAAAAA' } for i in range(5, 10) ]
+
+        began = time.monotonic()
+        results = provision_many(rows, self.target, concurrency=5, rate=20, printer=QuietPrinter())
+
+        self.assertTrue(all(x['ok'] for x in results))
+        self.assertGreaterEqual(time.monotonic() - began, 4 / 20.0 - 0.01)
@@ -0,0 +1,132 @@
+import io
+import unittest
+from scoobe.cli import Manifest, field_name
+from scoobe.common import QuietPrinter
+from scoobe.server import register_devices
+
+# answers register_devices' two statements the way mysql would, from a dict of serial -> (cpuid, codes)
+class FakeCursor:
+
+    def __init__(self, devices):
+        self.devices = devices
+        self.rows = []
+        self.rowcount = 0
+
+    def execute(self, sql, args=()):
+        serials = list(args)
+        self.rows = [ { 'existing' : len([ x for x in serials if x in self.devices ]) } ]
+
+    # 1 per inserted row, 2 per changed row, 0 per row that was already as specified
+    def executemany(self, sql, rows):
+        self.rowcount = 0
+        for serial, cpuid, code, last_code in rows:
+            before = self.devices.get(serial)
+            self.devices[serial] = (cpuid, code, last_code)
+            if before is None:
+                self.rowcount += 1
+            elif before != self.devices[serial]:
+                self.rowcount += 2
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+class FakeConnection:
+
+    def __init__(self, devices):
+        self.devices = devices
+
+    def cursor(self):
+        return FakeCursor(self.devices)
+
+    def close(self):
+        pass
+
+class FakeTarget:
+
+    def __init__(self, devices):
+        self.devices = devices
+
+    def get_name(self):
+        return 'fake'
+
+    def get_db_connection(self):
+        return FakeConnection(self.devices)
+
+# a manifest as the cli would hand it over, read lazily
+def manifest(text):
+    parsed = type('Parsed', (), { field_name(Manifest()) : io.StringIO(text) })
+    return Manifest().get_val(parsed)
+
+class RegisterDevicesTest(unittest.TestCase):
+
+    def test_counts(self):
+        target = FakeTarget({ 'C030UQ00000001' : ('a', '11111111', '11111111'),
+                              'C030UQ00000002' : ('b', '11111111', '11111111'),
+                              'C030UQ00000003' : ('c', '22222222', '11111111') })
+        rows = [ { 'serial' : 'C030UQ00000001', 'cpuid' : 'a' },   # unchanged
+                 { 'serial' : 'C030UQ00000002', 'cpuid' : 'x' },   # new cpuid
+                 { 'serial' : 'C030UQ00000003', 'cpuid' : 'c' },   # new activation code
+                 { 'serial' : 'C030UQ00000004', 'cpuid' : 'd' },   # new
+                 { 'serial' : 'C030UQ00000005', 'cpuid' : 'e' } ]  # new
+        chunks = []
+
+        totals = register_devices(rows, target, chunk_size=2, on_chunk=chunks.append, printer=QuietPrinter())
+
+        self.assertEqual([(2, 0, 1, 1), (2, 1, 1, 0), (1, 1, 0, 0)],
+                         [ (x['rows'], x['inserted'], x['updated'], x['unchanged']) for x in chunks ])
+        self.assertEqual((5, 2, 2, 1), (totals['rows'], totals['inserted'], totals['updated'], totals['unchanged']))
+        self.assertEqual(('x', '11111111', '11111111'), target.devices['C030UQ00000002'])
+
+    def test_repeated_serial_counts_once(self):
+        target = FakeTarget({})
+        rows = [ { 'serial' : 'C030UQ00000001', 'cpuid' : 'a' }, { 'serial' : 'C030UQ00000001', 'cpuid' : 'b' } ]
+
+        totals = register_devices(rows, target, printer=QuietPrinter())
+
+        self.assertEqual((1, 1, 0, 0), (totals['rows'], totals['inserted'], totals['updated'], totals['unchanged']))
+        self.assertEqual('b', target.devices['C030UQ00000001'][0])
+
+    def test_bad_row_says_how_far_it_got(self):
+        target = FakeTarget({})
+        cpuid = '00000001740e21801000000007018640'
+        rows = manifest(''.join('C030UQ0000000{},{}\n'.format(i, cpuid) for i in range(1, 4)) +
+                        'not-a-serial,{}\n'.format(cpuid))
+
+        with self.assertRaises(ValueError) as raised:
+            register_devices(rows, target, chunk_size=2, printer=QuietPrinter())
+
+        self.assertIn('device 4 of the manifest', str(raised.exception))
+        self.assertIn('2 devices were already registered', str(raised.exception))
+        self.assertEqual(2, len(target.devices))
+
+    def test_missing_cpuid(self):
+        target = FakeTarget({})
+        rows = [ { 'serial' : 'C030UQ00000001', 'cpuid' : 'a' }, { 'serial' : 'C030UQ00000002' } ]
+
+        with self.assertRaises(ValueError) as raised:
+            register_devices(rows, target, printer=QuietPrinter())
+
+        self.assertIn('device 2 of the manifest: C030UQ00000002 has no cpuid', str(raised.exception))
+        self.assertEqual({}, target.devices)
+
+class ManifestTest(unittest.TestCase):
+
+    def check_rejected(self, line, problem):
+        with self.assertRaises(ValueError) as raised:
+            list(manifest(line))
+        self.assertIn(problem, str(raised.exception))
+
+    def test_serial_must_be_the_whole_value(self):
+        self.check_rejected("C043UQ72330608' OR '1'='1,00000001740e21801000000007018640\n", 'valid serial number')
+
+    def test_cpuid_must_be_hex(self):
+        self.check_rejected("C043UQ72330608,0000000174') OR 1=1\n", 'valid cpuid')
+
+    def test_merchant_must_be_a_uuid_or_an_id(self):
+        self.check_rejected("C043UQ72330608,00000001740e21801000000007018640,1 OR 1=1\n", 'valid merchant')
+
+    def test_valid_rows(self):
+        rows = list(manifest("C043UQ72330608,00000001740e21801000000007018640,TCF09QDYHEDQ8\n"
+                             "C043UQ72330609,00000001740e21801000000007018641,12\n"
+                             "C043UQ72330610\n"))
+        self.assertEqual(['TCF09QDYHEDQ8', '12', None], [ x.get('merchant') for x in rows ])
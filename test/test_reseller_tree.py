@@ -0,0 +1,53 @@
+import unittest
+from scoobe.reseller_tree import ResellerTree
+
+#        1            6
+#      /   \          |
+#     2     3         7
+#    / \
+#   4   5
+rows = [ [1, 'ROOTAAAAAAAAA', 'root',  None],
+         [2, 'LEFTAAAAAAAAA', 'left',  1],
+         [3, 'RIGHTAAAAAAAA', 'right', 1],
+         [4, 'LLAAAAAAAAAAA', 'll',    2],
+         [5, 'LRAAAAAAAAAAA', 'lr',    2],
+         [6, 'OTHERAAAAAAAA', 'other', None],
+         [7, 'OCHILDAAAAAAA', 'child', 6] ]
+
+class ResellerTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = ResellerTree(rows)
+
+    def test_subtree(self):
+        self.assertEqual([2, 4, 5], self.tree.subtree(2))
+        self.assertEqual([1, 2, 4, 5, 3], self.tree.subtree(1))
+        self.assertEqual([3], self.tree.subtree(3))
+
+    def test_ancestors(self):
+        self.assertEqual([2, 1], self.tree.ancestors(5))
+        self.assertEqual([], self.tree.ancestors(1))
+        self.assertEqual(1, self.tree.root(4))
+        self.assertTrue(self.tree.is_ancestor(1, 5))
+        self.assertFalse(self.tree.is_ancestor(3, 5))
+
+    def test_path(self):
+        self.assertEqual([4, 2, 1, 3], self.tree.path(4, 3))
+        self.assertEqual([4, 2, 5], self.tree.path(4, 5))
+        self.assertEqual([1, 2, 4], self.tree.path(1, 4))
+        self.assertIsNone(self.tree.path(4, 7))
+
+    def test_resolve(self):
+        self.assertEqual(3, self.tree.resolve('RIGHTAAAAAAAA'))
+        self.assertEqual(3, self.tree.resolve('3'))
+        with self.assertRaises(ValueError):
+            self.tree.resolve('99')
+
+    def test_incremental_add(self):
+        self.tree.add([[8, 'NEWAAAAAAAAAA', 'new', 3]])
+        self.assertEqual([3, 8], self.tree.subtree(3))
+        self.assertEqual(8, self.tree.max_db_id)
+
+    def test_cycle_terminates(self):
+        tree = ResellerTree([[1, 'AAAAAAAAAAAAA', 'a', 2], [2, 'BBBBBBBBBBBBB', 'b', 1]])
+        self.assertEqual(2, len(tree.subtree(1)) + len(tree.ancestors(1)))
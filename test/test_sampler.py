@@ -0,0 +1,70 @@
+import os
+import random
+import tempfile
+import unittest
+from scoobe import sampler
+from scoobe.common import StatusPrinter
+
+class FakeTarget:
+
+    def get_name(self):
+        return 'fake'
+
+    def get_cli_arg(self):
+        return 'fake'
+
+class MerchantPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.home = tempfile.TemporaryDirectory()
+        os.environ['SCOOBE_HOME'] = self.home.name
+
+        self.merchants = [ [db_id, 'MERCHANT{:05d}'.format(db_id)] for db_id in range(1, 101) ]
+        self.queries = []
+        self.refreshes = []
+
+        def get_eligible_merchants(target, printer=StatusPrinter()):
+            self.queries.append(target.get_name())
+            return list(self.merchants)
+
+        self.real = (sampler.get_eligible_merchants, sampler.start_background_refresh)
+        sampler.get_eligible_merchants = get_eligible_merchants
+        sampler.start_background_refresh = lambda target : self.refreshes.append(target.get_name()) or True
+
+    def tearDown(self):
+        sampler.get_eligible_merchants, sampler.start_background_refresh = self.real
+        del os.environ['SCOOBE_HOME']
+        self.home.cleanup()
+
+    def test_distinct_picks_from_one_query(self):
+        picks = sampler.sample_merchants(FakeTarget(), 10, rng=random.Random(1))
+        self.assertEqual(10, len(set(x.id for x in picks)))
+        picks = sampler.sample_merchants(FakeTarget(), 10, rng=random.Random(2))
+        self.assertEqual(['fake'], self.queries)
+        self.assertEqual([], self.refreshes)
+
+    def test_refresh_replaces_the_pool(self):
+        sampler.refresh_pool(FakeTarget())
+        self.merchants = self.merchants[50:] + [[150, 'MERCHANT00150']]
+        pool = sampler.refresh_pool(FakeTarget())
+        self.assertEqual(51, len(pool['merchants']))
+        self.assertNotIn([1, 'MERCHANT00001'], pool['merchants'])
+
+    def test_stale_pool_refreshes_in_background(self):
+        pool = sampler.refresh_pool(FakeTarget())
+        pool['refreshed'] -= sampler.pool_refresh_age + 1
+        sampler.merchant_pools.put('fake', pool)
+
+        sampler.sample_merchants(FakeTarget(), 1)
+        self.assertEqual(['fake'], self.refreshes)
+
+    def test_pool_with_other_criteria_is_rebuilt(self):
+        sampler.merchant_pools.put('fake', { 'built' : 0, 'refreshed' : 0, 'max_db_id' : 5,
+                                             'merchants' : [[5, 'OLDMERCHANT00']] })
+        picks = sampler.sample_merchants(FakeTarget(), 1)
+        self.assertEqual(['fake'], self.queries)
+        self.assertNotEqual('OLDMERCHANT00', picks[0].id)
+
+    def test_too_many(self):
+        with self.assertRaises(ValueError):
+            sampler.sample_merchants(FakeTarget(), 101)
@@ -0,0 +1,49 @@
+import re
+import random
+import unittest
+from types import SimpleNamespace
+from scoobe.seed import skewed_split, seed_plan, seed_devices, seed_merchant_devices
+
+class SeedPlanTest(unittest.TestCase):
+
+    def test_split_adds_up(self):
+        rng = random.Random(1)
+        counts = skewed_split(1000, 10, minimum=1, rng=rng)
+        self.assertEqual(1000, sum(counts))
+        self.assertTrue(all(x >= 1 for x in counts))
+
+        # the head of the distribution gets more than the tail
+        self.assertGreater(counts[0], counts[-1])
+
+    def test_split_too_small(self):
+        with self.assertRaises(ValueError):
+            skewed_split(3, 5, minimum=1)
+
+    def test_plan_shape(self):
+        plan = seed_plan(4, 40, 100, run_id='test', rng=random.Random(2))
+        self.assertEqual(4, len(plan))
+        self.assertEqual(40, sum(len(x.devices_per_merchant) for x in plan))
+        self.assertEqual(100, sum(sum(x.devices_per_merchant) for x in plan))
+        self.assertEqual(4, len(set(x.marker for x in plan)))
+        self.assertEqual('seed_test_0', plan[0].name)
+
+    def test_devices_look_real(self):
+        devices = seed_devices(50, rng=random.Random(3))
+        self.assertEqual(50, len(set(x['serial'] for x in devices)))
+        for device in devices:
+            self.assertTrue(re.match(r'C[A-Za-z0-9]{3}[UEL][CQNOPRD][0-9]{8}$', device['serial']))
+            self.assertEqual(32, len(device['cpuid']))
+
+    def test_merchants_never_share_serials(self):
+        merchants = [ (SimpleNamespace(id='M{:012d}'.format(x), reseller_db_id=x % 3), 50) for x in range(400) ]
+        devices, serial2reseller = seed_merchant_devices(merchants, rng=random.Random(4))
+
+        self.assertEqual(20000, len(devices))
+        self.assertEqual(20000, len(serial2reseller))
+        self.assertEqual(['M000000000000'] * 50, [ x['merchant'] for x in devices[:50] ])
+        self.assertEqual('M000000000399', devices[-1]['merchant'])
+
+    def test_same_seed_same_devices(self):
+        merchants = [ (SimpleNamespace(id='M', reseller_db_id=1), 5) ]
+        self.assertEqual(seed_merchant_devices(merchants, rng=random.Random(5)),
+                         seed_merchant_devices(merchants, rng=random.Random(5)))
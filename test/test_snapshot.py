@@ -0,0 +1,104 @@
+import os
+import gzip
+import json
+import decimal
+import datetime
+import tempfile
+import unittest
+from scoobe.cli import target_from_arg
+from scoobe.common import StatusPrinter
+from scoobe.mysql import Query, Feedback
+from scoobe.server import get_reseller, get_plan_group, get_plan_groups, get_merchant, get_partner_control_plan, \
+                          PartnerControl
+from scoobe.snapshot import Snapshot, build_db, _column_tag, _stored
+
+data = { 'source'    : 'stg1',
+         'taken'     : '2020-01-01T00:00:00',
+         'tables'    : { 'reseller'            : { 'columns' : ['id', 'uuid', 'name', 'parent_id'],
+                                                   'rows'    : [ [1, 'ROOTAAAAAAAAA', 'clover', None],
+                                                                 [2, 'CHILDAAAAAAAA', 'child', 1] ] },
+                         'merchant_plan_group' : { 'columns' : ['id', 'uuid', 'name', 'enforce_assignment',
+                                                                'trial_days'],
+                                                   'rows'    : [ [7, 'GROUPAAAAAAAA', 'group', 1, 30] ] } },
+         'endpoints' : { 'v3/resellers/CHILDAAAAAAAA'  : { 'id' : 'CHILDAAAAAAAA', 'name' : 'child',
+                                                           'supportPhone' : '555' },
+                         'v3/merchant_plan_groups'     : { 'elements' : [ { 'id' : 'GROUPAAAAAAAA' } ] },
+                         'v3/partner_controls/CONTROLAAAAAA?expand=plan' : { 'id'   : 'CONTROLAAAAAA',
+                                                                             'plan' : { 'id' : 'PLANAAAAAAAAA' } } } }
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'stg1.snapshot.json.gz')
+        with gzip.open(self.path, 'wt') as snapshot_file:
+            json.dump(data, snapshot_file)
+        self.target = target_from_arg(self.path)
+        self.printer = StatusPrinter(file=open(os.devnull, 'w'))
+
+    def tearDown(self):
+        self.printer.file.close()
+        self.dir.cleanup()
+
+    def test_is_a_target(self):
+        self.assertIsInstance(self.target, Snapshot)
+        self.assertEqual(self.path, self.target.get_cli_arg())
+
+    def test_queries(self):
+        row = Query(self.target, 'metaRO', 'test321', "SELECT uuid FROM reseller WHERE id = '2';").execute(
+                Feedback.OneRow, printer=self.printer)
+        self.assertEqual({ 'uuid' : 'CHILDAAAAAAAA' }, row)
+
+        plan_group = get_plan_group('GROUPAAAAAAAA', self.target, printer=self.printer)
+        self.assertEqual(7, plan_group.db_id)
+        self.assertEqual(30, plan_group.trial_days)
+
+    def test_endpoints(self):
+        reseller = get_reseller('2', self.target, printer=self.printer)
+        self.assertEqual('CHILDAAAAAAAA', reseller.id)
+        self.assertEqual('555', reseller.supportPhone)
+        self.assertEqual([ { 'id' : 'GROUPAAAAAAAA' } ], get_plan_groups(self.target, printer=self.printer)['elements'])
+
+    def test_read_only(self):
+        with self.assertRaises(Exception):
+            Query(self.target, 'metaRW', 'test789', "DELETE FROM reseller;").execute(
+                    Feedback.ChangeCount, printer=self.printer)
+
+    def test_missing_endpoint(self):
+        with self.assertRaises(ValueError):
+            get_reseller('1', self.target, printer=self.printer)
+
+    def test_partner_control_plan(self):
+        partner_control = PartnerControl({ 'db_id' : 5, 'id' : 'CONTROLAAAAAA' })
+        self.assertEqual({ 'id' : 'PLANAAAAAAAAA' },
+                         get_partner_control_plan(partner_control, self.target, printer=self.printer))
+
+    def test_missing_table(self):
+        with self.assertRaises(ValueError) as raised:
+            get_merchant('MERCHANTAAAAA', self.target, printer=self.printer)
+        self.assertIn("merchant isn't in the snapshot of stg1", str(raised.exception))
+
+class ColumnTypeTest(unittest.TestCase):
+
+    # what MySQLdb would hand over
+    row = { 'id'       : 1,
+            'created'  : datetime.datetime(2020, 1, 2, 3, 4, 5),
+            'day'      : datetime.date(2020, 1, 2),
+            'fee'      : decimal.Decimal('1.50'),
+            'duration' : datetime.timedelta(hours=1),
+            'blob'     : b'\x00\x01',
+            'name'     : 'x' }
+
+    def test_values_come_back_as_they_were(self):
+        columns = list(self.row)
+        tags = { x : _column_tag([None, self.row[x]]) for x in columns }
+        db = build_db({ 'thing' : { 'columns' : columns,
+                                    'rows'    : [ [ _stored(self.row[x], tags[x]) for x in columns ],
+                                                  [ 2 ] + [ None ] * (len(columns) - 1) ],
+                                    'types'   : { x : tag for x, tag in tags.items() if tag is not None } } })
+
+        self.assertEqual('date', tags['day'])
+        self.assertEqual(self.row, db.execute('SELECT * FROM thing WHERE id = 1').fetchone())
+        self.assertEqual({ 'at' : self.row['created'] },
+                         db.execute('SELECT created AS at FROM thing WHERE id = 1').fetchone())
+        self.assertIsNone(db.execute('SELECT fee FROM thing WHERE id = 2').fetchone()['fee'])
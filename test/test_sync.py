@@ -0,0 +1,84 @@
+import unittest
+from scoobe.sync import plan_sync, resolve, apply_sync, diff_snapshots, field_changes
+
+def snapshot(group_id, plan_id, plan_description, bundle_id):
+    return { 'plan_groups'         : [ { 'id' : group_id, 'name' : 'Group', 'trialDays' : 30,
+                                         'href' : 'https://somewhere/' + group_id } ],
+             'plans'               : [ { 'id' : plan_id, 'name' : 'Plan', 'description' : plan_description,
+                                         'merchantPlanGroup' : { 'id' : group_id },
+                                         'appBundle' : { 'id' : bundle_id } } ],
+             'partner_controls'    : [],
+             'event_subscriptions' : [],
+             'app_bundles'         : { bundle_id : 'Bundle' } }
+
+class SyncPlanTest(unittest.TestCase):
+
+    def test_same_content_different_uuids(self):
+        source = snapshot('SRCGROUP00001', 'SRCPLAN000001', 'a plan', 'SRCBUNDLE0001')
+        dest = snapshot('DSTGROUP00001', 'DSTPLAN000001', 'a plan', 'DSTBUNDLE0001')
+        self.assertEqual([], plan_sync(source, dest))
+
+    def test_update(self):
+        source = snapshot('SRCGROUP00001', 'SRCPLAN000001', 'a better plan', 'SRCBUNDLE0001')
+        dest = snapshot('DSTGROUP00001', 'DSTPLAN000001', 'a plan', 'DSTBUNDLE0001')
+        steps = plan_sync(source, dest)
+        self.assertEqual(1, len(steps))
+        self.assertEqual('update', steps[0]['action'])
+        self.assertEqual('DSTPLAN000001', steps[0]['dest_id'])
+        self.assertEqual(['description'], steps[0]['fields'])
+
+    def test_create_in_dependency_order(self):
+        source = snapshot('SRCGROUP00001', 'SRCPLAN000001', 'a plan', 'SRCBUNDLE0001')
+        dest = { 'plan_groups' : [], 'plans' : [], 'partner_controls' : [], 'event_subscriptions' : [],
+                 'app_bundles' : { 'DSTBUNDLE0001' : 'Bundle' } }
+        steps = plan_sync(source, dest)
+        self.assertEqual(['plan_groups', 'plans'], [ x['kind'] for x in steps ])
+
+        # the new group's uuid is only known once it has been created
+        created = []
+        def create(body, target, printer=None):
+            created.append(body)
+            return { 'id' : 'NEWGROUP00001' }
+
+        from scoobe import sync
+        real_kinds = sync.kinds
+        sync.kinds = [ kind._replace(create=create) for kind in real_kinds ]
+        try:
+            results = apply_sync(steps, None, dest)
+        finally:
+            sync.kinds = real_kinds
+
+        self.assertTrue(all(x['ok'] for x in results))
+        self.assertEqual({ 'id' : 'NEWGROUP00001' }, created[1]['merchantPlanGroup'])
+        self.assertEqual({ 'id' : 'DSTBUNDLE0001' }, created[1]['appBundle'])
+
+    def test_unnamed_references_need_a_map(self):
+        body = { 'appBundle' : { 'id' : 'SRCBUNDLE0001' } }
+        with self.assertRaises(ValueError):
+            resolve(body, { 'plan_groups' : {}, 'app_bundles' : {} })
+        resolved = resolve(body, { 'plan_groups' : {}, 'app_bundles' : {} }, { 'SRCBUNDLE0001' : 'DSTBUNDLE0001' })
+        self.assertEqual({ 'id' : 'DSTBUNDLE0001' }, resolved['appBundle'])
+
+class DiffTest(unittest.TestCase):
+
+    def test_identical_content_is_not_a_difference(self):
+        left = snapshot('SRCGROUP00001', 'SRCPLAN000001', 'a plan', 'SRCBUNDLE0001')
+        right = snapshot('DSTGROUP00001', 'DSTPLAN000001', 'a plan', 'DSTBUNDLE0001')
+        self.assertEqual([], diff_snapshots(left, right))
+
+    def test_changes_additions_and_removals(self):
+        left = snapshot('SRCGROUP00001', 'SRCPLAN000001', 'a plan', 'SRCBUNDLE0001')
+        right = snapshot('DSTGROUP00001', 'DSTPLAN000001', 'another plan', 'DSTBUNDLE0001')
+        left['event_subscriptions'].append({ 'id' : 'SUB0000000001', 'name' : 'gone', 'parameters' : {} })
+        right['partner_controls'].append({ 'id' : 'PC00000000001', 'name' : 'new', 'enabled' : True })
+
+        differences = { (x['kind'], x['change']) : x for x in diff_snapshots(left, right) }
+        self.assertEqual(3, len(differences))
+        self.assertEqual({ 'description' : ('a plan', 'another plan') }, differences[('plans', 'changed')]['fields'])
+        self.assertEqual('gone', differences[('event_subscriptions', 'removed')]['key'])
+        self.assertEqual('new', differences[('partner_controls', 'added')]['key'])
+
+    def test_nested_fields(self):
+        self.assertEqual({ 'criteria.Bank' : (1, 2), 'name' : ('a', None) },
+                         dict(field_changes({ 'criteria' : { 'Bank' : 1 }, 'name' : 'a' },
+                                            { 'criteria' : { 'Bank' : 2 } })))
@@ -0,0 +1,87 @@
+import json
+import time
+import unittest
+from scoobe import trace
+from scoobe.common import QuietPrinter, Indent
+
+# stands in for an sh command
+class FakeCommand:
+
+    def __init__(self, args=[]):
+        self.args = args
+        self.calls = []
+
+    def __call__(self, *args, **kwargs):
+        self.calls.append(self.args + list(args))
+        return 'ok'
+
+    def bake(self, *args):
+        return FakeCommand(self.args + list(args))
+
+    def __getattr__(self, name):
+        return self.bake(name)
+
+    def __str__(self):
+        return '/usr/bin/adb'
+
+class TraceTest(unittest.TestCase):
+
+    def setUp(self):
+        trace.tracer = trace.Tracer()
+
+    def tearDown(self):
+        trace.tracer = None
+
+    def test_indents_are_named_after_the_last_message(self):
+        printer = QuietPrinter()
+        printer("Finding merchant")
+        with Indent(printer):
+            printer("[Query]\nSELECT 1")
+            with Indent(printer):
+                pass
+
+        spans = trace.tracer.spans
+        self.assertEqual(['Finding merchant', '[Query]'], [ x.name for x in spans ])
+        self.assertEqual('Finding merchant;[Query]', spans[1].stack())
+        self.assertTrue(all(x.end is not None for x in spans))
+
+    def test_errors_are_recorded(self):
+        with self.assertRaises(ValueError):
+            with trace.span('outer'):
+                raise ValueError()
+        self.assertEqual('ValueError', trace.tracer.spans[0].attrs['error'])
+
+    def test_collapsed_counts_own_time(self):
+        with trace.span('outer'):
+            time.sleep(0.02)
+            with trace.span('inner'):
+                time.sleep(0.02)
+
+        lines = dict(x.rsplit(' ', 1) for x in trace.tracer.collapsed().splitlines())
+        self.assertEqual({'outer', 'outer;inner'}, set(lines))
+        self.assertLess(int(lines['outer']), 35000)
+        self.assertGreaterEqual(int(lines['outer;inner']), 15000)
+
+    def test_chrome(self):
+        with trace.span('GET /v3/merchants', 'http', status=200):
+            pass
+        events = json.loads(json.dumps(trace.tracer.chrome()))['traceEvents']
+        self.assertEqual(1, len(events))
+        self.assertEqual(('X', 'http', {'status' : '200'}), (events[0]['ph'], events[0]['cat'], events[0]['args']))
+
+    def test_traced_command(self):
+        command = FakeCommand()
+        adb = trace.TracedCommand(command, 'adb')
+        self.assertEqual('ok', adb.shell(['getprop', 'ro.serialno']))
+        self.assertEqual('ok', adb.bake('-s', 'C030UQ00000001')('get-serialno'))
+
+        self.assertEqual(['adb shell getprop ro.serialno', 'adb -s C030UQ00000001 get-serialno'],
+                         [ x.name for x in trace.tracer.spans ])
+
+    def test_off_by_default(self):
+        trace.tracer = None
+        with trace.span('nothing') as span:
+            self.assertIsNone(span)
+        printer = QuietPrinter()
+        with Indent(printer):
+            pass
@@ -0,0 +1,96 @@
+import unittest
+from scoobe.ui import Snapshot, Mode, wait_for
+
+dump = """<?xml version='1.0' encoding='UTF-8' standalone='yes' ?><hierarchy rotation="0">
+<node index="0" text="" resource-id="" class="android.widget.FrameLayout" content-desc="" clickable="false" bounds="[0,0][1280,800]">
+  <node index="0" text="Pick Language" resource-id="com.clover.setupwizard:id/title" class="android.widget.TextView" content-desc="" clickable="false" bounds="[0,0][640,100]" />
+  <node index="1" text="Next" resource-id="com.clover.setupwizard:id/next" class="android.widget.Button" content-desc="" clickable="true" bounds="[1000,700][1280,800]" />
+  <node index="2" text="" resource-id="" class="android.widget.ImageView" content-desc="Successfully connected" clickable="false" bounds="[0,100][64,164]" />
+</node>
+</hierarchy>UI hierchary dumped to: /dev/tty
+"""
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.snap = Snapshot(dump)
+
+    def test_index(self):
+        self.assertEqual(len(self.snap.nodes), 4)
+        next_button = self.snap.find_text('Next')[0]
+        self.assertTrue(next_button.clickable)
+        self.assertEqual(next_button.bounds, (1000, 700, 1280, 800))
+        self.assertEqual(self.snap.find_resource_id('com.clover.setupwizard:id/title')[0].text, 'Pick Language')
+
+    def test_regex_and_content_desc(self):
+        self.assertTrue(self.snap.has_text('Pick.*'))
+        self.assertTrue(self.snap.has_text('Successfully connected'))
+        self.assertFalse(self.snap.has_text('Activate'))
+
+    def test_modes(self):
+        self.assertTrue(Mode.any(self.snap, ['Activate', 'Next']))
+        self.assertFalse(Mode.all(self.snap, ['Activate', 'Next']))
+        self.assertTrue(Mode.absent(self.snap, ['Activate', 'Welcome']))
+
+    def test_wait_for_one_dump_per_poll(self):
+        dumps = []
+        def fake_dump():
+            dumps.append(1)
+            return dump if len(dumps) >= 3 else dump.replace('Next', 'Loading')
+
+        snap = wait_for(['Next'], dump=fake_dump, min_interval=0, max_interval=0)
+        self.assertIsNotNone(snap)
+        self.assertEqual(len(dumps), 3)
+
+    def test_wait_for_keeps_polling_through_bad_dumps(self):
+        dumps = ['', 'ERROR: could not get idle state.', dump[:200], dump]
+        snap = wait_for(['Next'], dump=lambda : dumps.pop(0), min_interval=0, max_interval=0)
+        self.assertIsNotNone(snap)
+        self.assertEqual([], dumps)
+
+    def test_wait_for_timeout(self):
+        self.assertIsNone(wait_for(['Activate'], timeout=0.05, min_interval=0.01, dump=lambda : dump))
+
+class FakeDevice:
+
+    class Selector:
+        def __init__(self, device, kwargs):
+            self.device = device
+            self.kwargs = kwargs
+        def click(self):
+            self.device.log.append(('click', self.kwargs))
+        def set_text(self, text):
+            self.device.log.append(('set_text', self.kwargs, text))
+
+    class Screen:
+        def on(self):
+            pass
+
+    def __init__(self):
+        self.log = []
+        self.screen = FakeDevice.Screen()
+
+    def __call__(self, **kwargs):
+        return FakeDevice.Selector(self, kwargs)
+
+    def dump(self):
+        self.log.append(('dump',))
+        return dump
+
+class ScriptRunnerTest(unittest.TestCase):
+
+    def test_one_session_for_all_steps(self):
+        from scoobe.ui import ScriptRunner
+        from scoobe.common import QuietPrinter
+
+        device = FakeDevice()
+        records = ScriptRunner(device, printer=QuietPrinter()).run([
+                    { 'wait' : 'Pick Language' },
+                    { 'press' : 'Next' },
+                    { 'type' : 'hello', 'into' : 'com.clover.setupwizard:id/title' },
+                    { 'wait' : 'Activate', 'timeout' : 0 },
+                    { 'press' : 'never reached' } ])
+
+        self.assertEqual([ r['ok'] for r in records ], [True, True, True, False])
+        self.assertIn(('click', {'text' : 'Next'}), device.log)
+        self.assertIn(('set_text', {'resourceId' : 'com.clover.setupwizard:id/title'}, 'hello'), device.log)
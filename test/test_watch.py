@@ -0,0 +1,102 @@
+import re
+import sqlite3
+import unittest
+from scoobe.mysql import Feedback
+from scoobe.watch import TableWatcher, filter_condition, watched_tables, get_merchant_ids
+
+# answers a Session's queries from sqlite (enough for the ones TableWatcher makes)
+class FakeSession:
+
+    def __init__(self):
+        self.db = sqlite3.connect(':memory:')
+        self.queries = []
+        self.db.row_factory = lambda cursor, row : { c[0] : v for c, v in zip(cursor.description, row) }
+
+    def execute(self, sql, feedback, rowtransform=lambda x : x, params=()):
+        self.queries.append(sql)
+        show = re.match(r"SHOW COLUMNS FROM (\w+) LIKE '(\w+)';", sql)
+        if show:
+            table, column = show.groups()
+            rows = [ x for x in self.db.execute('PRAGMA table_info({})'.format(table)) if x['name'] == column ]
+        else:
+            rows = self.db.execute(sql.replace('%s', '?'), params).fetchall()
+        rows = [ rowtransform(x) for x in rows ]
+        if feedback == Feedback.OneRow:
+            return rows[0] if rows else None
+        return rows
+
+class TableWatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.session = FakeSession()
+        self.session.db.execute("CREATE TABLE device_provision (id INTEGER, serial_number TEXT, merchant_id INTEGER, "
+                                "modified_time TEXT)")
+        self.session.db.execute("CREATE TABLE setting (id INTEGER, merchant_id INTEGER, value TEXT)")
+        self.session.db.execute("INSERT INTO device_provision VALUES (1, 'C030UQ00000001', 7, '2020-01-01 00:00:00')")
+        self.session.db.execute("INSERT INTO setting VALUES (1, 7, 'a')")
+
+    def test_only_changes_after_the_baseline(self):
+        watcher = TableWatcher('device_provision', self.session)
+        self.assertEqual([], watcher.poll())
+
+        self.session.db.execute("INSERT INTO device_provision VALUES (2, 'C030UQ00000002', 7, '2020-01-01 00:00:00')")
+        events = watcher.poll()
+        self.assertEqual([('insert', 2)], [ (x['change'], x['row']['id']) for x in events ])
+        self.assertEqual([], watcher.poll())
+
+    def test_updates_at_the_same_time_are_seen(self):
+        watcher = TableWatcher('device_provision', self.session)
+
+        # same second as the baseline, only the contents tell it apart
+        self.session.db.execute("UPDATE device_provision SET merchant_id = 8 WHERE id = 1")
+        events = watcher.poll()
+        self.assertEqual([('update', 1, 8)], [ (x['change'], x['row']['id'], x['row']['merchant_id']) for x in events ])
+        self.assertEqual([], watcher.poll())
+
+        self.session.db.execute("UPDATE device_provision SET merchant_id = 9, modified_time = '2020-01-01 00:00:05' "
+                                "WHERE id = 1")
+        self.assertEqual([9], [ x['row']['merchant_id'] for x in watcher.poll() ])
+        self.assertEqual([], watcher.poll())
+
+    def test_untimed_tables_follow_ids(self):
+        watcher = TableWatcher('setting', self.session)
+        self.assertFalse(watcher.timed)
+
+        self.session.db.execute("INSERT INTO setting VALUES (2, 7, 'b')")
+        self.assertEqual([2], [ x['row']['id'] for x in watcher.poll() ])
+
+    def test_filters(self):
+        device_provision, merchant, setting = watched_tables
+        self.assertEqual(("AND (serial_number IN (%s) OR merchant_id IN (%s))", ['C030UQ00000001', 7]),
+                         filter_condition(device_provision, ['C030UQ00000001'], [7]))
+        self.assertIsNone(filter_condition(setting, ['C030UQ00000001'], []))
+
+        watcher = TableWatcher('device_provision', self.session, *filter_condition(device_provision, [], [8]))
+        self.session.db.execute("INSERT INTO device_provision VALUES (2, 'C030UQ00000002', 7, '2020-01-02 00:00:00')")
+        self.session.db.execute("INSERT INTO device_provision VALUES (3, 'C030UQ00000003', 8, '2020-01-02 00:00:00')")
+        self.assertEqual([3], [ x['row']['id'] for x in watcher.poll() ])
+
+    def test_polls_use_one_column_each(self):
+        watcher = TableWatcher('device_provision', self.session)
+        self.session.queries = []
+
+        # a new row at a new time matches both queries, but is only one event
+        self.session.db.execute("INSERT INTO device_provision VALUES (2, 'C030UQ00000002', 7, '2020-01-02 00:00:00')")
+        self.assertEqual([('insert', 2)], [ (x['change'], x['row']['id']) for x in watcher.poll() ])
+
+        self.assertEqual(2, len(self.session.queries))
+        for sql in self.session.queries:
+            self.assertNotIn(' OR ', sql)
+            self.assertNotIn("'", sql)
+
+    def test_merchant_uuids_and_ids(self):
+        self.session.db.execute("CREATE TABLE merchant (id INTEGER, uuid TEXT)")
+        self.session.db.execute("INSERT INTO merchant VALUES (0, 'ZEROAAAAAAAAA')")
+        self.session.db.execute("INSERT INTO merchant VALUES (7, 'SEVENAAAAAAAA')")
+        self.session.db.execute("INSERT INTO merchant VALUES (8, 'EIGHTAAAAAAAA')")
+
+        # a uuid never matches an id (mysql would compare it to id as 0)
+        self.assertEqual([7, 8], sorted(get_merchant_ids(['SEVENAAAAAAAA', '8'], self.session)))
+        self.assertEqual([], get_merchant_ids(['NOSUCHAAAAAAA'], self.session))
+        for sql in self.session.queries:
+            self.assertNotIn("'", sql)